@@ -0,0 +1,122 @@
+# cogs/anagrafe.py
+from __future__ import annotations
+from typing import Awaitable, Callable, List
+
+import discord
+from discord.ext import commands
+from discord import app_commands
+
+from utils.checks import staff_only
+from utils.profili import (
+    abackfill_ibans, afind_by_document, afind_by_faction, afind_by_iban, afind_by_job, afind_by_plate,
+    aget_profile, aindex_values, mask_iban,
+)
+
+MAX_RESULTS = 25
+# campi mostrati per ogni risultato (lettura proiettata, niente documento intero)
+RESULT_FIELDS = ("nome_rp", "cognome_rp", "bank.iban", "lavoro")
+
+
+async def _result_embed(guild: discord.Guild | None, title: str, user_ids: List[int]) -> discord.Embed:
+    if not user_ids:
+        return discord.Embed(title=title, description="Nessun profilo trovato.", color=discord.Color.dark_grey())
+    lines = []
+    for uid in user_ids[:MAX_RESULTS]:
+        prof = await aget_profile(uid, fields=RESULT_FIELDS)
+        nome = f"{prof.get('nome_rp') or ''} {prof.get('cognome_rp') or ''}".strip() or "—"
+        assente = "" if guild is None or guild.get_member(uid) else " *(non nel server)*"
+        lines.append(f"• <@{uid}> — **{nome}** · IBAN `{mask_iban(prof['bank'].get('iban'))}`{assente}")
+    if len(user_ids) > MAX_RESULTS:
+        lines.append(f"… e altri {len(user_ids) - MAX_RESULTS}.")
+    emb = discord.Embed(title=title, description="\n".join(lines), color=discord.Color.blurple())
+    emb.set_footer(text=f"VeneziaRP | Anagrafe • {len(user_ids)} risultati")
+    return emb
+
+
+async def _index_choices(index: str, current: str) -> List[app_commands.Choice[str]]:
+    cur = current.casefold()
+    values = await aindex_values(index)
+    return [
+        app_commands.Choice(name=f"{v} ({n})"[:100], value=v[:100])
+        for v, n in sorted(values.items(), key=lambda kv: -kv[1])
+        if cur in v
+    ][:25]
+
+
+class Anagrafe(commands.Cog):
+    """Ricerche inverse sui profili (staff): chi possiede un IBAN, un documento, una targa..."""
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    async def _reply(self, itx: discord.Interaction, title: str, find: Callable[[str], Awaitable], value: str):
+        # la prima ricerca dopo l'avvio costruisce gli indici: meglio non rischiare i 3 secondi
+        await itx.response.defer(ephemeral=True, thinking=True)
+        found = await find(value)
+        ids = [found] if isinstance(found, int) else list(found or [])
+        emb = await _result_embed(itx.guild, title, ids)
+        await itx.followup.send(embed=emb, ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
+
+    @app_commands.command(name="cerca_iban", description="Trova il titolare di un IBAN (staff).")
+    @app_commands.describe(iban="IBAN completo (gli spazi vengono ignorati)")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def cerca_iban(self, itx: discord.Interaction, iban: str):
+        await self._reply(itx, f"🏦 IBAN {iban.strip()}", afind_by_iban, iban)
+
+    @app_commands.command(name="iban_rilascia", description="Assegna un IBAN a tutti i profili che non ce l'hanno (staff).")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def iban_rilascia(self, itx: discord.Interaction):
+        await itx.response.defer(ephemeral=True, thinking=True)
+        # una passata sullo store, un commit per tutti i nuovi IBAN
+        res = await abackfill_ibans()
+        lines = [
+            f"✅ IBAN rilasciati: **{res['issued']}**",
+            f"🏦 IBAN già presenti: {res['existing']}" + (f" (di cui non validi: {res['invalid']})" if res["invalid"] else ""),
+        ]
+        if res["collisions"]:
+            lines.append(f"⚠️ IBAN condivisi da più profili: **{len(res['collisions'])}**")
+            for iban, uids in list(res["collisions"].items())[:10]:
+                lines.append(f"• `{mask_iban(iban)}` → " + ", ".join(f"<@{u}>" for u in uids))
+        await itx.followup.send("\n".join(lines), ephemeral=True, allowed_mentions=discord.AllowedMentions.none())
+
+    @app_commands.command(name="cerca_documento", description="Trova il titolare di una carta d'identità o di un documento (staff).")
+    @app_commands.describe(numero="Numero della carta d'identità, patente, porto d'armi, cittadinanza…")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def cerca_documento(self, itx: discord.Interaction, numero: str):
+        await self._reply(itx, f"🪪 Documento {numero.strip()}", afind_by_document, numero)
+
+    @app_commands.command(name="cerca_targa", description="Trova il proprietario di un veicolo dalla targa (staff).")
+    @app_commands.describe(targa="Targa del veicolo (es. AB123CD)")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def cerca_targa(self, itx: discord.Interaction, targa: str):
+        await self._reply(itx, f"🚗 Targa {targa.strip().upper()}", afind_by_plate, targa)
+
+    @app_commands.command(name="cerca_fazione", description="Elenca i membri di una fazione (staff).")
+    @app_commands.describe(fazione="Nome della fazione")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def cerca_fazione(self, itx: discord.Interaction, fazione: str):
+        await self._reply(itx, f"🛡️ Fazione: {fazione}", afind_by_faction, fazione)
+
+    @cerca_fazione.autocomplete("fazione")
+    async def _fazione_autocomplete(self, itx: discord.Interaction, current: str):
+        return await _index_choices("fazione", current)
+
+    @app_commands.command(name="cerca_lavoro", description="Elenca chi svolge un lavoro (staff).")
+    @app_commands.describe(lavoro="Nome del lavoro")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def cerca_lavoro(self, itx: discord.Interaction, lavoro: str):
+        await self._reply(itx, f"💼 Lavoro: {lavoro}", afind_by_job, lavoro)
+
+    @cerca_lavoro.autocomplete("lavoro")
+    async def _lavoro_autocomplete(self, itx: discord.Interaction, current: str):
+        return await _index_choices("lavoro", current)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Anagrafe(bot))
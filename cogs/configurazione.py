@@ -0,0 +1,33 @@
+# cogs/configurazione.py
+from __future__ import annotations
+
+import discord
+from discord import app_commands
+from discord.ext import commands
+
+from utils import config_registry
+from utils.checks import staff_only
+
+
+class Configurazione(commands.Cog):
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    @app_commands.command(name="config_reload", description="Rilegge subito i file di configurazione (ruoli, canali, economia).")
+    async def config_reload(self, itx: discord.Interaction):
+        await itx.response.defer(ephemeral=True, thinking=True)
+        results = await config_registry.areload()
+        lines = []
+        for name, err in results.items():
+            snap = await config_registry.aget(name)
+            if err:
+                lines.append(f"❌ {name}: {err}\n   (resta in uso la versione caricata <t:{int(snap.loaded_at)}:R>)")
+            else:
+                lines.append(f"✅ {name}: {len(snap.data)} chiavi")
+        await itx.followup.send("\n".join(lines) or "ℹ️ Nessun file registrato.", ephemeral=True)
+
+
+async def setup(bot: commands.Bot):
+    await bot.add_cog(Configurazione(bot))
@@ -1,156 +1,238 @@
 # cogs/economy_auto.py
 from __future__ import annotations
 import asyncio
-import json
-from pathlib import Path
-from typing import Dict, Any, Tuple
+import io
+import logging
+import time
+from typing import Dict, Any, List
 from datetime import datetime, timezone
 
 import discord
 from discord.ext import commands
 
-from utils.profili import get_profile, set_profile, money_fmt
-
-CONFIG_FILE = Path("data/economy_config.json")
-CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
-
-DEFAULT_CONFIG = {
-    "salary_per_cycle": {},             # { "ROLE_ID": amount, ... }
-    "payroll_log_channel_id": 1409251318153089044,  # canale log
-    "delete_logs_after_seconds": 120    # auto-delete dopo 2 minuti
+from utils import economy_config, outbound, payroll
+from utils.async_io import run_io
+from utils.ledger import from_cents
+from utils.economy_config import EconomyConfig
+from utils.payroll import SalaryIndex, arun_payroll, plan_guild, write_csv
+from utils.profili import money_fmt
+from utils.scheduler import Daily, Monthly, get_scheduler
+
+
+async def _load_config() -> EconomyConfig:
+    """Config compilata per il payroll; errore se il file non è mai stato valido (meglio non pagare che pagare zero)."""
+    cfg = await economy_config.acurrent()
+    if cfg is None:
+        raise RuntimeError(f"Config economia non valida: {economy_config.error()}")
+    return cfg
+
+PAYROLL_JOB = "payroll"
+# payroll_mode della config -> calendario (00:00 UTC); i due modi hanno id di ciclo diversi
+# ("2026-10" / "2026-10-18"), quindi stato dello scheduler separato
+PAYROLL_SCHEDULES = {
+    "monthly": (PAYROLL_JOB, Monthly(day=1)),
+    "daily": (f"{PAYROLL_JOB}_daily", Daily()),
 }
 
-def load_config() -> Dict[str, Any]:
-    if CONFIG_FILE.exists():
-        try:
-            cfg = json.loads(CONFIG_FILE.read_text(encoding="utf-8"))
-            for k, v in DEFAULT_CONFIG.items():
-                cfg.setdefault(k, v)
-            return cfg
-        except Exception:
-            pass
-    CONFIG_FILE.write_text(json.dumps(DEFAULT_CONFIG, ensure_ascii=False, indent=2), encoding="utf-8")
-    return DEFAULT_CONFIG.copy()
-
-def pick_salary_for_member(member: discord.Member, salary_map: Dict[str, Any]) -> Tuple[int, int | None]:
-    """Ritorna (stipendio, role_id) scegliendo la quota PIÙ ALTA tra i ruoli posseduti."""
-    best_amount = 0
-    best_role_id = None
-    member_role_ids = {r.id for r in member.roles}
-    for k, v in salary_map.items():
-        try:
-            rid = int(k)
-            amount = int(v)
-        except Exception:
-            continue
-        if rid in member_role_ids and amount > best_amount:
-            best_amount = amount
-            best_role_id = rid
-    return best_amount, best_role_id
+def _payroll_key(guild_id: int, cycle: str) -> str:
+    # stessa chiave per scheduler e /payroll_now: un ciclo si paga una volta sola, da chiunque parta
+    return f"payroll:{guild_id}:{cycle}"
 
 class EconomyAuto(commands.Cog):
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        self._worker_task: asyncio.Task | None = None
-        self._stop = asyncio.Event()
-        self._last_run_date: datetime.date | None = None
+        self._register_task: asyncio.Task | None = None
+        self._job, self._schedule = PAYROLL_SCHEDULES["monthly"]
 
     async def cog_load(self):
-        self._stop.clear()
-        self._worker_task = asyncio.create_task(self._worker())
+        self._register_task = asyncio.create_task(self._register_jobs())
 
     async def cog_unload(self):
-        self._stop.set()
-        if self._worker_task:
-            self._worker_task.cancel()
-            try:
-                await self._worker_task
-            except Exception:
-                pass
-
-    # ------------- Worker loop (mensile) -------------
-    async def _worker(self):
+        if self._register_task:
+            self._register_task.cancel()
+        sched = get_scheduler()
+        sched.remove_job(self._job)
+        if not sched.jobs:
+            await sched.stop()
+
+    # ------------- Scheduler (persistente) -------------
+    async def _register_jobs(self):
+        # le gilde (e i loro membri) servono per sapere chi pagare: si aspetta il ready
         await self.bot.wait_until_ready()
-        while not self._stop.is_set():
-            now = datetime.now(timezone.utc)
-            # se è il primo del mese e non abbiamo ancora pagato oggi
-            if now.day == 1 and (self._last_run_date != now.date()):
-                try:
-                    cfg = load_config()
-                    await self._run_payroll(cfg)
-                    self._last_run_date = now.date()
-                except Exception:
-                    pass
-            try:
-                # ricontrolla tra 1 ora
-                await asyncio.wait_for(self._stop.wait(), timeout=3600)
-            except asyncio.TimeoutError:
-                continue
+        # il calendario si legge qui: un cambio di payroll_mode vale dal prossimo avvio (o reload del cog)
+        cfg = await economy_config.acurrent()
+        self._job, self._schedule = PAYROLL_SCHEDULES[cfg.payroll_mode if cfg else "monthly"]
+        get_scheduler().add_job(self._job, self._schedule, self._payroll_job, lambda: [g.id for g in self.bot.guilds])
+
+    async def _payroll_job(self, cycle: str, guild_id: int) -> Dict[str, Any]:
+        """Un ciclo dello scheduler: stipendi di `cycle` (es. "2026-10") per una gilda."""
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            raise RuntimeError(f"Gilda {guild_id} non disponibile")
+        cfg = await _load_config()
+        index = cfg.salary
+        # chiave = ciclo: anche se lo stato dello scheduler non fosse stato salvato, il checkpoint
+        # e il ledger non ripagano
+        run = await self._pay_guild(guild, index, cfg, key=_payroll_key(guild_id, cycle)) if index else None
+        if run is None:
+            return {"paid": 0, "total": 0}
+        return {"paid": run["paid"], "scanned": run["scanned"], "total": run["total"]}
 
     # ------------- Core payroll -------------
-    async def _run_payroll(self, cfg: Dict[str, Any]):
+    async def _run_payroll(self, cfg: EconomyConfig) -> List[Dict[str, Any]]:
         if not self.bot.guilds:
-            return
-
-        salary_map: Dict[str, Any] = cfg.get("salary_per_cycle") or {}
-        if not salary_map:
-            return
+            return []
 
-        log_channel_id = int(cfg.get("payroll_log_channel_id") or 0)
-        delete_after = int(cfg.get("delete_logs_after_seconds") or 120)
+        # tabella stipendi già compilata al caricamento della config: {role_id: centesimi}
+        index = cfg.salary
+        if not index:
+            return []
 
+        # il ciclo in corso del calendario: se lo scheduler lo ha già pagato (o lo sta pagando) non si ripaga
+        cycle = self._schedule.cycle_at(datetime.now(timezone.utc))
+        runs = []
         for guild in self.bot.guilds:
-            log_ch = guild.get_channel(log_channel_id) if log_channel_id else None
-
-            paid_count = 0
-            total_paid = 0
-
-            for member in guild.members:
-                if member.bot:
-                    continue
-                amount, role_id = pick_salary_for_member(member, salary_map)
-                if amount <= 0 or role_id is None:
-                    continue
-
-                # Accredito su BANCA
-                prof = get_profile(member.id)
-                bank = dict(prof.get("bank") or {})
-                try:
-                    saldo_attuale = float(bank.get("saldo") or 0)
-                except Exception:
-                    saldo_attuale = 0.0
-                nuovo_saldo = saldo_attuale + float(amount)
-                bank["saldo"] = nuovo_saldo
-                set_profile(member.id, bank=bank)
-
-                paid_count += 1
-                total_paid += int(amount)
-
-            # Log (con auto-delete dopo 2 minuti)
-            if isinstance(log_ch, discord.TextChannel):
-                try:
-                    msg = await log_ch.send(
-                        f"💰 **Stipendi mensili eseguiti** in **{guild.name}** — "
-                        f"pagati **{paid_count}** utenti • Totale {money_fmt(total_paid)}."
-                    )
-                    asyncio.create_task(self._autodelete(msg, delete_after))
-                except Exception:
-                    pass
-
-    async def _autodelete(self, message: discord.Message, delay: int):
-        try:
-            await asyncio.sleep(max(5, delay))
-            await message.delete()
-        except (discord.NotFound, discord.Forbidden):
-            pass
+            run = await self._pay_guild(guild, index, cfg, key=_payroll_key(guild.id, cycle))
+            if run is not None:
+                runs.append(run)
+        return runs
+
+    async def _pay_guild(self, guild: discord.Guild, index: SalaryIndex, cfg: EconomyConfig, key: str) -> Dict[str, Any] | None:
+        """Stipendi di una gilda, a blocchi (vedi payroll.arun_payroll). None se `key` era già stata pagata."""
+        t0 = time.perf_counter()
+        log_channel_id = cfg.payroll_log_channel_id
+        delete_after = cfg.delete_logs_after_seconds
+        log_ch = guild.get_channel(log_channel_id) if log_channel_id else None
+
+        run = await arun_payroll(guild, index, key)
+        if run.get("already"):
+            return None
+        elapsed = time.perf_counter() - t0
+        logging.info(
+            "💰 Payroll %s: %s membri esaminati, %s pagati, totale %s, %s blocchi, %.3fs%s",
+            guild.id, run["scanned"], run["paid"], money_fmt(from_cents(run["total"])), run["chunks"], elapsed,
+            " (ripreso da checkpoint)" if run["resumed"] else "",
+        )
+
+        # Log (con auto-delete dopo 2 minuti): coda in uscita, che gestisce anche la cancellazione
+        if isinstance(log_ch, discord.TextChannel):
+            outbound.post_log(
+                log_ch,
+                f"💰 **Stipendi eseguiti** in **{guild.name}** — "
+                f"pagati **{run['paid']}** utenti su {run['scanned']} • Totale {money_fmt(from_cents(run['total']))} "
+                f"• {elapsed:.2f}s",
+                delete_after=delete_after,
+            )
+        return dict(run, guild_id=guild.id)
 
     # ------------- Comando manuale -------------
     @commands.hybrid_command(name="payroll_now", description="Esegui subito il ciclo stipendi (staff).")
     @commands.has_permissions(manage_guild=True)
     async def payroll_now(self, ctx: commands.Context):
-        cfg = load_config()
-        await self._run_payroll(cfg)
-        await ctx.reply("✅ Payroll eseguito ora.", mention_author=False)
+        try:
+            cfg = await _load_config()
+        except RuntimeError as e:
+            return await ctx.reply(f"❌ {e}", mention_author=False)
+        runs = await self._run_payroll(cfg)
+        if not runs:
+            return await ctx.reply("ℹ️ Nessuno stipendio da pagare (tabella vuota o ciclo già pagato).", mention_author=False)
+        lines = [
+            f"• `{r['guild_id']}`: {r['paid']} pagati su {r['scanned']} membri • {money_fmt(from_cents(r['total']))} • {r['elapsed_ms']:.1f} ms"
+            for r in runs
+        ]
+        await ctx.reply("✅ Payroll eseguito ora.\n" + "\n".join(lines), mention_author=False)
+
+    @commands.hybrid_command(name="payroll_status", description="Avanzamento degli stipendi e prossime scadenze (staff).")
+    @commands.has_permissions(manage_guild=True)
+    async def payroll_status(self, ctx: commands.Context):
+        await payroll.load_progress()
+        emb = discord.Embed(title="📊 Stato stipendi", color=discord.Color.blurple(), timestamp=datetime.now(timezone.utc))
+        runs = payroll.progress()
+        lines = []
+        for r in runs[:10]:
+            g = self.bot.get_guild(r.get("guild_id") or 0)
+            members = r.get("members") or 0
+            if r.get("done"):
+                state = "✅ completato"
+            elif r.get("running"):
+                state = f"⏳ in corso {r['scanned']}/{members} ({r['scanned'] * 100 // max(members, 1)}%)"
+            else:
+                state = f"⏸️ interrotto a {r['scanned']}/{members}: riprende alla prossima esecuzione"
+            lines.append(
+                f"`{r['key']}` — {g.name if g else r.get('guild_id')}\n"
+                f"{state} • pagati {r['paid']} • {money_fmt(from_cents(r['total']))} • "
+                f"{r['chunks']} blocchi • aggiornato <t:{int(r['updated'])}:R>"
+            )
+        emb.add_field(name="Esecuzioni", value="\n".join(lines)[:1024] or "Nessuna esecuzione registrata.", inline=False)
+
+        sched = []
+        for st in get_scheduler().status():
+            if st["job"] != self._job:
+                continue
+            g = self.bot.get_guild(st["guild_id"])
+            pending = f" • ⚠️ da recuperare: {', '.join(st['pending'])}" if st["pending"] else ""
+            sched.append(
+                f"{g.name if g else st['guild_id']}: ultimo ciclo {st['last_cycle'] or '—'} • "
+                f"prossimo <t:{int(st['next_due'].timestamp())}:R>{pending}"
+            )
+        emb.add_field(name=f"Scheduler ({self._schedule!r})", value="\n".join(sched)[:1024] or "Non ancora avviato.", inline=False)
+        await ctx.reply(embed=emb, mention_author=False, ephemeral=True)
+
+    @commands.hybrid_command(name="payroll_preview", description="Anteprima degli stipendi: chi verrebbe pagato e quanto, senza pagare (staff).")
+    @commands.has_permissions(manage_guild=True)
+    async def payroll_preview(self, ctx: commands.Context):
+        await ctx.defer(ephemeral=True)
+        try:
+            cfg = await _load_config()
+        except RuntimeError as e:
+            return await ctx.reply(f"❌ {e}", mention_author=False, ephemeral=True)
+        index = cfg.salary
+        if not index:
+            return await ctx.reply("ℹ️ La tabella stipendi è vuota.", mention_author=False, ephemeral=True)
+
+        # stesso indice e stesso piano dell'esecuzione reale, ma niente ledger né audit
+        plans = [plan_guild(g, index) for g in self.bot.guilds]
+        guilds = {g.id: g for g in self.bot.guilds}
+
+        def member_name(gid: int, uid: int) -> str:
+            m = guilds[gid].get_member(uid)
+            return m.display_name if m else str(uid)
+
+        def role_name(gid: int, rid: int) -> str:
+            r = guilds[gid].get_role(rid)
+            return r.name if r else (index.label(rid) or str(rid))
+
+        def render() -> bytes:
+            buf = io.StringIO()
+            write_csv(plans, buf, member_name, role_name)
+            return buf.getvalue().encode("utf-8-sig")  # BOM: Excel legge gli accenti
+
+        data = await run_io(render)
+        emb = discord.Embed(
+            title="🧾 Anteprima stipendi",
+            description="Nessun pagamento eseguito: è solo una simulazione.",
+            color=discord.Color.blurple(),
+            timestamp=datetime.now(timezone.utc),
+        )
+        for p in plans[:10]:
+            g = guilds[p.guild_id]
+            roles = [
+                f"{role_name(p.guild_id, rid)}: {n} membri • {money_fmt(from_cents(c))}"
+                for rid, (n, c) in list(p.by_role().items())[:10]
+            ]
+            emb.add_field(
+                name=f"{g.name} — {money_fmt(from_cents(p.total))} ({len(p.entries)}/{p.scanned} membri)",
+                value="\n".join(roles)[:1024] or "—",
+                inline=False,
+            )
+        emb.set_footer(text=f"Totale {money_fmt(from_cents(sum(p.total for p in plans)))} • {sum(p.elapsed_ms for p in plans):.1f} ms")
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M")
+        await ctx.reply(
+            embed=emb,
+            file=discord.File(io.BytesIO(data), filename=f"payroll_preview_{stamp}.csv"),
+            mention_author=False,
+            ephemeral=True,
+        )
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(EconomyAuto(bot))
\ No newline at end of file
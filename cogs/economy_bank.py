@@ -1,50 +1,108 @@
 # cogs/economy_bank.py
 from __future__ import annotations
-import json
-from pathlib import Path
-from typing import Dict, Any
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict
 
 import discord
 from discord.ext import commands
 from discord import app_commands
 
-from utils.profili import get_profile, set_profile, money_fmt
+from utils import accounts, audit_log, economy, economy_config, leaderboard, ledger_verify, outbound
+from utils.async_io import run_io
+from utils.checks import is_staff, staff_only
+from utils.economy_config import EconomyConfig
+from utils.iban import normalize_iban, validate_iban
+from utils.ledger import bank_account, from_cents, to_cents
+from utils.profili import afind_by_iban, mask_iban, money_fmt
+from views.classifica_view import ClassificaView, build_classifica_embed
 
-CONFIG_FILE = Path("data/economy_config.json")
-CONFIG_FILE.parent.mkdir(parents=True, exist_ok=True)
+_on_defaults = False
 
-DEFAULT_CFG = {
-    # canale dove loggare le operazioni utente (facoltativo)
-    "bank_log_channel_id": 0,
+async def _load_cfg() -> EconomyConfig:
+    # config compilata dal registro (in memoria, riletta solo se il file cambia); se il file non è
+    # mai stato valido valgono i default dello schema (segnalato una volta, finché non torna valido)
+    global _on_defaults
+    cfg = await economy_config.acurrent()
+    if cfg is None:
+        if not _on_defaults:
+            logging.warning("⚠️ Config economia non valida o assente: la banca usa i default dello schema")
+            _on_defaults = True
+        return economy_config.DEFAULTS
+    _on_defaults = False
+    return cfg
 
-    # limiti/parametri
-    "min_operation_amount": 10,       # minimo 10€
-    "max_operation_amount": 1_000_000,  # tetto massimo
+# etichette dei movimenti nell'estratto conto (op dell'audit)
+OP_LABELS = {
+    "DEPOSIT": "Deposito",
+    "WITHDRAW": "Prelievo",
+    "PAYROLL": "Stipendio",
+    "WALLET_DEPOSIT": "Accredito portafoglio",
+    "WALLET_WITHDRAW": "Addebito portafoglio",
+    "BANK_DEPOSIT": "Accredito conto",
+    "BANK_WITHDRAW": "Addebito conto",
+    "BANK_TRANSFER_IN": "Bonifico ricevuto",
+    "BANK_TRANSFER_OUT": "Bonifico inviato",
+    "SET_IBAN": "IBAN aggiornato",
+    "CREDIT": "Accredito",
+    "DEBIT": "Addebito",
+    "OPENING": "Saldo iniziale",
+    "RECONCILE": "Saldo importato",
 }
 
-def _load_cfg() -> Dict[str, Any]:
-    cfg = DEFAULT_CFG.copy()
-    if CONFIG_FILE.exists():
-        try:
-            user_cfg = json.loads(CONFIG_FILE.read_text(encoding="utf-8"))
-            # importa solo chiavi conosciute, senza distruggere altre configurazioni già presenti
-            for k in DEFAULT_CFG.keys():
-                if k in user_cfg:
-                    cfg[k] = user_cfg[k]
-            # lascia intatti eventuali altre chiavi dell'economia (stipendi, ecc.)
-        except Exception:
-            pass
-    else:
-        CONFIG_FILE.write_text(json.dumps(cfg, ensure_ascii=False, indent=2), encoding="utf-8")
-    return cfg
+def _statement_line(rec: Dict[str, Any]) -> str:
+    cents = rec.get("cents")
+    if cents is None:
+        cents = to_cents(rec.get("amount") or 0)  # record scritti prima dei centesimi
+    ts = int(rec.get("t") or 0)
+    label = OP_LABELS.get(rec.get("op"), rec.get("op") or "—")
+    amount = "" if not cents else f" {'➕' if cents > 0 else '➖'} **{money_fmt(from_cents(abs(cents)))}**"
+    reason = f" · {rec['reason']}" if rec.get("reason") else ""
+    return f"<t:{ts}:d> <t:{ts}:t> — {label}{amount}{reason}"
+
+
+# comandi che muovono denaro: aspettano migrazione e riconciliazione dei saldi (le letture no)
+MOVEMENT_COMMANDS = frozenset({"deposita", "preleva", "bonifico"})
 
-def _round2(x: float) -> float:
-    return float(f"{x:.2f}")
 
 class EconomyBank(commands.Cog):
     """Deposita e preleva dal conto bancario personale."""
     def __init__(self, bot: commands.Bot):
         self.bot = bot
+        # motivo per cui i movimenti sono bloccati (None = tutto ok): fino alla fine di on_ready
+        # i vecchi saldi potrebbero non essere ancora nel ledger
+        self._halted: str | None = "avvio in corso, riprova tra qualche secondo."
+
+    async def interaction_check(self, itx: discord.Interaction) -> bool:
+        # senza riconciliazione i vecchi saldi non sono nel ledger: meglio nessun movimento che saldi a 0
+        if self._halted and itx.command is not None and itx.command.name in MOVEMENT_COMMANDS:
+            await itx.response.send_message(f"⛔ Banca non disponibile: {self._halted}", ephemeral=True)
+            return False
+        return True
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # snapshot periodici dei saldi: le verifiche ripartono da lì
+        await run_io(ledger_verify.enable_auto_snapshots)
+        # una tantum, in quest'ordine: prima i saldi di economy.json, poi quelli dei profili
+        try:
+            await economy.amigrate_balances()
+        except Exception as e:
+            self._halted = "migrazione dei saldi di economy.json fallita, contatta lo staff."
+            logging.exception(f"❌ Migrazione dei saldi di economy.json fallita, comandi della banca bloccati: {e}")
+            return
+        gid = accounts.economy_guild_id([g.id for g in self.bot.guilds])
+        if gid is None:
+            self._halted = "il bot è in più gilde e ECONOMY_GUILD_ID non è impostata (riconciliazione dei conti non eseguita)."
+            logging.error("❌ Riconciliazione conti impossibile: imposta ECONOMY_GUILD_ID. Comandi della banca bloccati.")
+            return
+        try:
+            await accounts.areconcile_profiles(gid)
+        except Exception as e:
+            self._halted = "riconciliazione dei conti fallita, contatta lo staff."
+            logging.exception(f"❌ Riconciliazione conti fallita, comandi della banca bloccati: {e}")
+            return
+        self._halted = None
 
     # ========= Slash: /deposita =========
     @app_commands.command(name="deposita", description="Deposita una somma dal portafoglio al conto bancario.")
@@ -52,34 +110,25 @@ class EconomyBank(commands.Cog):
     async def deposita(self, itx: discord.Interaction, importo: float):
         await itx.response.defer(ephemeral=True)
 
-        cfg = _load_cfg()
-        min_amt = float(cfg.get("min_operation_amount") or 1)
-        max_amt = float(cfg.get("max_operation_amount") or 1_000_000)
+        cfg = await _load_cfg()
+        min_amt = float(cfg.min_operation_amount)
+        max_amt = float(cfg.max_operation_amount)
 
         # validazione importo
         if importo is None or importo <= 0:
-            return await itx.followup.send("❌ Inserisci un importo positivo.", ephemeral=True)
+            return await outbound.followup(itx, "❌ Inserisci un importo positivo.", ephemeral=True)
         if importo < min_amt:
-            return await itx.followup.send(f"❌ L'importo minimo è {money_fmt(min_amt)}.", ephemeral=True)
+            return await outbound.followup(itx, f"❌ L'importo minimo è {money_fmt(min_amt)}.", ephemeral=True)
         if importo > max_amt:
-            return await itx.followup.send(f"❌ L'importo massimo per operazione è {money_fmt(max_amt)}.", ephemeral=True)
-
-        prof = get_profile(itx.user.id)
-        wallet = float(prof.get("wallet") or 0)
-        bank   = dict(prof.get("bank") or {})
-        saldo  = float(bank.get("saldo") or 0)
-
-        if wallet < importo:
-            return await itx.followup.send(
-                f"❌ Fondi insufficienti nel portafoglio. Disponibile: {money_fmt(wallet)}",
-                ephemeral=True
-            )
-
-        # esegui movimento
-        wallet -= importo
-        saldo  += importo
+            return await outbound.followup(itx, f"❌ L'importo massimo per operazione è {money_fmt(max_amt)}.", ephemeral=True)
 
-        set_profile(itx.user.id, wallet=_round2(wallet), bank={"saldo": _round2(saldo)})
+        # UNA transazione del ledger (portafoglio -> conto): il controllo fondi è atomico.
+        # Chiave = id dell'interazione: un retry di Discord non deposita una seconda volta.
+        try:
+            mov = await accounts.adeposit(itx.guild_id or 0, itx.user.id, importo, "/deposita", key=f"itx:{itx.id}")
+        except ValueError as e:
+            return await outbound.followup(itx, str(e), ephemeral=True)
+        wallet, saldo = from_cents(mov.wallet), from_cents(mov.bank)
 
         # feedback all'utente
         msg = (
@@ -87,20 +136,19 @@ class EconomyBank(commands.Cog):
             f"💳 Portafoglio: {money_fmt(wallet)}\n"
             f"🏦 Conto: {money_fmt(saldo)}"
         )
-        await itx.followup.send(msg, ephemeral=True)
+        await outbound.followup(itx, msg, ephemeral=True)
 
         # log opzionale
-        log_ch_id = int(cfg.get("bank_log_channel_id") or 0)
-        if log_ch_id and itx.guild:
+        log_ch_id = cfg.bank_log_channel_id
+        if log_ch_id and itx.guild and not mov.replayed:
             ch = itx.guild.get_channel(log_ch_id)
             if isinstance(ch, discord.TextChannel):
-                try:
-                    await ch.send(
-                        f"📥 **Deposito** — {itx.user.mention} ha depositato {money_fmt(importo)}.\n"
-                        f"Saldo conto: {money_fmt(saldo)}"
-                    )
-                except Exception:
-                    pass
+                # accodato: righe vicine finiscono nello stesso messaggio, e la risposta all'utente ha la precedenza
+                outbound.post_log(
+                    ch,
+                    f"📥 **Deposito** — {itx.user.mention} ha depositato {money_fmt(importo)}.\n"
+                    f"Saldo conto: {money_fmt(saldo)}",
+                )
 
     # ========= Slash: /preleva =========
     @app_commands.command(name="preleva", description="Preleva una somma dal conto bancario al portafoglio.")
@@ -108,53 +156,179 @@ class EconomyBank(commands.Cog):
     async def preleva(self, itx: discord.Interaction, importo: float):
         await itx.response.defer(ephemeral=True)
 
-        cfg = _load_cfg()
-        min_amt = float(cfg.get("min_operation_amount") or 1)
-        max_amt = float(cfg.get("max_operation_amount") or 1_000_000)
+        cfg = await _load_cfg()
+        min_amt = float(cfg.min_operation_amount)
+        max_amt = float(cfg.max_operation_amount)
 
         if importo is None or importo <= 0:
-            return await itx.followup.send("❌ Inserisci un importo positivo.", ephemeral=True)
+            return await outbound.followup(itx, "❌ Inserisci un importo positivo.", ephemeral=True)
         if importo < min_amt:
-            return await itx.followup.send(f"❌ L'importo minimo è {money_fmt(min_amt)}.", ephemeral=True)
+            return await outbound.followup(itx, f"❌ L'importo minimo è {money_fmt(min_amt)}.", ephemeral=True)
         if importo > max_amt:
-            return await itx.followup.send(f"❌ L'importo massimo per operazione è {money_fmt(max_amt)}.", ephemeral=True)
-
-        prof = get_profile(itx.user.id)
-        wallet = float(prof.get("wallet") or 0)
-        bank   = dict(prof.get("bank") or {})
-        saldo  = float(bank.get("saldo") or 0)
-
-        if saldo < importo:
-            return await itx.followup.send(
-                f"❌ Fondi insufficienti sul conto. Disponibile: {money_fmt(saldo)}",
-                ephemeral=True
-            )
+            return await outbound.followup(itx, f"❌ L'importo massimo per operazione è {money_fmt(max_amt)}.", ephemeral=True)
 
-        # esegui movimento
-        saldo  -= importo
-        wallet += importo
-
-        set_profile(itx.user.id, wallet=_round2(wallet), bank={"saldo": _round2(saldo)})
+        # UNA transazione del ledger (conto -> portafoglio), idempotente come /deposita
+        try:
+            mov = await accounts.awithdraw(itx.guild_id or 0, itx.user.id, importo, "/preleva", key=f"itx:{itx.id}")
+        except ValueError as e:
+            return await outbound.followup(itx, str(e), ephemeral=True)
+        wallet, saldo = from_cents(mov.wallet), from_cents(mov.bank)
 
         msg = (
             f"✅ Prelievo effettuato: **{money_fmt(importo)}**\n"
             f"💳 Portafoglio: {money_fmt(wallet)}\n"
             f"🏦 Conto: {money_fmt(saldo)}"
         )
-        await itx.followup.send(msg, ephemeral=True)
+        await outbound.followup(itx, msg, ephemeral=True)
 
         # log opzionale
-        log_ch_id = int(cfg.get("bank_log_channel_id") or 0)
-        if log_ch_id and itx.guild:
+        log_ch_id = cfg.bank_log_channel_id
+        if log_ch_id and itx.guild and not mov.replayed:
+            ch = itx.guild.get_channel(log_ch_id)
+            if isinstance(ch, discord.TextChannel):
+                outbound.post_log(
+                    ch,
+                    f"📤 **Prelievo** — {itx.user.mention} ha prelevato {money_fmt(importo)}.\n"
+                    f"Saldo conto: {money_fmt(saldo)}",
+                )
+
+    # ========= Slash: /bonifico =========
+    @app_commands.command(name="bonifico", description="Invia un bonifico dal tuo conto a un IBAN.")
+    @app_commands.describe(
+        iban="IBAN del destinatario (gli spazi vengono ignorati).",
+        importo="Importo da inviare (es. 100).",
+        causale="Causale del bonifico (facoltativa).",
+    )
+    @app_commands.guild_only()
+    async def bonifico(self, itx: discord.Interaction, iban: str, importo: float, causale: str | None = None):
+        await itx.response.defer(ephemeral=True)
+
+        cfg = await _load_cfg()
+        min_amt = float(cfg.min_operation_amount)
+        max_amt = float(cfg.max_operation_amount)
+
+        if importo is None or importo <= 0:
+            return await outbound.followup(itx, "❌ Inserisci un importo positivo.", ephemeral=True)
+        if importo < min_amt:
+            return await outbound.followup(itx, f"❌ L'importo minimo è {money_fmt(min_amt)}.", ephemeral=True)
+        if importo > max_amt:
+            return await outbound.followup(itx, f"❌ L'importo massimo per operazione è {money_fmt(max_amt)}.", ephemeral=True)
+
+        # cifre di controllo prima di tutto: un IBAN digitato male non arriva nemmeno all'indice
+        iban = normalize_iban(iban)
+        if not validate_iban(iban):
+            return await outbound.followup(itx, "❌ IBAN non valido: controlla di averlo copiato per intero.", ephemeral=True)
+        owners = await afind_by_iban(iban)  # indice IBAN -> utenti: lookup O(1)
+        if not owners:
+            return await outbound.followup(itx, "❌ Nessun conto corrisponde a questo IBAN.", ephemeral=True)
+        if len(owners) > 1:
+            # mai scegliere a caso il destinatario di un bonifico
+            logging.warning("⚠️ /bonifico rifiutato: IBAN %s condiviso da %s", mask_iban(iban), owners)
+            return await outbound.followup(
+                itx,
+                "❌ Questo IBAN risulta assegnato a più conti: bonifico annullato. "
+                "Segnalalo allo staff (le collisioni sono elencate da `/iban_rilascia`).",
+                ephemeral=True,
+            )
+        dest_id = owners[0]
+        if dest_id == itx.user.id:
+            return await outbound.followup(itx, "❌ Non puoi inviare un bonifico a te stesso.", ephemeral=True)
+
+        reason = (causale or "").strip()[:200] or "/bonifico"
+        try:
+            tx = await economy.atransfer_bank(itx.guild_id, itx.user.id, dest_id, importo, reason, key=f"itx:{itx.id}")
+        except ValueError as e:
+            # fondi insufficienti, importo non valido, ...: ogni errore con il suo messaggio
+            return await outbound.followup(itx, f"❌ {e}.", ephemeral=True)
+        # saldo subito dopo QUESTO bonifico (c'è sempre: la transazione ha una chiave)
+        saldo = from_cents(tx["after"][bank_account(itx.guild_id, itx.user.id)])
+
+        await outbound.followup(
+            itx,
+            f"✅ Bonifico di **{money_fmt(importo)}** inviato a <@{dest_id}> (`{mask_iban(iban)}`).\n"
+            f"🏦 Conto: {money_fmt(saldo)}",
+            ephemeral=True,
+            allowed_mentions=discord.AllowedMentions.none(),
+        )
+
+        log_ch_id = cfg.bank_log_channel_id
+        if log_ch_id and itx.guild and not tx.get("replayed"):
             ch = itx.guild.get_channel(log_ch_id)
             if isinstance(ch, discord.TextChannel):
-                try:
-                    await ch.send(
-                        f"📤 **Prelievo** — {itx.user.mention} ha prelevato {money_fmt(importo)}.\n"
-                        f"Saldo conto: {money_fmt(saldo)}"
-                    )
-                except Exception:
-                    pass
+                outbound.post_log(
+                    ch,
+                    f"🔁 **Bonifico** — {itx.user.mention} → <@{dest_id}>: {money_fmt(importo)}.\n"
+                    f"Causale: {reason}",
+                )
+
+    # ========= Slash: /estratto_conto =========
+    @app_commands.command(name="estratto_conto", description="Mostra gli ultimi movimenti del conto.")
+    @app_commands.describe(
+        movimenti="Quanti movimenti mostrare (max 50).",
+        utente="Utente di cui vedere l'estratto conto (solo staff).",
+    )
+    async def estratto_conto(
+        self,
+        itx: discord.Interaction,
+        movimenti: app_commands.Range[int, 1, 50] = 20,
+        utente: discord.Member | None = None,
+    ):
+        target = utente or itx.user
+        if target.id != itx.user.id and not is_staff(itx):
+            return await itx.response.send_message("❌ Puoi vedere solo il **tuo** estratto conto.", ephemeral=True)
+        await itx.response.defer(ephemeral=True)
+
+        # legge solo i segmenti/offset dell'utente (vedi utils/audit_log)
+        recs = await run_io(audit_log.statement, itx.guild_id or 0, target.id, movimenti)
+        if not recs:
+            return await outbound.followup(itx, "ℹ️ Nessun movimento registrato.", ephemeral=True)
+
+        emb = discord.Embed(
+            title=f"🧾 Estratto conto — {target.display_name}",
+            description="\n".join(_statement_line(r) for r in recs)[:4000],
+            color=discord.Color.blurple(),
+            timestamp=datetime.now(timezone.utc),
+        )
+        emb.set_footer(text=f"VeneziaRP | Banca • ultimi {len(recs)} movimenti")
+        await outbound.followup(itx, embed=emb, ephemeral=True)
+
+    # ========= Slash: /verifica_conti (staff) =========
+    @app_commands.command(name="verifica_conti", description="Verifica i saldi del ledger contro l'audit (staff).")
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    async def verifica_conti(self, itx: discord.Interaction):
+        await itx.response.defer(ephemeral=True)
+        # replay dall'ultimo snapshot, diviso per gilda su un pool di processi
+        report = await run_io(ledger_verify.verify_live)
+        diffs = report["discrepancies"]
+        emb = discord.Embed(
+            title="✅ Conti verificati" if not diffs else f"❌ {len(diffs)} differenze",
+            color=discord.Color.green() if not diffs else discord.Color.red(),
+            timestamp=datetime.now(timezone.utc),
+        )
+        emb.add_field(name="Transazioni", value=f"{report['from_seq']} → {report['upto_seq']} ({report['transactions']})", inline=True)
+        emb.add_field(name="Conti", value=f"{report['accounts']} in {report['guilds']} gilde", inline=True)
+        emb.add_field(name="Record audit", value=str(report["audit_records"]), inline=True)
+        if diffs:
+            lines = [
+                f"`{d['account']}` ledger {money_fmt(from_cents(d['ledger']))} ≠ {d['source']} "
+                f"{money_fmt(from_cents(d.get('audit', d.get('memory', 0))))}"
+                for d in diffs[:15]
+            ]
+            if len(diffs) > 15:
+                lines.append(f"… e altre {len(diffs) - 15}")
+            emb.description = "\n".join(lines)
+        emb.set_footer(text=f"{report['elapsed_s']}s" + (" • snapshot aggiornato" if report["snapshot_written"] else ""))
+        await outbound.followup(itx, embed=emb, ephemeral=True)
+
+    # ========= Slash: /classifica =========
+    @app_commands.command(name="classifica", description="Classifica dei cittadini più ricchi (portafoglio + conto).")
+    @app_commands.guild_only()
+    async def classifica(self, itx: discord.Interaction):
+        # la classifica è mantenuta dal ledger a ogni movimento: qui solo query O(log n)
+        board = leaderboard.get_leaderboard() if leaderboard.is_loaded() else await run_io(leaderboard.get_leaderboard)
+        view = ClassificaView(board, itx.user.id, itx.guild)
+        await itx.response.send_message(embed=build_classifica_embed(board, itx.guild, itx.user.id, 0), view=view)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(EconomyBank(bot))
\ No newline at end of file
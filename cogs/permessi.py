@@ -1,28 +1,15 @@
-import json
-from pathlib import Path
 import discord
 from discord import app_commands
 from discord.ext import commands
 
-ROLES_FILE = Path("data/roles.json")
-CHANS_FILE = Path("data/channels.json")
-for p in (ROLES_FILE, CHANS_FILE):
-    p.parent.mkdir(parents=True, exist_ok=True)
+from utils import config_registry
 
 # ---------------- utils ----------------
-def load_json(path: Path) -> dict:
-    if path.exists():
-        try:
-            return json.loads(path.read_text(encoding="utf-8"))
-        except:
-            return {}
-    return {}
-
 def get_role(g: discord.Guild, rid): 
     return g.get_role(rid) if rid else None
 
-def resolve_category(g: discord.Guild, key: str) -> discord.CategoryChannel | None:
-    data = load_json(CHANS_FILE)
+def resolve_category(g: discord.Guild, data: config_registry.Snapshot, key: str) -> discord.CategoryChannel | None:
+    # data: snapshot CHANNELS (letto dal chiamante con config_registry.aget)
     # prova nome esatto
     name = (data.get("names", {}).get("categories", {}) or {}).get(key)
     if name:
@@ -37,8 +24,8 @@ def resolve_category(g: discord.Guild, key: str) -> discord.CategoryChannel | No
             return ch
     return None
 
-def resolve_channel(g: discord.Guild, key: str) -> discord.TextChannel | None:
-    data = load_json(CHANS_FILE)
+def resolve_channel(g: discord.Guild, data: config_registry.Snapshot, key: str) -> discord.TextChannel | None:
+    # data: snapshot CHANNELS (letto dal chiamante con config_registry.aget)
     # prova nome esatto
     name = (data.get("names", {}).get("channels", {}) or {}).get(key)
     if name:
@@ -73,11 +60,12 @@ class Permessi(commands.Cog):
     @app_commands.command(name="perm_check", description="Mostra categorie/canali risolti.")
     async def perm_check(self, itx: discord.Interaction):
         g = itx.guild
-        cat_ver = resolve_category(g, "verifica")
-        cat_reg = resolve_category(g, "registro")
-        cat_ana = resolve_category(g, "anagrafe")
-        ch_ver  = resolve_channel(g, "verifica")
-        ch_citt = resolve_channel(g, "cittadinanza")
+        channels = await config_registry.aget(config_registry.CHANNELS)
+        cat_ver = resolve_category(g, channels, "verifica")
+        cat_reg = resolve_category(g, channels, "registro")
+        cat_ana = resolve_category(g, channels, "anagrafe")
+        ch_ver  = resolve_channel(g, channels, "verifica")
+        ch_citt = resolve_channel(g, channels, "cittadinanza")
 
         lines = [
             f"Categoria verifica: {cat_ver.name if cat_ver else '❌'}",
@@ -93,22 +81,23 @@ class Permessi(commands.Cog):
     async def apply_permessi(self, itx: discord.Interaction):
         await itx.response.defer(ephemeral=True, thinking=True)
         g = itx.guild
-        roles_map = load_json(ROLES_FILE)
+        roles_map = await config_registry.aget(config_registry.ROLES)
+        channels = await config_registry.aget(config_registry.CHANNELS)
 
         r_nonver = get_role(g, roles_map.get("non_verificato"))
         r_turista = get_role(g, roles_map.get("turista"))
         r_citt = get_role(g, roles_map.get("cittadino"))
-        staff_ids = (roles_map.get("groups") or {}).get("staff", [])
+        staff_ids = roles_map.ids("groups.staff")
         staff_roles = [get_role(g, i) for i in staff_ids if get_role(g, i)]
 
         if not r_nonver or not r_turista or not r_citt:
             return await itx.followup.send("❌ Config ruoli incompleta.", ephemeral=True)
 
         # categorie/canali
-        cat_ver = resolve_category(g, "verifica")
-        cat_reg = resolve_category(g, "registro")
-        cat_ana = resolve_category(g, "anagrafe")
-        ch_citt = resolve_channel(g, "cittadinanza")
+        cat_ver = resolve_category(g, channels, "verifica")
+        cat_reg = resolve_category(g, channels, "registro")
+        cat_ana = resolve_category(g, channels, "anagrafe")
+        ch_citt = resolve_channel(g, channels, "cittadinanza")
 
         # --- VERIFICA ---
         if cat_ver:
@@ -1,37 +1,27 @@
 # cogs/profilo.py
 from __future__ import annotations
 import asyncio
-import json
-from pathlib import Path
+from typing import Any, Mapping
 from datetime import datetime, timezone
 
 import discord
 from discord.ext import commands
 from discord import app_commands
 
-from utils.profili import get_profile, money_fmt, mask_iban
+from utils import accounts, audit_log, config_registry, outbound
+from utils.async_io import io_stats
+from utils.checks import staff_only
+from utils.config_registry import Snapshot
+from utils.profili import BANK_FIELDS, ProfileView, aget_profile, aget_profile_view, money_fmt, mask_iban, cache_stats
 
-ROLES_FILE = Path("data/roles.json")
 AUTO_DELETE_SECONDS = 120
 DIV = "━━━━━━━━━━━━━━━━━━━"  # divider minimal
 
 
 # ------------------ helpers ------------------
 
-def load_roles_map() -> dict:
-    if ROLES_FILE.exists():
-        try:
-            return json.loads(ROLES_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {}
-
-def is_staff_member(member: discord.Member, roles_map: dict) -> bool:
-    staff_ids = (roles_map.get("groups") or {}).get("staff", []) or []
-    try:
-        staff_ids = {int(x) for x in staff_ids}
-    except Exception:
-        staff_ids = set()
+def is_staff_member(member: discord.Member, roles_map: Snapshot) -> bool:
+    staff_ids = roles_map.ids("groups.staff")
     return member.guild_permissions.manage_guild or any(r.id in staff_ids for r in member.roles)
 
 def fmt_ts(dt: datetime | None) -> str:
@@ -47,23 +37,8 @@ def username_tag(m: discord.Member) -> str:
         return f"{m.name}#{m.discriminator}"
     return m.name
 
-def _ids(roles_map: dict, key: str) -> list[int]:
-    raw = roles_map.get(key)
-    if not raw:
-        return []
-    if isinstance(raw, int):
-        raw = [raw]
-    out = []
-    for x in raw:
-        try:
-            out.append(int(x))
-        except Exception:
-            pass
-    return out
-
-def roles_in_section(member: discord.Member, ids: list[int]) -> list[discord.Role]:
-    sid = set(ids or [])
-    return [r for r in sorted(member.roles, key=lambda r: r.position, reverse=True) if r.id in sid]
+def roles_in_section(member: discord.Member, ids: frozenset[int]) -> list[discord.Role]:
+    return [r for r in sorted(member.roles, key=lambda r: r.position, reverse=True) if r.id in ids]
 
 def make_embed(member: discord.Member, guild: discord.Guild | None, title: str, lines: list[str]) -> discord.Embed:
     color = (member.top_role.color if member.top_role and member.top_role.color.value else discord.Color.blurple())
@@ -75,12 +50,12 @@ def make_embed(member: discord.Member, guild: discord.Guild | None, title: str,
         emb.set_footer(text="VeneziaRP | Scheda profilo")
     return emb
 
-def main_badges(member: discord.Member, roles_map: dict, prof: dict) -> str:
-    staff_ids = (roles_map.get("groups") or {}).get("staff", []) or []
+def main_badges(member: discord.Member, roles_map: Snapshot, prof: Mapping[str, Any]) -> str:
+    staff_ids = roles_map.ids("groups.staff")
     is_staff  = any(r.id in staff_ids or r.permissions.manage_guild for r in member.roles)
     is_boost  = bool(getattr(member, "premium_since", None))
-    rid_citt  = roles_map.get("cittadino")
-    rid_tur   = roles_map.get("turista")
+    rid_citt  = roles_map.id("cittadino")
+    rid_tur   = roles_map.id("turista")
 
     badges = []
     if rid_citt and any(r.id == rid_citt for r in member.roles): badges.append("🏛️ Cittadino")
@@ -93,8 +68,8 @@ def main_badges(member: discord.Member, roles_map: dict, prof: dict) -> str:
 
 # ---------- section renderers ----------
 
-def render_overview(member: discord.Member, roles_map: dict, prof: dict, guild: discord.Guild | None) -> discord.Embed:
-    staff_ids = (roles_map.get("groups") or {}).get("staff", []) or []
+def render_overview(member: discord.Member, roles_map: Snapshot, prof: Mapping[str, Any], guild: discord.Guild | None) -> discord.Embed:
+    staff_ids = roles_map.ids("groups.staff")
     staff_roles = [r for r in member.roles if r.id in staff_ids]
     staff_top = max(staff_roles, key=lambda r: r.position, default=None)
 
@@ -110,7 +85,7 @@ def render_overview(member: discord.Member, roles_map: dict, prof: dict, guild:
 
     return make_embed(member, guild, f"👤 Profilo — {member.display_name}", lines)
 
-def render_docs(member: discord.Member, prof: dict, guild: discord.Guild | None) -> discord.Embed:
+def render_docs(member: discord.Member, prof: Mapping[str, Any], guild: discord.Guild | None) -> discord.Embed:
     pda = (prof.get("docs") or {}).get("porto_armi") or {}
     pda_line = ""
     if pda.get("stato"):
@@ -132,7 +107,7 @@ def render_docs(member: discord.Member, prof: dict, guild: discord.Guild | None)
         lines.append(pda_line)
     return make_embed(member, guild, f"🪪  Documenti — {member.display_name}", lines)
 
-def render_licenses(member: discord.Member, prof: dict, guild: discord.Guild | None) -> discord.Embed:
+def render_licenses(member: discord.Member, prof: Mapping[str, Any], guild: discord.Guild | None) -> discord.Embed:
     pats = ((prof.get("docs") or {}).get("patenti") or {})
     def _row(label_emoji: str, key: str) -> str:
         data = pats.get(key) or {}
@@ -157,10 +132,10 @@ def render_licenses(member: discord.Member, prof: dict, guild: discord.Guild | N
     ]
     return make_embed(member, guild, f"🚗 Patenti & Licenze — {member.display_name}", lines)
 
-def render_work(member: discord.Member, prof: dict, roles_map: dict, guild: discord.Guild | None) -> discord.Embed:
-    lavori_ids = _ids(roles_map, "sep_lavori")
+def render_work(member: discord.Member, prof: Mapping[str, Any], roles_map: Snapshot, guild: discord.Guild | None) -> discord.Embed:
+    lavori_ids = roles_map.ids("sep_lavori")
     lavori_ruoli = roles_in_section(member, lavori_ids)
-    lavoro_name = ", ".join(r.name for r in lavori_ruoli) or (prof.get("lavoro") or prof.get("lavoro_rp") or "—")
+    lavoro_name = ", ".join(r.name for r in lavori_ruoli) or (prof.get("lavoro") or "—")
     dip = prof.get("dipartimento") or prof.get("dip") or "—"
     assunto = prof.get("assunto_il") or prof.get("assunzione") or ""
     lines = [
@@ -172,11 +147,11 @@ def render_work(member: discord.Member, prof: dict, roles_map: dict, guild: disc
         lines.append(f"📅 **Assunto il:** {assunto}")
     return make_embed(member, guild, f"💼  Lavoro — {member.display_name}", lines)
 
-def render_bank(member: discord.Member, prof: dict, guild: discord.Guild | None) -> discord.Embed:
+def render_bank(member: discord.Member, prof: Mapping[str, Any], guild: discord.Guild | None) -> discord.Embed:
     bank = prof.get("bank") or {}
     wallet = money_fmt(prof.get("wallet"))
     saldo  = money_fmt(bank.get("saldo"))
-    iban   = mask_iban(bank.get("iban") or prof.get("iban"))
+    iban   = mask_iban(bank.get("iban"))
     lines = [
         DIV,
         f"💳 **Portafoglio:** {wallet}",
@@ -185,7 +160,7 @@ def render_bank(member: discord.Member, prof: dict, guild: discord.Guild | None)
     ]
     return make_embed(member, guild, f"🏦  Banca — {member.display_name}", lines)
 
-def render_assets(member: discord.Member, prof: dict, guild: discord.Guild | None) -> discord.Embed:
+def render_assets(member: discord.Member, prof: Mapping[str, Any], guild: discord.Guild | None) -> discord.Embed:
     pr = prof.get("proprieta") or {}
     def _list_lines(title, items):
         if not items:
@@ -206,7 +181,7 @@ def render_assets(member: discord.Member, prof: dict, guild: discord.Guild | Non
     ]
     return make_embed(member, guild, f"🏠  Proprietà — {member.display_name}", lines)
 
-def render_awards(member: discord.Member, prof: dict, guild: discord.Guild | None) -> discord.Embed:
+def render_awards(member: discord.Member, prof: Mapping[str, Any], guild: discord.Guild | None) -> discord.Embed:
     rec = prof.get("riconoscimenti") or []
     if not rec:
         body = "Nessun riconoscimento ottenuto."
@@ -236,7 +211,7 @@ def render_discord(member: discord.Member, guild: discord.Guild | None) -> disco
 # ---------------- View: un solo messaggio, si edita ----------------
 
 class ProfiloView(discord.ui.View):
-    def __init__(self, owner_id: int, member: discord.Member, roles_map: dict):
+    def __init__(self, owner_id: int, member: discord.Member, roles_map: Snapshot):
         super().__init__(timeout=AUTO_DELETE_SECONDS)
         self.owner_id = owner_id
         self.member = member
@@ -264,9 +239,18 @@ class ProfiloView(discord.ui.View):
     )
     async def select_section(self, interaction: discord.Interaction, select: discord.ui.Select):
         guild = interaction.guild
-        prof = get_profile(self.member.id)
-
         v = select.values[0]
+        if v == "bank":
+            # la banca legge solo 3-4 campi: niente documenti/patenti/proprietà
+            # IBAN dal profilo, saldi dal servizio conti (tabella in memoria del ledger)
+            prof = ProfileView(
+                await accounts.amoney(self.member.guild.id, self.member.id),
+                await aget_profile(self.member.id, fields=BANK_FIELDS),
+            )
+        else:
+            # vista in sola lettura: nessuna copia/merge dei default a ogni cambio sezione
+            prof = await aget_profile_view(self.member.id)
+
         if v == "overview":
             emb = render_overview(self.member, self.roles_map, prof, guild)
         elif v == "docs":
@@ -299,14 +283,14 @@ class Profilo(commands.Cog):
     )
     @app_commands.describe(utente="Utente di cui mostrare il profilo (solo staff).")
     async def profilo(self, itx: discord.Interaction, utente: discord.Member | None = None):
-        roles_map = load_roles_map()
+        roles_map = await config_registry.aget(config_registry.ROLES)
 
         target: discord.Member = utente or itx.user  # type: ignore
         if utente and utente.id != itx.user.id and not is_staff_member(itx.user, roles_map):
             await itx.response.send_message("❌ Puoi vedere solo il **tuo** profilo.", ephemeral=True)
             return
 
-        prof = get_profile(target.id)
+        prof = await aget_profile_view(target.id)
         emb = render_overview(target, roles_map, prof, itx.guild)
         view = ProfiloView(owner_id=itx.user.id, member=target, roles_map=roles_map)
 
@@ -327,6 +311,17 @@ class Profilo(commands.Cog):
                 pass
         asyncio.create_task(_auto())
 
+    @app_commands.default_permissions(administrator=True)
+    @staff_only()
+    @app_commands.command(name="profili_cache", description="Statistiche della cache profili (staff).")
+    async def profili_cache(self, itx: discord.Interaction):
+        st = cache_stats()
+        lines = [f"{k}: {v}" for k, v in st.items()]
+        lines += [f"io_{k}: {v}" for k, v in io_stats().items()]
+        lines += [f"audit_{k}: {v}" for k, v in audit_log.stats().items()]
+        lines += [f"outbound_{k}: {v}" for k, v in outbound.stats().items()]
+        await itx.response.send_message("```\n" + "\n".join(lines) + "\n```", ephemeral=True)
+
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Profilo(bot))
\ No newline at end of file
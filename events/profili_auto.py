@@ -1,65 +1,26 @@
 # events/profil_auto.py
 from __future__ import annotations
-import json
-from pathlib import Path
-from typing import Any, Iterable, List, Dict, Optional
+from typing import Any, FrozenSet, List, Dict, Optional
 
 import discord
 from discord.ext import commands
 
-from utils.profili import get_profile, set_profile
+from utils import accounts, config_registry
+from utils.profili import aset_profile
 
-ROLES_FILE = Path("data/roles.json")
-
-
-def _load_roles_map() -> Dict[str, Any]:
-    if ROLES_FILE.exists():
-        try:
-            return json.loads(ROLES_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {}
-
-
-def _to_ids(val: Any) -> List[int]:
-    """
-    Converte val in lista di int.
-    - int -> [int]
-    - str numerica -> [int]
-    - list/tuple di int/str -> [int, ...]
-    - altro/None -> []
-    """
-    if val is None:
-        return []
-    if isinstance(val, (list, tuple, set)):
-        out: List[int] = []
-        for x in val:
-            try:
-                out.append(int(x))
-            except Exception:
-                pass
-        return out
-    try:
-        return [int(val)]
-    except Exception:
-        return []
-
-
-def _role_names(member: discord.Member, ids: Iterable[int]) -> List[str]:
-    idset = set(ids)
-    if not idset:
+def _role_names(member: discord.Member, ids: FrozenSet[int]) -> List[str]:
+    if not ids:
         return []
     roles_sorted = sorted(member.roles, key=lambda r: r.position, reverse=True)
-    return [r.name for r in roles_sorted if r.id in idset]
+    return [r.name for r in roles_sorted if r.id in ids]
 
 
-def _top_role_name(member: discord.Member, ids: Iterable[int]) -> Optional[str]:
-    idset = set(ids)
-    if not idset:
+def _top_role_name(member: discord.Member, ids: FrozenSet[int]) -> Optional[str]:
+    if not ids:
         return None
     roles_sorted = sorted(member.roles, key=lambda r: r.position, reverse=True)
     for r in roles_sorted:
-        if r.id in idset:
+        if r.id in ids:
             return r.name
     return None
 
@@ -71,10 +32,8 @@ class ProfiliAuto(commands.Cog):
     # 👋 Al join: assicura che il profilo esista
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        # crea con defaults se manca
-        get_profile(member.id)
-        # eventualmente inizializza qualche campo base
-        set_profile(member.id, nome_rp=None, identity_card=None)
+        # crea il profilo se manca (i default li aggiunge get_profile in lettura)
+        await aset_profile(member.id, nome_rp=None, identity_card=None)
 
     # 🔄 Aggiorna profilo solo se i ruoli cambiano
     @commands.Cog.listener()
@@ -85,11 +44,11 @@ class ProfiliAuto(commands.Cog):
         if set(before.roles) == set(after.roles):
             return
 
-        roles_map = _load_roles_map()
+        roles_map = await config_registry.aget(config_registry.ROLES)
 
         # --- Cittadinanza ---
-        cittadino_id = _to_ids(roles_map.get("cittadino"))
-        turista_id   = _to_ids(roles_map.get("turista"))
+        cittadino_id = roles_map.ids("cittadino")
+        turista_id   = roles_map.ids("turista")
         is_cittadino = any(r.id in cittadino_id for r in after.roles) if cittadino_id else False
         is_turista   = any(r.id in turista_id   for r in after.roles) if turista_id   else False
 
@@ -101,33 +60,34 @@ class ProfiliAuto(commands.Cog):
             payload["cittadinanza"] = "Turista"
 
         # --- Lavori (sep_lavori) → prendi il ruolo più alto tra quelli configurati ---
-        lavori_ids = _to_ids(roles_map.get("sep_lavori"))
+        lavori_ids = roles_map.ids("sep_lavori")
         top_job = _top_role_name(after, lavori_ids)
         payload["lavoro"] = top_job  # può essere None se non ha lavori
 
         # --- Fazioni (sep_fazioni) ---
-        fazioni_ids = _to_ids(roles_map.get("sep_fazioni"))
+        fazioni_ids = roles_map.ids("sep_fazioni")
         payload["fazioni"] = _role_names(after, fazioni_ids)
 
         # --- Patenti/Licenze (sep_licenze) ---
-        licenze_ids = _to_ids(roles_map.get("sep_licenze"))
+        licenze_ids = roles_map.ids("sep_licenze")
         payload["patenti_extra"] = _role_names(after, licenze_ids)
 
         # Applica in un colpo solo
-        set_profile(after.id, **payload)
+        await aset_profile(after.id, **payload)
 
-    # 🏦 Esempi helper (se vuoi riusarli altrove)
-    async def aggiorna_wallet(self, user_id: int, importo: float):
-        prof = get_profile(user_id)
-        nuovo = float(prof.get("wallet") or 0) + float(importo)
-        set_profile(user_id, wallet=nuovo)
+    # 🏦 Esempi helper (se vuoi riusarli altrove): i saldi stanno nel servizio conti, per gilda.
+    # Senza guild_id si usa la gilda dell'economia (stessa firma (user_id, importo) di prima).
+    def _guild_id(self, guild_id: Optional[int]) -> int:
+        gid = guild_id or accounts.economy_guild_id([g.id for g in self.bot.guilds])
+        if gid is None:
+            raise ValueError("guild_id mancante: il bot è in più gilde e ECONOMY_GUILD_ID non è impostata")
+        return gid
 
-    async def aggiorna_banca(self, user_id: int, importo: float):
-        prof = get_profile(user_id)
-        bank = dict(prof.get("bank") or {"iban": "", "saldo": 0.0})
-        bank["saldo"] = float(bank.get("saldo") or 0) + float(importo)
-        set_profile(user_id, bank=bank)
+    async def aggiorna_wallet(self, user_id: int, importo: float, *, guild_id: Optional[int] = None):
+        await accounts.acredit_wallet(self._guild_id(guild_id), user_id, importo)
 
+    async def aggiorna_banca(self, user_id: int, importo: float, *, guild_id: Optional[int] = None):
+        await accounts.acredit_bank(self._guild_id(guild_id), user_id, importo)
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(ProfiliAuto(bot))
\ No newline at end of file
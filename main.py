@@ -9,12 +9,14 @@ import logging
 import discord
 from discord.ext import commands
 
+from utils import async_io, audit_log, ledger, profili
+
 # === CONFIG ===
 DEV_GUILD_ID = 1408579338777002077  # server principale di test/uso
 DATA_VOTAZIONE_FILE = "data/votazione_data.json"
 
-# === LOGGING ===
-logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+# Importare questo modulo non deve avere effetti: i worker "spawn" di utils/ledger_verify lo
+# rieseguono come __mp_main__. Logging, cartelle e bot si preparano solo sotto __main__ / in _runner.
 
 # === INTENTS ===
 intents = discord.Intents.default()
@@ -23,16 +25,9 @@ intents.members = True
 intents.message_content = True
 intents.presences = True
 
-# === BOT ===
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-# === CARTELLE DATA ===
-os.makedirs("data", exist_ok=True)
-os.makedirs("data/annunci", exist_ok=True)
-
 
 # ---------- Ripristino Votazione SSU ----------
-async def _restore_votazione_if_any() -> bool:
+async def _restore_votazione_if_any(bot: commands.Bot) -> bool:
     """Ripristina la VotazioneView SSU dal file JSON, se esiste."""
     try:
         from views.votazione_view import VotazioneView
@@ -96,7 +91,7 @@ async def _restore_votazione_if_any() -> bool:
 
 
 # ---------- Ripristino Annunci ----------
-async def _restore_annunci_if_any() -> int:
+async def _restore_annunci_if_any(bot: commands.Bot) -> int:
     """Ripristina le view degli Annunci persistenti da utils/annuncio_storage."""
     restored = 0
     try:
@@ -127,7 +122,7 @@ async def _restore_annunci_if_any() -> int:
         logging.warning("⚠️ Manca views/tipi/evento_view.py")
 
     try:
-        states = store.all_states()
+        states = await store.aall_states()
     except Exception as e:
         logging.exception(f"❌ Errore lettura stati Annunci: {e}")
         return 0
@@ -164,8 +159,7 @@ async def _restore_annunci_if_any() -> int:
 
 
 # ---------- Setup ----------
-@bot.event
-async def setup_hook():
+async def _setup_hook(bot: commands.Bot):
     # Carica COGS
     if os.path.isdir("./cogs"):
         for filename in os.listdir("./cogs"):
@@ -194,14 +188,14 @@ async def setup_hook():
     except Exception:
         VotazioneView = None
         logging.warning("⚠️ views/votazione_view.py non trovato.")
-    restored_ssu = await _restore_votazione_if_any()
+    restored_ssu = await _restore_votazione_if_any(bot)
     if not restored_ssu and VotazioneView:
         try:
             bot.add_view(VotazioneView())
             logging.info("ℹ️ Registrata VotazioneView SSU globale (nessun restore attivo).")
         except Exception:
             pass
-    await _restore_annunci_if_any()
+    await _restore_annunci_if_any(bot)
 
     # (Facoltativo) altre view persistenti se presenti
     for dotted, kwargs in [
@@ -222,8 +216,7 @@ async def setup_hook():
 
 
 # ---------- Ready ----------
-@bot.event
-async def on_ready():
+async def _on_ready(bot: commands.Bot):
     guilds_str = ", ".join(f"{g.name} ({g.id})" for g in bot.guilds)
     logging.info(f"✅ {bot.user} è online | Guilds: {guilds_str} | latency {bot.latency:.3f}s")
 
@@ -246,15 +239,47 @@ async def on_ready():
         logging.exception(f"❌ Errore sync slash: {e}")
 
 
+# ---------- Bot ----------
+def create_bot() -> commands.Bot:
+    """Un bot nuovo per ogni avvio del runner (un Bot chiuso non si riavvia su un altro loop)."""
+    bot = commands.Bot(command_prefix="!", intents=intents)
+
+    @bot.event
+    async def setup_hook():
+        await _setup_hook(bot)
+
+    @bot.event
+    async def on_ready():
+        await _on_ready(bot)
+
+    return bot
+
+
 # ---------- Runner con riavvio automatico ----------
 async def _runner():
     token = os.getenv("DISCORD_TOKEN")
     if not token:
         raise SystemExit("❌ Manca DISCORD_TOKEN nei Secrets/Deployment.")
-    await bot.start(token, reconnect=True)
+    bot = create_bot()
+    try:
+        async with bot:
+            await bot.start(token, reconnect=True)
+    finally:
+        # salva le modifiche ai profili ancora in cache, poi chiude store, ledger, audit e pool I/O
+        profili.close()
+        ledger.close()
+        audit_log.close()
+        async_io.shutdown()
 
 
 if __name__ == "__main__":
+    # === LOGGING ===
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+    # === CARTELLE DATA ===
+    os.makedirs("data", exist_ok=True)
+    os.makedirs("data/annunci", exist_ok=True)
+
     delay = 5
     while True:
         try:
@@ -62,4 +62,4 @@ class AnnuncioEventoModal(discord.ui.Modal, title="Crea Evento / Iscrizioni"):
         from views.tipi.evento_view import EventoView
         view = EventoView(msg.id, state)
         await msg.edit(view=view)
-        store.save(msg.id, state)
\ No newline at end of file
+        await store.asave(msg.id, state)
\ No newline at end of file
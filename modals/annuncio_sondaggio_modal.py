@@ -15,4 +15,4 @@ class AnnuncioSondaggioModal(discord.ui.Modal, title="Crea Sondaggio Rapido"):
         embed = discord.Embed(title="📊 Sondaggio", description=str(self.domanda.value), color=discord.Color.gold())
         view = SondaggioView(interaction.id, ops)
         msg = await interaction.response.send_message(embed=embed, view=view)
-        store.save(msg.id, {"tipo": "sondaggio", "domanda": self.domanda.value, "opzioni": ops, "voti": {o: [] for o in ops}})
\ No newline at end of file
+        await store.asave(msg.id, {"tipo": "sondaggio", "domanda": self.domanda.value, "opzioni": ops, "voti": {o: [] for o in ops}})
\ No newline at end of file
@@ -13,4 +13,4 @@ class AnnuncioStandardModal(discord.ui.Modal, title="Crea Annuncio Standard"):
         embed = discord.Embed(title=str(self.titolo.value), description=str(self.descrizione.value), color=discord.Color.gold())
         embed.set_footer(text="VeneziaRP | Annunci")
         msg = await interaction.response.send_message(embed=embed)
-        store.save(msg.id, {"tipo": "standard", "titolo": self.titolo.value, "descrizione": self.descrizione.value})
\ No newline at end of file
+        await store.asave(msg.id, {"tipo": "standard", "titolo": self.titolo.value, "descrizione": self.descrizione.value})
\ No newline at end of file
@@ -15,4 +15,4 @@ class AnnuncioVotazioneModal(discord.ui.Modal, title="Crea Annuncio con Votazion
         embed.set_footer(text="VeneziaRP | Annunci")
         view = VotazioneView(interaction.id)
         msg = await interaction.response.send_message(embed=embed, view=view)
-        store.save(msg.id, {"tipo": "votazione", "yes": [], "no": [], "maybe": []})
\ No newline at end of file
+        await store.asave(msg.id, {"tipo": "votazione", "yes": [], "no": [], "maybe": []})
\ No newline at end of file
@@ -0,0 +1,39 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+
+# i moduli si importano come nel bot (dalla radice del repo: `utils.ledger`, ...)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Cartella di lavoro temporanea: i percorsi dei moduli (data/...) sono relativi."""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "data").mkdir()
+    return tmp_path
+
+
+@pytest.fixture
+def profiles(workdir, monkeypatch):
+    """utils.profili con una cache (e uno store) nuovi nella cartella temporanea."""
+    from utils import profili
+    cache = profili._ProfileCache()
+    monkeypatch.setattr(profili, "_cache", cache)
+    yield profili
+    cache.close()
+
+
+@pytest.fixture
+def economy(workdir, monkeypatch):
+    """Ledger, audit e stato del payroll nuovi, nella cartella temporanea."""
+    from utils import audit_log, ledger, payroll
+    led = ledger.Ledger(workdir / "data" / "ledger.jsonl")
+    monkeypatch.setattr(ledger, "_ledger", led)
+    monkeypatch.setattr(payroll, "_progress", None)
+    audit_log.close()
+    yield led
+    audit_log.close()
+    led.close()
@@ -0,0 +1,64 @@
+# tests/test_accounts.py
+import asyncio
+
+import pytest
+
+from utils import accounts, audit_log, economy as econ
+from utils.ledger import mint_account
+
+G = 1
+
+
+def test_deposit_and_withdraw_move_between_wallet_and_bank(economy):
+    accounts.credit_wallet(G, 5, 100)
+    assert accounts.deposit(G, 5, 30) == accounts.Movement(7000, 3000, False)
+    assert accounts.withdraw(G, 5, "10,50") == accounts.Movement(8050, 1950, False)
+    assert accounts.balances(G, 5) == (8050, 1950)
+    assert economy.balance(mint_account(G)) == -10000
+
+
+def test_movements_are_idempotent_by_key(economy):
+    accounts.credit_wallet(G, 5, 100)
+    first = accounts.deposit(G, 5, 30, key="itx:1")
+    again = accounts.deposit(G, 5, 30, key="itx:1")
+    assert again == first._replace(replayed=True)
+    assert accounts.balances(G, 5) == (7000, 3000)
+    audit_log.flush()
+    assert [r["op"] for r in audit_log.statement(G, 5)] == ["DEPOSIT", "CREDIT"]
+
+
+def test_insufficient_funds_is_a_readable_value_error(economy):
+    accounts.credit_wallet(G, 5, 1)
+    with pytest.raises(ValueError, match="Fondi insufficienti nel portafoglio"):
+        accounts.deposit(G, 5, 2)
+    with pytest.raises(ValueError, match="importo positivo"):
+        accounts.withdraw(G, 5, 0)
+
+
+def test_payroll_credits_are_one_transaction(economy):
+    tx = accounts.credit_bank_many(G, {1: 100, 2: 0, 3: 250}, "PAYROLL", key="payroll:x")
+    assert len(tx["legs"]) == 3
+    assert accounts.credit_bank_many(G, {1: 100, 3: 250}, "PAYROLL", key="payroll:x")["replayed"]
+    assert accounts.balances(G, 3) == (0, 250)
+    assert accounts.credit_bank_many(G, {}, "PAYROLL") == {}
+
+
+def test_economy_iban_lives_on_the_profile(economy, profiles):
+    econ.set_iban(G, 5, "IT60X0542811101000000123456")
+    assert profiles.get_profile(5)["bank"]["iban"] == "IT60X0542811101000000123456"
+    acct = econ.deposit_bank(G, 5, 12.5)
+    assert acct["bank"] == {"iban": "IT60X0542811101000000123456", "balance": 12.5}
+    acct = econ.withdraw_bank(G, 5, 2.5)
+    assert acct["cents"]["bank"] == 1000
+    acct = asyncio.run(econ.aget_account(G, 5))
+    assert acct["bank"]["iban"] == "IT60X0542811101000000123456"
+
+
+def test_economy_transfer_is_atomic(economy, profiles):
+    econ.deposit_bank(G, 1, 10)
+    tx = econ.transfer_bank(G, 1, 2, 4, key="itx:9")
+    assert tx["after"] == {"bank:1:1": 600, "bank:1:2": 400}
+    assert econ.transfer_bank(G, 1, 2, 4, key="itx:9")["replayed"]
+    with pytest.raises(ValueError, match="Fondi insufficienti sul conto"):
+        econ.transfer_bank(G, 1, 2, 100)
+    assert accounts.balances(G, 2) == (0, 400)
@@ -0,0 +1,48 @@
+# tests/test_async_io.py
+import asyncio
+import threading
+
+import pytest
+
+from utils import async_io
+from utils.async_io import io_stats, read_json_sync, run_io, write_json_sync
+
+
+def test_run_io_runs_off_the_event_loop():
+    async def main():
+        loop_thread = threading.get_ident()
+        return loop_thread, await run_io(threading.get_ident)
+
+    loop_thread, worker_thread = asyncio.run(main())
+    assert loop_thread != worker_thread
+
+
+def test_pool_is_recreated_after_shutdown():
+    # main.py: shutdown() a fine runner, poi un nuovo asyncio.run deve poter usare di nuovo il pool
+    assert asyncio.run(run_io(sum, [1, 2])) == 3
+    async_io.shutdown()
+    assert asyncio.run(run_io(sum, [3, 4])) == 7
+
+
+def test_stats_count_calls_and_errors_from_many_threads():
+    before = io_stats()
+
+    def boom():
+        raise KeyError
+
+    async def main():
+        await asyncio.gather(*(run_io(int, "1") for _ in range(500)))
+        with pytest.raises(KeyError):
+            await run_io(boom)
+
+    asyncio.run(main())
+    after = io_stats()
+    assert after["calls"] - before["calls"] == 501
+    assert after["errors"] - before["errors"] == 1
+
+
+def test_json_roundtrip(tmp_path):
+    path = tmp_path / "sub" / "x.json"
+    write_json_sync(path, {"a": [1, "è"]})
+    assert read_json_sync(path, None) == {"a": [1, "è"]}
+    assert read_json_sync(tmp_path / "missing.json", {"d": 1}) == {"d": 1}
@@ -0,0 +1,78 @@
+# tests/test_audit_log.py
+import random
+import time
+
+import pytest
+
+from utils.audit_log import AuditLog, AuditWriter
+
+JAN = time.mktime((2026, 1, 15, 0, 0, 0, 0, 0, 0))
+FEB = time.mktime((2026, 2, 15, 0, 0, 0, 0, 0, 0))
+
+
+@pytest.fixture
+def audit(tmp_path):
+    a = AuditLog(tmp_path / "audit")
+    yield a
+    a.close()
+
+
+def _rec(t, uid, cents, gid=1):
+    return {"t": t, "guild_id": gid, "user_id": uid, "cents": cents, "op": "X"}
+
+
+def test_statement_is_newest_first_across_segments(audit):
+    audit.append_many([_rec(JAN + i, 7, i) for i in range(5)] + [_rec(FEB + i, 7, 100 + i) for i in range(3)])
+    assert [r["cents"] for r in audit.statement(1, 7, limit=5)] == [102, 101, 100, 4, 3]
+    assert [r["cents"] for r in audit.statement(1, 7, limit=3, before=FEB)] == [4, 3, 2]
+    assert list(audit.statement(2, 7)) == []
+
+
+def test_closed_segment_lookup_matches_a_full_scan(audit):
+    rnd = random.Random(3)
+    recs = [_rec(JAN + i, rnd.randint(1, 300), i) for i in range(3000)]
+    audit.append_many(recs)
+    audit.append_many([_rec(FEB, 1, -1)])  # gennaio ora è chiuso: si cerca nell'indice ordinato
+    for uid in (0, 1, 150, 300, 301):
+        expected = [r["cents"] for r in reversed(recs) if r["user_id"] == uid]
+        got = [r["cents"] for r in audit.statement(1, uid, limit=10_000) if r["t"] < FEB]
+        assert got == expected
+    assert (audit.dir / "economy-2026-01.sidx").exists()
+
+
+def test_late_record_in_a_closed_segment_is_found(audit):
+    audit.append_many([_rec(JAN, 7, 1), _rec(FEB, 8, 0)])
+    assert [r["cents"] for r in audit.statement(1, 7)] == [1]   # costruisce la .sidx di gennaio
+    audit.append_many([_rec(JAN + 1, 7, 2)])                    # record in ritardo su gennaio
+    audit.append_many([_rec(FEB + 1, 8, 0)])
+    assert [r["cents"] for r in audit.statement(1, 7)] == [2, 1]
+
+
+def test_record_without_index_line_is_reindexed(tmp_path):
+    a = AuditLog(tmp_path / "audit")
+    a.append_many([_rec(JAN, 7, 1)])
+    a.close()
+    # crash tra la scrittura del record e quella della sua riga d'indice
+    with (tmp_path / "audit" / "economy-2026-01.jsonl").open("a", encoding="utf-8") as f:
+        f.write('{"t": %s, "guild_id": 1, "user_id": 7, "cents": 2}\n' % JAN)
+        f.write('{"t": %s, "guild_id": 1, "user_id": 7, "cents": 3' % JAN)  # troncato
+    b = AuditLog(tmp_path / "audit")
+    assert [r["cents"] for r in b.statement(1, 7)] == [2, 1]
+    b.append_many([_rec(JAN, 9, 0)])  # riapre il segmento: ripara l'indice su disco
+    b.close()
+    idx = (tmp_path / "audit" / "economy-2026-01.idx").read_text().split("\n")
+    assert sum(1 for line in idx if line.startswith("1:7 ")) == 2
+
+
+def test_writer_groups_records_and_flushes(audit):
+    w = AuditWriter(audit)
+    for i in range(1000):
+        w.submit(_rec(JAN + i, i % 10, i))
+    w.flush()
+    st = w.stats()
+    assert st["records"] == 1000 and st["pending"] == 0
+    assert st["batches"] < 1000
+    assert len(list(audit.statement(1, 3, limit=1000))) == 100
+    w.close()
+    with pytest.raises(RuntimeError):
+        w.submit(_rec(JAN, 1, 1))
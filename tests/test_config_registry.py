@@ -0,0 +1,67 @@
+# tests/test_config_registry.py
+import asyncio
+import json
+import os
+
+import pytest
+
+from utils import config_registry
+from utils.config_registry import ConfigRegistry, Snapshot
+
+
+def _write(path, data, mtime):
+    path.write_text(json.dumps(data) if not isinstance(data, str) else data, encoding="utf-8")
+    os.utime(path, (mtime, mtime))  # mtime distinti anche su filesystem a bassa risoluzione
+
+
+def _positive(data):
+    if data.get("n", 0) < 0:
+        raise ValueError("n negativo")
+    return data.get("n", 0)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    monkeypatch.setattr(config_registry, "CHECK_INTERVAL", 0.0)
+    reg = ConfigRegistry()
+    reg.register("roles", tmp_path / "roles.json")
+    reg.register("eco", tmp_path / "eco.json", _positive)
+    return reg
+
+
+def test_snapshot_is_frozen_with_role_ids_ready():
+    snap = Snapshot({"staff": ["1", 2, "x"], "cittadino": "3", "groups": {"vip": [4]}, "lista": [{"a": 1}]}, 0.0)
+    assert snap.ids("staff") == {1, 2}
+    assert snap.ids("mancante", "groups.vip") == {4}
+    assert snap.id("cittadino") == 3 and snap.id("staff") is None
+    with pytest.raises(TypeError):
+        snap.data["staff"] = []
+    with pytest.raises(TypeError):
+        snap["lista"][0]["a"] = 2
+
+
+def test_file_is_reread_only_when_it_changes(registry, tmp_path):
+    path = tmp_path / "roles.json"
+    _write(path, {"staff": [1]}, 1000)
+    first = registry.get("roles")
+    assert first.ids("staff") == {1}
+    assert registry.get("roles") is first  # stesso mtime: nessuna rilettura
+    _write(path, {"staff": [2]}, 2000)
+    assert asyncio.run(registry.aget("roles")).ids("staff") == {2}
+
+
+def test_invalid_file_keeps_the_last_good_snapshot(registry, tmp_path):
+    path = tmp_path / "eco.json"
+    _write(path, {"n": -1}, 500)
+    assert registry.get("eco").fallback  # mai stato valido: configurazione vuota
+    _write(path, {"n": 5}, 1000)
+    good = registry.get("eco")
+    assert good.extra == 5 and not good.fallback
+    _write(path, {"n": -1}, 2000)
+    assert registry.get("eco") is good
+    assert "n negativo" in registry.errors()["eco"]
+    _write(path, "{rotto", 3000)
+    assert registry.reload(["eco"])["eco"] and registry.get("eco") is good
+    _write(path, {"n": 7}, 4000)
+    assert registry.reload() == {"roles": None, "eco": None}
+    assert registry.get("eco").extra == 7 and registry.errors() == {}
@@ -0,0 +1,72 @@
+# tests/test_economy_config.py
+import json
+from pathlib import Path
+
+import pytest
+
+from utils.economy_config import DEFAULTS, SCHEMA, ConfigError, compile_config
+
+SHIPPED = Path(__file__).resolve().parent.parent / "data" / "economy_config.json"
+
+
+def test_shipped_config_is_valid_and_agrees_with_the_schema():
+    data = json.loads(SHIPPED.read_text(encoding="utf-8"))
+    cfg = compile_config(data)
+    assert len(cfg.salary) > 0
+    # dove il file e lo schema danno un valore allo stesso campo non devono divergere per sbaglio
+    assert cfg.min_operation_amount == DEFAULTS.min_operation_amount
+
+
+def test_defaults_come_from_the_schema():
+    assert DEFAULTS.min_operation_amount == SCHEMA["min_operation_amount"][1]
+    assert DEFAULTS.payroll_mode == "monthly"
+    assert len(DEFAULTS.salary) == 0
+
+
+def test_salary_entries_are_compiled_to_cents():
+    cfg = compile_config({
+        "salary_per_cycle": {
+            "_commento": "ignorato",
+            "111": 800,
+            "222": {"amount": 12.5, "label": "Cittadino", "_nota": "x"},
+            "333": 0,
+        },
+    })
+    assert cfg.salary.get(111) == 80000
+    assert cfg.salary.get(222) == 1250
+    assert cfg.salary.label(222) == "Cittadino"
+    assert 333 not in cfg.salary
+    assert cfg.salary.pick([111, 222, 999]) == (80000, 111)
+
+
+def test_all_errors_are_reported_together():
+    with pytest.raises(ConfigError) as e:
+        compile_config({
+            "min_operation_amount": "dieci",
+            "max_operation_amount": True,
+            "payroll_mode": "weekly",
+            "delete_logs_after_seconds": -1,
+            "boh": 1,
+            "salary_per_cycle": {"abc": 1, "111": {"amount": -5}, "222": {"amount": 1, "colore": "blu"}},
+        })
+    errors = e.value.errors
+    assert any(m.startswith("min_operation_amount: tipo non valido") for m in errors)
+    assert any(m.startswith("max_operation_amount: tipo non valido") for m in errors)  # bool non è un numero
+    assert any(m.startswith("payroll_mode:") for m in errors)
+    assert any(m.startswith("delete_logs_after_seconds:") for m in errors)
+    assert "boh: chiave sconosciuta" in errors
+    assert any(m.startswith("salary_per_cycle.abc:") for m in errors)
+    assert any(m.startswith("salary_per_cycle.111.amount:") for m in errors)
+    assert any(m.startswith("salary_per_cycle.222.colore:") for m in errors)
+
+
+def test_range_checks():
+    with pytest.raises(ConfigError, match="max_operation_amount"):
+        compile_config({"min_operation_amount": 50, "max_operation_amount": 10})
+    with pytest.raises(ConfigError, match="min_operation_amount"):
+        compile_config({"min_operation_amount": 0})
+
+
+def test_obsolete_keys_are_accepted():
+    cfg = compile_config({"payroll_minutes": 60})
+    assert cfg._replace(salary=None) == DEFAULTS._replace(salary=None)
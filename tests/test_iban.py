@@ -0,0 +1,61 @@
+# tests/test_iban.py
+import pytest
+
+from utils import iban as ib
+from utils.iban import generate_iban, issue_ibans, normalize_iban, validate_iban
+
+
+@pytest.mark.parametrize("value", [
+    "IT60X0542811101000000123456",
+    "it60 x054 2811 1010 0000 0123 456",
+    "GB82WEST12345698765432",
+    "DE89370400440532013000",
+])
+def test_valid_ibans(value):
+    assert validate_iban(value)
+
+
+@pytest.mark.parametrize("value", [
+    "IT61X0542811101000000123456",   # cifre di controllo sbagliate
+    "IT60X054281110100000012345",    # lunghezza IT errata
+    "GB82WEST1234569876543Z",
+    "",
+    None,
+    "ITXX",
+])
+def test_invalid_ibans(value):
+    assert not validate_iban(value)
+
+
+def test_normalize():
+    assert normalize_iban(" it60 x054\t2811 ") == "IT60X0542811"
+    assert normalize_iban(None) == ""
+
+
+def test_generated_ibans_are_valid_and_stable():
+    uid = 123456789012345678
+    a = generate_iban(uid)
+    assert validate_iban(a) and len(a) == 27 and a.startswith("IT")
+    assert a == generate_iban(uid)
+    assert a.endswith(f"{uid % 10**12:012d}")
+    assert validate_iban(generate_iban(uid, attempt=3)) and generate_iban(uid, 3) != a
+
+
+def test_issue_ibans_resolves_collisions():
+    # stesse ultime 12 cifre: al primo tentativo avrebbero lo stesso IBAN
+    u1, u2 = 10**12 + 42, 2 * 10**12 + 42
+    assert generate_iban(u1) == generate_iban(u2)
+    taken = {generate_iban(7)}
+    out = issue_ibans([u1, u2, 7], taken)
+    assert len(set(out.values())) == 3
+    assert out[u1] == generate_iban(u1)
+    assert out[7] != generate_iban(7)
+    assert all(validate_iban(v) for v in out.values())
+    assert set(out.values()) <= taken
+
+
+def test_issue_ibans_gives_up_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(ib, "MAX_ATTEMPTS", 2)
+    taken = {generate_iban(5, 0), generate_iban(5, 1)}
+    with pytest.raises(RuntimeError):
+        issue_ibans([5], taken)
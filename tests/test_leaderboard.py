@@ -0,0 +1,62 @@
+# tests/test_leaderboard.py
+import random
+
+import pytest
+
+from utils.leaderboard import Leaderboard, RankTree
+
+G = 1
+
+
+def test_rank_tree_matches_a_sorted_list():
+    rnd = random.Random(7)
+    tree, ref = RankTree(), []
+    for _ in range(2000):
+        key = (rnd.randint(-50, 0), rnd.randint(1, 40))
+        if key in ref and rnd.random() < 0.5:
+            tree.discard(key)
+            ref.remove(key)
+        elif key not in ref:
+            tree.add(key)
+            ref.append(key)
+    ref.sort()
+    assert len(tree) == len(ref)
+    assert [tree.select(i) for i in range(len(ref))] == ref
+    for i, key in enumerate(ref):
+        assert tree.rank(key) == i
+    with pytest.raises(IndexError):
+        tree.select(len(ref))
+
+
+def test_load_sums_wallet_and_bank_and_skips_system():
+    board = Leaderboard()
+    board.load({
+        f"wallet:{G}:1": 100, f"bank:{G}:1": 400,
+        f"bank:{G}:2": 300,
+        f"wallet:{G}:3": 0,
+        f"system:{G}:mint": -800,
+    })
+    assert board.top(G) == [(1, 1, 500), (2, 2, 300)]
+    assert board.rank(G, 3) is None
+    assert board.size(G) == 2
+
+
+def test_transactions_move_users_and_ties_break_by_id():
+    board = Leaderboard()
+    board.load({f"bank:{G}:1": 500, f"bank:{G}:2": 300})
+    board.on_transaction({"legs": [[f"bank:{G}:1", -200], [f"bank:{G}:2", 200]]})
+    assert board.top(G) == [(1, 2, 500), (2, 1, 300)]
+    board.on_transaction({"legs": [[f"system:{G}:mint", -200], [f"wallet:{G}:1", 200]]})
+    assert board.top(G) == [(1, 1, 500), (2, 2, 500)]
+    board.on_transaction({"legs": [[f"bank:{G}:2", -500], [f"system:{G}:mint", 500]]})
+    assert board.rank(G, 2) is None
+    assert board.rank(G, 1) == (1, 500)
+
+
+def test_pages():
+    board = Leaderboard()
+    board.load({f"bank:{G}:{u}": u * 10 for u in range(1, 26)})
+    assert board.pages(G, page_size=10) == 3
+    assert [r[0] for r in board.page(G, 2, page_size=10)] == [21, 22, 23, 24, 25]
+    assert board.page(G, 0, page_size=10)[0] == (1, 25, 250)
+    assert board.pages(999) == 1 and board.page(999, 0) == []
@@ -0,0 +1,124 @@
+# tests/test_ledger.py
+import pytest
+
+from utils.ledger import (
+    InsufficientFunds, Ledger, bank_account, from_cents, mint_account, to_cents, wallet_account,
+)
+
+G, U, V = 1, 10, 20
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    led = Ledger(tmp_path / "ledger.jsonl")
+    yield led
+    led.close()
+
+
+def _fund(led, account, cents):
+    return led.post([(mint_account(G), -cents), (account, cents)], "CREDIT")
+
+
+@pytest.mark.parametrize("amount, cents", [
+    (1, 100), (0.1, 10), ("2,50", 250), (" 3.005 ", 301), (-1.5, -150), (0.015, 2),
+])
+def test_to_cents(amount, cents):
+    assert to_cents(amount) == cents
+
+
+@pytest.mark.parametrize("amount", [True, float("nan"), float("inf"), "abc", "1e999999"])
+def test_to_cents_rejects(amount):
+    with pytest.raises(ValueError):
+        to_cents(amount)
+
+
+def test_from_cents():
+    assert from_cents(12345) == 123.45
+
+
+def test_post_moves_balances_and_keeps_total_zero(ledger):
+    _fund(ledger, wallet_account(G, U), 1000)
+    tx = ledger.transfer(wallet_account(G, U), bank_account(G, U), 400, "DEPOSIT")
+    assert tx["seq"] == 2
+    assert ledger.balance(wallet_account(G, U)) == 600
+    assert ledger.balance(bank_account(G, U)) == 400
+    assert ledger.balance(mint_account(G)) == -1000
+    assert sum(ledger.balances().values()) == 0
+
+
+def test_post_rejects_unbalanced_and_empty(ledger):
+    with pytest.raises(ValueError):
+        ledger.post([(wallet_account(G, U), 100)], "X")
+    with pytest.raises(ValueError):
+        ledger.post([(wallet_account(G, U), 100), (wallet_account(G, U), -100)], "X")
+    assert ledger.seq == 0
+
+
+def test_insufficient_funds_writes_nothing(ledger):
+    _fund(ledger, bank_account(G, U), 100)
+    with pytest.raises(InsufficientFunds) as e:
+        ledger.transfer(bank_account(G, U), bank_account(G, V), 101, "BANK_TRANSFER")
+    assert (e.value.available, e.value.requested) == (100, 101)
+    assert ledger.seq == 1
+    assert ledger.balance(bank_account(G, V)) == 0
+
+
+def test_system_account_can_go_negative(ledger):
+    _fund(ledger, wallet_account(G, U), 5)
+    assert ledger.balance(mint_account(G)) == -5
+
+
+def test_replay_rebuilds_the_same_balances(ledger, tmp_path):
+    _fund(ledger, wallet_account(G, U), 1000)
+    ledger.transfer(wallet_account(G, U), bank_account(G, V), 250, "X")
+    before = ledger.balances()
+    ledger.close()
+    again = Ledger(tmp_path / "ledger.jsonl")
+    assert again.balances() == before
+    assert again.rebuild() == before
+    assert again.seq == 2
+
+
+def test_truncated_tail_is_discarded(ledger, tmp_path):
+    _fund(ledger, wallet_account(G, U), 1000)
+    ledger.close()
+    path = tmp_path / "ledger.jsonl"
+    with path.open("ab") as f:
+        f.write(b'{"seq":2,"t":0,"kind":"X","legs":[["wallet:1:10",-5')
+    again = Ledger(path)
+    assert again.seq == 1
+    assert again.balance(wallet_account(G, U)) == 1000
+    assert path.read_bytes().endswith(b"\n")
+    assert again.offset == path.stat().st_size
+
+
+def test_repeated_key_is_replayed_not_reposted(ledger):
+    _fund(ledger, wallet_account(G, U), 1000)
+    first = ledger.transfer(wallet_account(G, U), bank_account(G, U), 300, "DEPOSIT", key="itx:1")
+    again = ledger.transfer(wallet_account(G, U), bank_account(G, U), 300, "DEPOSIT", key="itx:1")
+    assert again["replayed"] is True
+    assert again["seq"] == first["seq"]
+    assert again["after"] == {wallet_account(G, U): 700, bank_account(G, U): 300}
+    assert ledger.seq == 2
+    assert ledger.balance(bank_account(G, U)) == 300
+
+
+def test_key_survives_restart(ledger, tmp_path):
+    _fund(ledger, wallet_account(G, U), 1000)
+    ledger.transfer(wallet_account(G, U), bank_account(G, U), 300, "DEPOSIT", key="itx:2")
+    ledger.close()
+    again = Ledger(tmp_path / "ledger.jsonl")
+    tx = again.transfer(wallet_account(G, U), bank_account(G, U), 300, "DEPOSIT", key="itx:2")
+    assert tx["replayed"] is True
+    assert again.balance(bank_account(G, U)) == 300
+
+
+def test_find_looks_past_the_in_memory_index(ledger):
+    offset = ledger.offset
+    tx = _fund(ledger, wallet_account(G, U), 50)
+    ledger.post([(mint_account(G), -1), (wallet_account(G, V), 1)], "OPENING", key="opening:x")
+    ledger._keys.clear()  # chiave scaduta/espulsa dall'LRU
+    assert ledger.lookup("opening:x") is None
+    found = ledger.find("opening:x", offset)
+    assert found is not None and found["seq"] == tx["seq"] + 1
+    assert ledger.find("missing") is None
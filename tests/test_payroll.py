@@ -0,0 +1,118 @@
+# tests/test_payroll.py
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from utils import accounts, audit_log, payroll
+from utils.ledger import bank_account
+from utils.payroll import SalaryIndex, arun_payroll, load_progress, plan_guild
+
+G = 1
+CITTADINO, VIP = 100, 200
+INDEX = SalaryIndex({CITTADINO: 800, VIP: 5000})
+
+
+def _guild(n=10):
+    members = [
+        SimpleNamespace(id=uid, bot=False, roles=[SimpleNamespace(id=CITTADINO)] + ([SimpleNamespace(id=VIP)] if uid % 5 == 0 else []))
+        for uid in range(1, n + 1)
+    ]
+    members.append(SimpleNamespace(id=999, bot=True, roles=[SimpleNamespace(id=VIP)]))
+    members.append(SimpleNamespace(id=500, bot=False, roles=[]))
+    return SimpleNamespace(id=G, members=members)
+
+
+def _paid(ledger, uid):
+    return ledger.balance(bank_account(G, uid))
+
+
+def test_plan_picks_the_best_paid_role_and_skips_bots():
+    plan = plan_guild(_guild(), INDEX)
+    assert plan.scanned == 11
+    assert len(plan.entries) == 10
+    assert plan.credits()[5] == 5000 and plan.credits()[4] == 800
+    assert plan.by_role() == {VIP: (2, 10000), CITTADINO: (8, 6400)}
+
+
+def test_chunked_run_pays_everyone_once(economy):
+    async def main():
+        first = await arun_payroll(_guild(), INDEX, "payroll:1:2026-10", chunk_size=3)
+        second = await arun_payroll(_guild(), INDEX, "payroll:1:2026-10", chunk_size=3)
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first["done"] and first["paid"] == 10 and first["total"] == 16400
+    assert first["chunks"] == 4
+    assert second.get("already") is True
+    assert economy.seq == 4
+    assert _paid(economy, 5) == 5000 and _paid(economy, 7) == 800 and _paid(economy, 500) == 0
+    audit_log.flush()
+    assert len(audit_log.statement(G, 5)) == 1
+
+
+def test_resume_after_a_crash_pays_only_the_rest(economy, monkeypatch):
+    real = accounts.acredit_bank_many
+    calls = []
+
+    async def dies_on_second_chunk(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 2:
+            raise SystemExit("crash")
+        return await real(*args, **kwargs)
+
+    monkeypatch.setattr(accounts, "acredit_bank_many", dies_on_second_chunk)
+    with pytest.raises(SystemExit):
+        asyncio.run(arun_payroll(_guild(), INDEX, "payroll:1:2026-11", chunk_size=4))
+    monkeypatch.setattr(accounts, "acredit_bank_many", real)
+    monkeypatch.setattr(payroll, "_progress", None)  # nuovo processo
+
+    result = asyncio.run(arun_payroll(_guild(), INDEX, "payroll:1:2026-11", chunk_size=4))
+    assert result["resumed"] and result["done"]
+    assert result["paid"] == 10 and result["total"] == 16400
+    assert all(_paid(economy, uid) in (800, 5000) for uid in range(1, 11))
+
+
+def test_crash_between_post_and_checkpoint_is_not_paid_twice(economy, monkeypatch):
+    real = accounts.acredit_bank_many
+
+    async def dies_after_posting(*args, **kwargs):
+        await real(*args, **kwargs)
+        raise SystemExit("crash dopo il post")
+
+    monkeypatch.setattr(accounts, "acredit_bank_many", dies_after_posting)
+    with pytest.raises(SystemExit):
+        asyncio.run(arun_payroll(_guild(), INDEX, "payroll:1:2026-12", chunk_size=20))
+    monkeypatch.setattr(accounts, "acredit_bank_many", real)
+    monkeypatch.setattr(payroll, "_progress", None)
+    economy._keys.clear()  # anche oltre il TTL dell'indice in memoria
+
+    result = asyncio.run(arun_payroll(_guild(), INDEX, "payroll:1:2026-12", chunk_size=20))
+    assert result["done"] and result["total"] == 16400
+    assert economy.seq == 1
+    assert _paid(economy, 5) == 5000
+
+
+def test_first_load_clears_stale_running_flags(workdir, monkeypatch):
+    monkeypatch.setattr(payroll, "_progress", None)
+    (workdir / "data" / "payroll_progress.json").write_text(json.dumps({
+        "payroll:1:2026-09": {"guild_id": G, "running": True, "done": False, "updated": 1},
+    }))
+    state = asyncio.run(load_progress())
+    assert state["payroll:1:2026-09"]["running"] is False
+
+
+def test_locks_survive_a_runner_restart(monkeypatch):
+    monkeypatch.setattr(payroll, "_locks", {})
+
+    async def contended():
+        lock = payroll._lock("payroll:x")
+        async with lock:
+            waiter = asyncio.ensure_future(payroll._lock("payroll:x").acquire())
+            await asyncio.sleep(0)
+        await waiter
+        payroll._lock("payroll:x").release()
+
+    asyncio.run(contended())
+    asyncio.run(contended())
@@ -0,0 +1,172 @@
+# tests/test_profili.py
+import asyncio
+from collections.abc import Mapping
+
+import pytest
+
+from utils.profili import PROFILE_DEFAULTS, ProfileView
+
+
+def test_view_overlays_saved_data_on_the_defaults():
+    v = ProfileView({"nome_rp": "Marco", "bank": {"iban": "IT00"}, "extra": 1})
+    assert v["nome_rp"] == "Marco"
+    assert v["cognome_rp"] == ""
+    assert v["bank"]["iban"] == "IT00"
+    assert v["bank"]["saldo"] == 0.0          # default del sotto-dict
+    assert v["docs"]["patenti"]["B"]["stato"] is False
+    assert v["extra"] == 1
+    assert isinstance(v["bank"], ProfileView)
+    with pytest.raises(KeyError):
+        v["nope"]
+
+
+def test_none_keeps_the_default():
+    v = ProfileView({"bio": None, "docs": None, "senza_default": None})
+    assert v["bio"] == ""
+    assert isinstance(v["docs"], Mapping) and "patenti" in v["docs"]
+    assert v["senza_default"] is None
+
+
+def test_iteration_and_len_include_extra_keys():
+    v = ProfileView({"extra": 1, "bio": "x"})
+    keys = list(v)
+    assert keys[: len(PROFILE_DEFAULTS)] == list(PROFILE_DEFAULTS)
+    assert keys[-1] == "extra" and keys.count("bio") == 1
+    assert len(v) == len(PROFILE_DEFAULTS) + 1
+    assert "extra" in v and "bio" in v and "nope" not in v
+
+
+def test_to_dict_is_a_detached_mutable_copy():
+    data = {"bank": {"iban": "IT00"}, "fazioni": ["a"]}
+    v = ProfileView(data)
+    d = v.to_dict()
+    d["bank"]["iban"] = "changed"
+    d["fazioni"].append("b")
+    d["proprieta"]["case"].append("casa")
+    assert data == {"bank": {"iban": "IT00"}, "fazioni": ["a"]}
+    assert ProfileView(None)["proprieta"]["case"] == ()
+    assert v.to_dict()["fazioni"] == ["a"]
+
+
+def test_defaults_are_read_only():
+    with pytest.raises(TypeError):
+        PROFILE_DEFAULTS["bio"] = "x"
+    with pytest.raises(TypeError):
+        ProfileView(None)["bank"]["iban"] = "x"
+
+
+def test_get_profile_projection(profiles):
+    profiles.set_profile(1, nome_rp="Ada", bank={"iban": "IT00"})
+    assert profiles.get_profile(1, fields=["bank.iban"]) == {"bank": {"iban": "IT00"}}
+    full = profiles.get_profile(1)
+    assert full["nome_rp"] == "Ada" and full["bank"]["saldo"] == 0.0
+    assert profiles.get_profile(2)["bio"] == ""
+
+
+def _counter(view):
+    return int(view["bio"] or 0)
+
+
+def test_update_profile_serializes_concurrent_updates(profiles):
+    async def bump(view):
+        n = _counter(view)
+        await asyncio.sleep(0)  # il profilo potrebbe cambiare qui
+        return {"bio": str(n + 1)}
+
+    async def main():
+        await asyncio.gather(*(profiles.update_profile(1, bump) for _ in range(100)))
+        await profiles.aflush()
+
+    asyncio.run(main())
+    assert profiles.get_profile(1)["bio"] == "100"
+
+
+def test_compare_and_set_rejects_a_stale_revision(profiles):
+    rev = profiles.profile_revision(1)
+    assert profiles.compare_and_set_profile(1, rev, bio="a")
+    assert not profiles.compare_and_set_profile(1, rev, bio="b")
+    assert profiles.get_profile(1)["bio"] == "a"
+
+
+def test_update_profile_error_aborts(profiles):
+    def fail(view):
+        raise ValueError("fondi insufficienti")
+
+    with pytest.raises(ValueError):
+        asyncio.run(profiles.update_profile(1, fail))
+    assert profiles.profile_revision(1) == 0
+
+
+def test_profile_lock_works_across_runner_restarts(profiles):
+    # main.py riavvia il runner con un nuovo asyncio.run: i lock del loop precedente non valgono più
+    async def contended():
+        async def bump(view):
+            await asyncio.sleep(0)
+            return {"bio": str(_counter(view) + 1)}
+        await asyncio.gather(*(profiles.update_profile(7, bump) for _ in range(20)))
+        await profiles.aflush()
+
+    asyncio.run(contended())
+    asyncio.run(contended())
+    assert profiles.get_profile(7)["bio"] == "40"
+
+
+def test_writes_inside_the_loop_are_coalesced_into_one_flush(profiles):
+    async def main():
+        for i in range(10):
+            profiles.set_profile(1, bio=str(i))
+        assert profiles.cache_stats()["pending"] == 1
+        return await profiles.aflush()
+
+    assert asyncio.run(main()) == 1
+    st = profiles.cache_stats()
+    assert (st["writes"], st["flushed_rows"], st["pending"]) == (10, 1, 0)
+    assert st["coalesced_writes"] == 9
+    assert profiles.get_profile(1)["bio"] == "9"
+
+
+def test_bulk_update_is_one_commit_and_isolates_errors(profiles):
+    profiles.set_profile(1, bank={"saldo": 10})
+    flushes = profiles.cache_stats()["flushes"]
+
+    def bad(view):
+        raise ValueError("saldo negativo")
+
+    res = profiles.bulk_update_profiles({
+        1: lambda v: {"bank": {"saldo": v["bank"]["saldo"] + 5}},
+        2: {"bio": "nuovo"},
+        3: bad,
+        4: lambda v: None,
+    })
+    assert res[1] == {"ok": True, "patch": {"bank": {"saldo": 15}}}
+    assert res[3] == {"ok": False, "error": "saldo negativo"}
+    assert res[4] == {"ok": True, "patch": {}}
+    assert profiles.cache_stats()["flushes"] == flushes + 1
+    assert profiles.get_profile(1)["bank"]["saldo"] == 15
+    assert profiles.get_profile(2)["bio"] == "nuovo"
+    assert profiles.profile_revision(3) == profiles.profile_revision(4) == 0
+
+
+def test_bulk_update_with_fields_merges_in_the_store(profiles):
+    profiles.set_profile(1, bio="tienimi", bank={"iban": "IT00", "saldo": 10})
+    profiles._cache.rows.clear()  # come dopo un riavvio: il profilo non è in cache
+    seen = []
+
+    def add(view):
+        seen.append(dict(view["bank"]))
+        return {"bank": {"saldo": view["bank"]["saldo"] + 1}}
+
+    profiles.bulk_update_profiles({1: add}, fields=["bank.saldo"])
+    assert seen[0]["saldo"] == 10 and seen[0]["iban"] == ""  # solo il campo richiesto
+    prof = profiles.get_profile(1)
+    assert (prof["bio"], prof["bank"]["iban"], prof["bank"]["saldo"]) == ("tienimi", "IT00", 11)
+
+
+def test_async_bulk_update_applies_and_flushes(profiles):
+    async def main():
+        res = await profiles.abulk_update_profiles({1: {"bio": "a"}, 2: lambda v: {"bio": v["bio"] + "b"}})
+        return res, profiles.cache_stats()["pending"]
+
+    res, pending = asyncio.run(main())
+    assert all(r["ok"] for r in res.values()) and pending == 0
+    assert profiles.get_profile(2)["bio"] == "b"
@@ -0,0 +1,44 @@
+# tests/test_profili_index.py
+import asyncio
+
+from utils.profili_index import ProfileIndex, index_keys_touched
+
+
+def test_update_moves_only_the_changed_values():
+    idx = ProfileIndex()
+    idx.update("1", {"bank": {"iban": "it60 x054"}, "fazioni": ["Polizia", "-"], "lavoro": "Medico"})
+    idx.update("2", {"fazioni": ["polizia"]})
+    assert idx.lookup("iban", "IT60X054") == {"1"}
+    assert idx.lookup("fazione", "POLIZIA ") == {"1", "2"}
+    assert idx.values("fazione") == {"polizia": 2}  # il segnaposto "-" non è indicizzato
+
+    idx.update("1", {"bank": {"iban": "IT99"}, "lavoro": "medico"})
+    assert idx.lookup("iban", "IT60X054") == set() and idx.lookup("iban", "it99") == {"1"}
+    assert idx.lookup("fazione", "polizia") == {"2"}
+    idx.update("2", None)
+    assert idx.values("fazione") == {} and len(idx) == 1
+
+
+def test_only_index_fields_trigger_a_reindex():
+    assert not index_keys_touched({"bank": {"saldo": 5}, "bio": "x"})
+    assert index_keys_touched({"bank": {"iban": "IT00"}})
+    assert index_keys_touched({"proprieta": {"veicoli": []}})
+
+
+def test_lookups_follow_every_write_path(profiles):
+    profiles.set_profile(1, bank={"iban": "IT00A"}, docs={"patenti": {"B": {"numero": "PB1"}}})
+    assert profiles.find_profiles("iban", "it00a") == [1]  # costruito dallo store
+
+    async def main():
+        await profiles.aset_profile(2, bank={"iban": "IT00A"})                  # collisione
+        await profiles.abulk_update_profiles({1: {"bank": {"iban": "IT00B"}}})
+        await profiles.abulk_update_profiles({2: {"bank": {"saldo": 1}}})      # non tocca l'indice
+        profiles.bulk_update_profiles({3: {"lavoro": "Meccanico"}}, fields=["lavoro"])
+        return (
+            await profiles.afind_by_iban("IT00A"),
+            await profiles.afind_by_iban("IT00B"),
+            await profiles.afind_by_document("pb1"),
+            await profiles.afind_by_job("meccanico"),
+        )
+
+    assert asyncio.run(main()) == ([2], [1], [1], [3])
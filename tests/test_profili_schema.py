@@ -0,0 +1,83 @@
+# tests/test_profili_schema.py
+import json
+
+import pytest
+
+from utils.profili import _deep_merge
+from utils.profili_schema import (
+    LEGACY_IMPORT_KEY, SCHEMA_META_KEY, SCHEMA_VERSION, iter_legacy_records, migrate, normalize_patch,
+    normalize_profile,
+)
+from utils.profili_store import JournalProfileStore, SqliteProfileStore
+
+
+@pytest.fixture(params=["sqlite", "journal"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        s = SqliteProfileStore(tmp_path / "profili.db")
+    else:
+        s = JournalProfileStore(tmp_path / "store.json", merge=_deep_merge)
+    yield s
+    s.close()
+
+
+def test_normalize_profile_moves_aliases():
+    prof = {"lavoro_rp": "Medico", "iban": "IT00", "bank": {"saldo": 5}}
+    out = normalize_profile(prof)
+    assert out == {"lavoro": "Medico", "bank": {"saldo": 5, "iban": "IT00"}}
+    assert prof["lavoro_rp"] == "Medico"          # l'originale non si tocca
+    plain = {"lavoro": "x"}
+    assert normalize_profile(plain) is plain       # nulla da fare: stesso oggetto
+
+
+def test_canonical_field_wins_unless_empty():
+    assert normalize_profile({"lavoro": "A", "lavoro_rp": "B"})["lavoro"] == "A"
+    assert normalize_profile({"lavoro": "", "lavoro_rp": "B"})["lavoro"] == "B"
+    # in un patch invece l'alias scritto oggi vale (se il canonico non c'è)
+    assert normalize_patch({"lavoro_rp": "B"}) == {"lavoro": "B"}
+
+
+def test_streaming_reader_handles_tiny_chunks(tmp_path):
+    path = tmp_path / "legacy.json"
+    data = {
+        "journal_seq": 3,
+        "1": {"nome_rp": "Top \"level\" {}", "lavoro_rp": "x"},
+        "profiles": {"2": {"bio": "è ok ✓", "fazioni": [1, {"a": None}]}, "3": "non un profilo"},
+        "meta": {"1": {}},
+    }
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+    recs = list(iter_legacy_records(path, chunk_size=3))
+    assert recs == [
+        ("1", data["1"], 0),
+        ("2", data["profiles"]["2"], 1),
+    ]
+    assert list(iter_legacy_records(tmp_path / "missing.json")) == []
+
+
+def test_migrate_imports_legacy_files_once_by_precedence(store, tmp_path):
+    old = tmp_path / "profile_data.json"
+    new = tmp_path / "profili.json"
+    old.write_text(json.dumps({"1": {"bio": "vecchio", "roblox": "r1"}, "2": {"lavoro_rp": "Fabbro"}}))
+    new.write_text(json.dumps({"1": {"bio": "top"}, "profiles": {"1": {"bio": "nuovo"}}}))
+    store.put_many({"3": {"bio": "già nello store", "iban": "IT03"}})
+
+    stats = migrate(store, (old, new), merge=_deep_merge)
+    assert stats == {"imported": 2, "normalized": 1}
+    assert store.get("1") == {"bio": "nuovo", "roblox": "r1"}
+    assert store.get("2") == {"lavoro": "Fabbro"}
+    assert store.get("3") == {"bio": "già nello store", "bank": {"iban": "IT03"}}
+    assert store.get_meta(SCHEMA_META_KEY) == str(SCHEMA_VERSION)
+    assert store.get_meta(LEGACY_IMPORT_KEY)
+
+    # idempotente: una seconda apertura non reimporta nulla
+    old.write_text(json.dumps({"4": {"bio": "tardivo"}}))
+    assert migrate(store, (old, new), merge=_deep_merge) == {"imported": 0, "normalized": 0}
+    assert store.get("4") is None
+
+
+def test_migrate_does_not_overwrite_profiles_written_by_the_bot(store, tmp_path):
+    legacy = tmp_path / "profili.json"
+    legacy.write_text(json.dumps({"profiles": {"5": {"bio": "legacy"}}}))
+    store.put_many({"5": {"bio": "bot"}})
+    assert migrate(store, (legacy,), merge=_deep_merge)["imported"] == 0
+    assert store.get("5") == {"bio": "bot"}
@@ -0,0 +1,67 @@
+# tests/test_profili_store.py
+import json
+
+import pytest
+
+from utils.profili import _deep_merge
+from utils.profili_store import JournalProfileStore, SqliteProfileStore
+
+
+def _open(kind, tmp_path, **kw):
+    if kind == "sqlite":
+        return SqliteProfileStore(tmp_path / "profili.db")
+    return JournalProfileStore(tmp_path / "profili.json", merge=_deep_merge, **kw)
+
+
+@pytest.fixture(params=["sqlite", "journal"])
+def kind(request):
+    return request.param
+
+
+def test_rows_patches_and_projections(kind, tmp_path):
+    s = _open(kind, tmp_path)
+    s.put_many({"1": {"bio": "a", "bank": {"iban": "IT00", "saldo": 5}}, "2": {"bio": "b"}})
+    s.write_batch({"2": {"bio": "b2"}}, {"1": {"bank": {"saldo": 7}}, "3": {"roblox": "r"}})
+    assert s.get("1") == {"bio": "a", "bank": {"iban": "IT00", "saldo": 7}}
+    assert s.get_many(["2", "3", "4"]) == {"2": {"bio": "b2"}, "3": {"roblox": "r"}}
+    assert s.get_fields_many(["1", "2"], ["bank.iban", "bio"]) == {
+        "1": {"bank": {"iban": "IT00"}, "bio": "a"},
+        "2": {"bio": "b2"},
+    }
+    s.set_meta("k", "v")
+    s.close()
+
+    again = _open(kind, tmp_path)
+    assert again.get("1")["bank"]["saldo"] == 7
+    assert again.get_meta("k") == "v"
+    assert dict(again.iter_all()).keys() == {"1", "2", "3"}
+    again.close()
+
+
+def test_journal_replays_after_the_snapshot_and_drops_a_torn_commit(tmp_path):
+    s = _open("journal", tmp_path)
+    s.put_many({"1": {"bio": "a"}})
+    s.write_batch({}, {"1": {"roblox": "r"}})
+    s.close()
+    with (tmp_path / "profili.journal.jsonl").open("a", encoding="utf-8") as f:
+        f.write('{"seq": 3, "ops": [{"u": "1", "p": {"bio": "tor')  # crash a metà commit
+    again = _open("journal", tmp_path)
+    assert again.get("1") == {"bio": "a", "roblox": "r"}
+    again.put_many({"2": {"bio": "b"}})
+    again.close()
+    assert _open("journal", tmp_path).get("2") == {"bio": "b"}
+
+
+def test_journal_compaction_folds_into_the_snapshot(tmp_path):
+    s = _open("journal", tmp_path, compact_bytes=10**9)
+    for i in range(50):
+        s.write_batch({}, {str(i % 5): {"n": i}})
+    s.compact()
+    snap = json.loads((tmp_path / "profili.json").read_text(encoding="utf-8"))
+    assert snap["profiles"]["4"] == {"n": 49}
+    assert (tmp_path / "profili.journal.jsonl").read_text() == ""
+    s.write_batch({}, {"0": {"n": -1}})
+    s.close()
+    again = _open("journal", tmp_path)
+    assert again.get("0") == {"n": -1} and again.get("4") == {"n": 49}
+    again.close()
@@ -0,0 +1,99 @@
+# tests/test_scheduler.py
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from utils.scheduler import Daily, Monthly, Scheduler, _Job
+
+UTC = timezone.utc
+
+
+def test_monthly_cycles():
+    m = Monthly(day=5, hour=12)
+    assert m.next("2026-12") == "2027-01"
+    assert m.prev("2026-01") == "2025-12"
+    assert m.due("2026-10") == datetime(2026, 10, 5, 12, tzinfo=UTC)
+    assert m.cycle_at(datetime(2026, 10, 5, 12, tzinfo=UTC)) == "2026-10"
+    assert m.cycle_at(datetime(2026, 10, 5, 11, 59, tzinfo=UTC)) == "2026-09"
+    assert m.cycle_at(datetime(2026, 1, 1, tzinfo=UTC)) == "2025-12"
+    with pytest.raises(ValueError):
+        Monthly(day=31)
+
+
+def test_daily_cycles():
+    d = Daily(hour=6, minute=30)
+    assert d.next("2024-02-28") == "2024-02-29"
+    assert d.prev("2026-01-01") == "2025-12-31"
+    assert d.cycle_at(datetime(2026, 3, 1, 6, 29, tzinfo=UTC)) == "2026-02-28"
+    assert d.cycle_at(datetime(2026, 3, 1, 6, 30, tzinfo=UTC)) == "2026-03-01"
+
+
+def _job(name="pay", schedule=None, max_catch_up=12, run=None):
+    return _Job(name, schedule or Daily(), run, lambda: [1], max_catch_up)
+
+
+def test_pending_catches_up_from_the_last_completed_cycle(tmp_path):
+    s = Scheduler(tmp_path / "scheduler.json")
+    s._state = {"pay": {"1": {"last_cycle": "2026-10-10"}}}
+    now = datetime(2026, 10, 14, 1, tzinfo=UTC)
+    assert s.pending(_job(), 1, now) == ["2026-10-11", "2026-10-12", "2026-10-13", "2026-10-14"]
+    assert s.pending(_job(max_catch_up=2), 1, now) == ["2026-10-13", "2026-10-14"]
+    assert s.next_due(_job(), 1, now) == datetime(2026, 10, 11, tzinfo=UTC)
+
+
+def test_first_sight_runs_only_a_recent_cycle(tmp_path):
+    s = Scheduler(tmp_path / "scheduler.json")
+    s._state = {}
+    monthly = _job(schedule=Monthly())
+    # scaduto da meno di INITIAL_GRACE: si esegue
+    assert s.pending(monthly, 1, datetime(2026, 10, 1, 6, tzinfo=UTC)) == ["2026-10"]
+    # scaduto da giorni: considerato già fatto, niente arretrati
+    assert s.pending(monthly, 1, datetime(2026, 10, 20, tzinfo=UTC)) == []
+
+
+def test_failed_cycle_is_not_marked_done(tmp_path):
+    path = tmp_path / "scheduler.json"
+    two_days_ago = (datetime.now(UTC) - timedelta(days=2)).strftime("%Y-%m-%d")
+    path.write_text(json.dumps({"pay": {"1": {"last_cycle": two_days_ago}}}))
+    s = Scheduler(path)
+    calls = []
+
+    async def run(cycle, gid):
+        calls.append(cycle)
+        if len(calls) == 2:
+            raise RuntimeError("boom")
+        return "ok"
+
+    s._jobs["pay"] = _job(run=run)
+    done = asyncio.run(s.run_pending())
+    assert done == 1 and len(calls) == 2
+    assert s.failures == 1
+    state = json.loads(path.read_text())
+    assert state["pay"]["1"]["last_cycle"] == calls[0]
+
+
+def test_singleton_survives_a_runner_restart(tmp_path):
+    # main.py riavvia il runner con un nuovo asyncio.run: evento e task vanno ricreati
+    s = Scheduler(tmp_path / "scheduler.json")
+
+    def one_run(name):
+        async def main():
+            ran = asyncio.Event()
+
+            async def run(cycle, gid):
+                ran.set()
+                return "ok"
+
+            s.add_job(name, Daily(), run, lambda: [1])
+            await asyncio.wait_for(ran.wait(), timeout=5)
+            s.remove_job(name)
+            await asyncio.wait_for(s.stop(), timeout=5)
+            return s.jobs
+        return asyncio.run(main())
+
+    assert one_run("a") == []
+    assert one_run("b") == []
+    state = json.loads((tmp_path / "scheduler.json").read_text())
+    assert set(state) == {"a", "b"}
@@ -0,0 +1,232 @@
+# utils/accounts.py
+"""
+Servizio conti unico (per gilda), sopra il ledger.
+
+I saldi vivono in UN solo posto: la tabella in memoria del ledger (utils/ledger), aggiornata
+a ogni transazione. Da qui leggono /profilo (sezione banca), /deposita, /preleva, il payroll
+e utils/economy: niente più `wallet`/`bank.saldo` nei profili né saldi in economy.json.
+
+Depositi e prelievi accettano una chiave di idempotenza (l'id dell'interazione): se Discord
+ripete la richiesta o l'utente clicca due volte, il ledger riconosce la chiave e si ritorna il
+risultato originale senza un secondo movimento (né un secondo record di audit).
+
+I campi `wallet` e `bank.saldo` dei profili sono deprecati: areconcile_profiles() li porta
+nel ledger una volta sola (transazione RECONCILE) e li azzera.
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from utils import audit_log, profili
+from utils.async_io import read_json_sync, run_io, write_json_sync
+from utils.ledger import (
+    InsufficientFunds, bank_account, from_cents, get_ledger, mint_account, to_cents, wallet_account,
+)
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = Path("data/accounts_state.json")
+
+# gilda a cui appartengono i saldi dei profili (che non hanno gilda). Se non è impostata
+# e il bot è in una sola gilda, si usa quella.
+ECONOMY_GUILD_ID = int(os.getenv("ECONOMY_GUILD_ID", "0") or 0)
+
+_lock = threading.Lock()
+
+
+class Movement(NamedTuple):
+    """Esito di un deposito/prelievo: saldi dopo il movimento (centesimi)."""
+    wallet: int
+    bank: int
+    replayed: bool = False   # True se era un duplicato: nessun nuovo movimento
+
+
+# ---------- Letture (O(1), dalla tabella in memoria del ledger) ----------
+def is_loaded() -> bool:
+    return get_ledger().loaded
+
+def load() -> None:
+    """Carica il ledger (replay): da chiamare nel pool I/O, una volta."""
+    get_ledger().seq
+
+def balances(guild_id: int, user_id: int) -> Tuple[int, int]:
+    """(portafoglio, conto) in centesimi."""
+    ledger = get_ledger()
+    return ledger.balance(wallet_account(guild_id, user_id)), ledger.balance(bank_account(guild_id, user_id))
+
+def money(guild_id: int, user_id: int) -> Dict[str, Any]:
+    """Saldi nella forma dei profili ({"wallet", "bank": {"saldo"}}), da sovrapporre a un profilo."""
+    w, b = balances(guild_id, user_id)
+    return {"wallet": from_cents(w), "bank": {"saldo": from_cents(b)}}
+
+async def amoney(guild_id: int, user_id: int) -> Dict[str, Any]:
+    if not is_loaded():
+        await run_io(load)  # solo la prima volta: replay del ledger fuori dall'event loop
+    return money(guild_id, user_id)
+
+
+# ---------- Movimenti (ognuno è UNA transazione del ledger) ----------
+def _positive(amount: Any) -> int:
+    cents = to_cents(amount)
+    if cents <= 0:
+        raise ValueError("❌ Inserisci un importo positivo.")
+    return cents
+
+def deposit(guild_id: int, user_id: int, amount: Any, reason: str = "", key: Optional[str] = None) -> Movement:
+    """Portafoglio -> conto. Ritorna i nuovi saldi; con `key` ripetuta quelli del movimento originale."""
+    try:
+        return _move(guild_id, user_id, _positive(amount), "DEPOSIT", reason, key)
+    except InsufficientFunds as e:
+        raise ValueError(f"❌ Fondi insufficienti nel portafoglio. Disponibile: {_fmt(e.available)}") from None
+
+def withdraw(guild_id: int, user_id: int, amount: Any, reason: str = "", key: Optional[str] = None) -> Movement:
+    """Conto -> portafoglio. Come deposit()."""
+    try:
+        return _move(guild_id, user_id, -_positive(amount), "WITHDRAW", reason, key)
+    except InsufficientFunds as e:
+        raise ValueError(f"❌ Fondi insufficienti sul conto. Disponibile: {_fmt(e.available)}") from None
+
+def _move(guild_id: int, user_id: int, cents: int, kind: str, reason: str, key: Optional[str]) -> Movement:
+    # cents > 0: portafoglio -> conto; cents < 0: conto -> portafoglio
+    w_acc, b_acc = wallet_account(guild_id, user_id), bank_account(guild_id, user_id)
+    src, dst = (w_acc, b_acc) if cents > 0 else (b_acc, w_acc)
+    tx = get_ledger().transfer(src, dst, abs(cents), kind, reason, key=key)
+    if key is None:
+        w, b = balances(guild_id, user_id)
+    else:
+        w, b = tx["after"][w_acc], tx["after"][b_acc]
+    replayed = bool(tx.get("replayed"))
+    if not replayed:
+        audit_log.record(guild_id, user_id, cents, kind, reason, {"saldo": b, "tx": tx["seq"]})
+    return Movement(w, b, replayed)
+
+def credit_wallet(guild_id: int, user_id: int, amount: Any, reason: str = "") -> int:
+    """Accredito (o addebito, se negativo) sul portafoglio dal conto di sistema. Ritorna il nuovo saldo."""
+    return _mint(guild_id, user_id, "wallet", to_cents(amount), reason)
+
+def credit_bank(guild_id: int, user_id: int, amount: Any, reason: str = "") -> int:
+    """Come credit_wallet, sul conto bancario."""
+    return _mint(guild_id, user_id, "bank", to_cents(amount), reason)
+
+def _mint(guild_id: int, user_id: int, kind: str, cents: int, reason: str) -> int:
+    account = wallet_account(guild_id, user_id) if kind == "wallet" else bank_account(guild_id, user_id)
+    if not cents:
+        return get_ledger().balance(account)
+    op = "CREDIT" if cents > 0 else "DEBIT"
+    try:
+        tx = get_ledger().post([(mint_account(guild_id), -cents), (account, cents)], op, reason)
+    except InsufficientFunds as e:
+        raise ValueError(f"❌ Fondi insufficienti. Disponibile: {_fmt(e.available)}") from None
+    audit_log.record(guild_id, user_id, cents, op, reason, {"account": kind, "tx": tx["seq"]})
+    return get_ledger().balance(account)
+
+def credit_bank_many(
+    guild_id: int,
+    amounts: Mapping[int, int],
+    kind: str,
+    reason: str = "",
+    meta: Optional[Dict[str, Any]] = None,
+    key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Accrediti in centesimi su molti conti con UNA transazione (payroll): tutti o nessuno.
+    Con `key` già usata ritorna la transazione originale ("replayed": True) senza riaccreditare.
+    """
+    legs = [(bank_account(guild_id, uid), cents) for uid, cents in amounts.items() if cents]
+    total = sum(c for _, c in legs)
+    if not legs:
+        return {}
+    return get_ledger().post(legs + [(mint_account(guild_id), -total)], kind, reason, meta, key)
+
+def _fmt(cents: int) -> str:
+    return profili.money_fmt(from_cents(cents))
+
+async def adeposit(guild_id: int, user_id: int, amount: Any, reason: str = "", key: Optional[str] = None) -> Movement:
+    return await run_io(deposit, guild_id, user_id, amount, reason, key)
+
+async def awithdraw(guild_id: int, user_id: int, amount: Any, reason: str = "", key: Optional[str] = None) -> Movement:
+    return await run_io(withdraw, guild_id, user_id, amount, reason, key)
+
+async def acredit_wallet(guild_id: int, user_id: int, amount: Any, reason: str = "") -> int:
+    return await run_io(credit_wallet, guild_id, user_id, amount, reason)
+
+async def acredit_bank(guild_id: int, user_id: int, amount: Any, reason: str = "") -> int:
+    return await run_io(credit_bank, guild_id, user_id, amount, reason)
+
+async def acredit_bank_many(
+    guild_id: int,
+    amounts: Mapping[int, int],
+    kind: str,
+    reason: str = "",
+    meta: Optional[Dict[str, Any]] = None,
+    key: Optional[str] = None,
+) -> Dict[str, Any]:
+    return await run_io(credit_bank_many, guild_id, amounts, kind, reason, meta, key)
+
+
+# ---------- Riconciliazione una tantum (profili -> ledger) ----------
+def economy_guild_id(guild_ids: Sequence[int]) -> Optional[int]:
+    if ECONOMY_GUILD_ID:
+        return ECONOMY_GUILD_ID
+    return guild_ids[0] if len(guild_ids) == 1 else None
+
+def _reconcile_key(guild_id: int) -> str:
+    return f"reconcile:profiles:{guild_id}"
+
+def _reconcile_ledger(guild_id: int) -> Tuple[Dict[str, Any], Sequence[str]]:
+    # gira nel pool I/O: legge lo store dei profili e scrive nel ledger
+    with _lock:
+        state = read_json_sync(STATE_FILE, {}) or {}
+        if state.get("profiles_reconciled"):
+            return state["profiles_reconciled"], ()
+        legs = []
+        users = []
+        for ukey, prof in profili.iter_all_profiles():
+            try:
+                w = to_cents(prof.get("wallet") or 0)
+                b = to_cents((prof.get("bank") or {}).get("saldo") or 0)
+            except ValueError:
+                continue
+            if w or b:
+                users.append(ukey)
+                # saldi negativi (mai ammessi, ma in un JSON può esserci di tutto) restano fuori
+                legs += [(acc, c) for acc, c in ((wallet_account(guild_id, ukey), w), (bank_account(guild_id, ukey), b)) if c > 0]
+        total = sum(c for _, c in legs)
+        key = _reconcile_key(guild_id)
+        # post e scrittura dello stato non sono atomici: se il processo è morto in mezzo, la
+        # transazione (chiave permanente) è già nel ledger e vale quella, senza ripostare
+        tx = get_ledger().find(key)
+        if tx is not None:
+            log.warning("Riconciliazione conti già nel ledger (tx %s): si aggiorna solo lo stato", tx["seq"])
+            total = sum(c for acc, c in tx["legs"] if c > 0)
+        elif legs:
+            tx = get_ledger().post(legs + [(mint_account(guild_id), -total)], "RECONCILE", "Saldi importati dai profili", key=key)
+            audit_log.record_many(
+                audit_log.make_record(guild_id, int(acc.rsplit(":", 1)[1]), c, "RECONCILE", "Saldi importati dai profili",
+                                      {"account": acc.split(":", 1)[0], "tx": tx["seq"]})
+                for acc, c in legs
+            )
+        state["profiles_reconciled"] = {
+            "guild_id": guild_id, "t": time.time(), "tx": tx["seq"] if tx else None,
+            "users": len(users), "cents": total,
+        }
+        write_json_sync(STATE_FILE, state)
+    log.info("✅ Riconciliazione conti: %s profili, %s centesimi portati nel ledger", len(users), total)
+    return state["profiles_reconciled"], users
+
+async def areconcile_profiles(guild_id: int) -> Dict[str, Any]:
+    """
+    Porta i vecchi saldi dei profili (`wallet`, `bank.saldo`) nel ledger della gilda, SOMMANDOLI
+    a quanto già presente (es. saldi importati da economy.json), con una sola transazione.
+    Fatto una volta (data/accounts_state.json); poi i campi dei profili vengono azzerati.
+    """
+    await profili.aflush()  # lo store deve avere anche le ultime scritture in cache
+    result, users = await run_io(_reconcile_ledger, guild_id)
+    if users:
+        # i campi restano nei profili ma a 0: la fonte è il ledger
+        await profili.abulk_update_profiles({int(k): {"wallet": 0.0, "bank": {"saldo": 0.0}} for k in users})
+    return result
@@ -1,5 +1,7 @@
 import os, json
 
+from utils.async_io import read_json, run_io, write_json, write_json_sync
+
 DATA_DIR = "data/annunci"
 os.makedirs(DATA_DIR, exist_ok=True)
 
@@ -8,8 +10,7 @@ def _path(mid: int) -> str:
 
 def save(mid: int, data: dict):
     data["message_id"] = mid
-    with open(_path(mid), "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+    write_json_sync(_path(mid), data)
 
 def load(mid: int) -> dict | None:
     try:
@@ -27,4 +28,15 @@ def all_states() -> list[dict]:
                     states.append(json.load(f))
             except Exception:
                 pass
-    return states
\ No newline at end of file
+    return states
+
+# ---------- Varianti async (per view/modal: l'I/O gira nel pool di utils.async_io) ----------
+async def asave(mid: int, data: dict):
+    data["message_id"] = mid
+    await write_json(_path(mid), data)
+
+async def aload(mid: int) -> dict | None:
+    return await read_json(_path(mid))
+
+async def aall_states() -> list[dict]:
+    return await run_io(all_states)
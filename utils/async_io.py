@@ -0,0 +1,133 @@
+# utils/async_io.py
+"""
+Facciata async per l'I/O su file.
+
+Tutto ciò che legge/scrive su disco gira in un pool di thread DEDICATO e limitato
+(non quello di default di asyncio), così le coroutine del bot non bloccano mai
+l'event loop (heartbeat del gateway, risposte entro i 3s delle interaction).
+"""
+from __future__ import annotations
+import asyncio
+import functools
+import json
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+T = TypeVar("T")
+
+IO_WORKERS = int(os.getenv("IO_WORKERS", "4"))
+
+# creato alla prima run_io e azzerato da shutdown(): dopo un riavvio del runner (main.py)
+# il pool si ricrea, invece di rifiutare ogni nuovo lavoro
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="venezia-io")
+    return _executor
+
+# contatori (tempo passato nei worker, non sull'event loop): aggiornati da più thread del pool
+_stats: Dict[str, float] = {"calls": 0, "errors": 0, "io_ms_total": 0.0, "io_ms_max": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _timed(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    t0 = time.perf_counter()
+    failed = False
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        ms = (time.perf_counter() - t0) * 1000
+        with _stats_lock:
+            _stats["calls"] += 1
+            _stats["errors"] += failed
+            _stats["io_ms_total"] += ms
+            _stats["io_ms_max"] = max(_stats["io_ms_max"], ms)
+
+
+async def run_io(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Esegue una funzione bloccante (I/O) nel pool dedicato e ne attende il risultato."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), functools.partial(_timed, fn, *args, **kwargs))
+
+
+def io_stats() -> Dict[str, Any]:
+    with _stats_lock:
+        st = dict(_stats)
+    calls = st["calls"]
+    return {
+        "workers": IO_WORKERS,
+        "calls": int(calls),
+        "errors": int(st["errors"]),
+        "io_ms_avg": round(st["io_ms_total"] / calls, 3) if calls else 0.0,
+        "io_ms_max": round(st["io_ms_max"], 3),
+    }
+
+
+def shutdown() -> None:
+    """Attende la fine delle operazioni in corso (da chiamare allo shutdown); la prossima run_io ricrea il pool."""
+    global _executor
+    with _executor_lock:
+        ex, _executor = _executor, None
+    if ex is not None:
+        ex.shutdown(wait=True)
+
+
+# ---------- JSON (sync, da usare dentro run_io o fuori dal bot) ----------
+def read_json_sync(path: Path | str, default: Any = None) -> Any:
+    path = Path(path)
+    if not path.exists():
+        return default
+    try:
+        return json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return default
+
+
+def write_json_sync(path: Path | str, data: Any) -> None:
+    """Scrittura atomica: file temporaneo + rename, così un crash non lascia mai un JSON a metà."""
+    _write_text_atomic(Path(path), json.dumps(data, ensure_ascii=False, indent=2))
+
+
+# ---------- JSON (async) ----------
+async def read_json(path: Path | str, default: Any = None) -> Any:
+    return await run_io(read_json_sync, path, default)
+
+
+# un lock per file: due salvataggi dello stesso file arrivano su disco nell'ordine in cui sono stati chiesti
+_path_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def _path_lock(path: Path) -> asyncio.Lock:
+    key = str(path.resolve())
+    lock = _path_locks.get(key)
+    if lock is None:
+        lock = asyncio.Lock()
+        _path_locks[key] = lock
+    return lock
+
+
+async def write_json(path: Path | str, data: Any) -> None:
+    # serializza SUBITO (sul loop) una copia coerente, poi scrive nel pool
+    path = Path(path)
+    payload = json.dumps(data, ensure_ascii=False, indent=2)
+    async with _path_lock(path):
+        await run_io(_write_text_atomic, path, payload)
+
+
+def _write_text_atomic(path: Path, payload: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(payload, encoding="utf-8")
+    os.replace(tmp, path)
@@ -0,0 +1,490 @@
+# utils/audit_log.py
+"""
+Audit dell'economia a segmenti, con indice per utente.
+
+- un segmento per mese (UTC): data/audit/economy-AAAA-MM.jsonl, un record JSON per riga
+- accanto a ogni segmento un indice append-only (economy-AAAA-MM.idx) con righe "gid:uid offset",
+  scritto insieme ai dati; del segmento attivo l'indice sta in memoria
+- per i segmenti chiusi si compatta (una volta) in un indice ORDINATO per chiave
+  (economy-AAAA-MM.sidx, una riga "gid:uid off,off,..." per utente): la ricerca è binaria, fuori
+  dal lock dello scrittore, e legge solo la riga dell'utente
+- per l'estratto conto si leggono SOLO i record dell'utente (seek diretto), dal segmento più
+  recente all'indietro, fermandosi appena ci sono abbastanza movimenti: il costo dipende dai
+  movimenti dell'utente, non da quanti record ha il server
+- un record scritto senza la sua riga d'indice (crash a metà) viene reindicizzato al caricamento
+- le scritture passano da AuditWriter (group commit): i record vanno in una coda limitata e un
+  thread li scrive a lotti, con UNA write + fsync ogni GROUP_COMMIT_MS o GROUP_COMMIT_MAX record
+"""
+from __future__ import annotations
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from utils.async_io import run_io
+
+log = logging.getLogger(__name__)
+
+AUDIT_DIR = Path("data/audit")
+LEGACY_AUDIT_FILE = Path("data/economy_audit.jsonl")
+
+# intestazione dell'indice ordinato: versione e byte del segmento coperti
+SIDX_MAGIC = b"#sidx1"
+
+# group commit: un lotto si chiude dopo GROUP_COMMIT_MS dal primo record o a GROUP_COMMIT_MAX record
+GROUP_COMMIT_MS = 5
+GROUP_COMMIT_MAX = 512
+# record in coda al massimo: oltre, chi scrive aspetta (backpressure) invece di far crescere la memoria
+MAX_PENDING = 10_000
+
+
+def segment_id(t: float) -> str:
+    return time.strftime("%Y-%m", time.gmtime(t))
+
+def index_key(guild_id: Any, user_id: Any) -> str:
+    return f"{guild_id}:{user_id}"
+
+
+class AuditLog:
+    def __init__(self, directory: Path = AUDIT_DIR, prefix: str = "economy"):
+        self.dir = directory
+        self.prefix = prefix
+        self._lock = threading.RLock()
+        self._sidx_lock = threading.Lock()  # compattazione degli indici ordinati (non blocca lo scrittore)
+        self._active_idx: Dict[str, List[int]] = {}
+        self._active: Optional[str] = None
+        self._data_f = None
+        self._idx_f = None
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+    # --- percorsi ---
+    def _data_path(self, seg: str) -> Path:
+        return self.dir / f"{self.prefix}-{seg}.jsonl"
+
+    def _idx_path(self, seg: str) -> Path:
+        return self.dir / f"{self.prefix}-{seg}.idx"
+
+    def _sidx_path(self, seg: str) -> Path:
+        return self.dir / f"{self.prefix}-{seg}.sidx"
+
+    def segments(self) -> List[str]:
+        """Segmenti esistenti, dal più vecchio al più recente."""
+        n = len(self.prefix) + 1
+        return sorted(p.stem[n:] for p in self.dir.glob(f"{self.prefix}-*.jsonl"))
+
+    def segment_files(self, since: str = "") -> List[Path]:
+        """File dei segmenti da `since` (id "AAAA-MM") in poi, in ordine."""
+        return [self._data_path(seg) for seg in self.segments() if seg >= since]
+
+    # --- indice ---
+    def _load_index(self, seg: str, repair: bool = True) -> Dict[str, List[int]]:
+        """Indice completo del segmento; con `repair` le righe mancanti vengono aggiunte al .idx."""
+        idx: Dict[str, List[int]] = {}
+        last = -1
+        ipath, dpath = self._idx_path(seg), self._data_path(seg)
+        if ipath.exists():
+            with ipath.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        key, off = line.split()
+                        off = int(off)
+                    except ValueError:
+                        continue  # riga d'indice troncata
+                    idx.setdefault(key, []).append(off)
+                    last = max(last, off)
+        if not dpath.exists():
+            return idx
+        # record finiti nel segmento ma non nell'indice (crash tra le due scritture)
+        missing: List[Tuple[str, int]] = []
+        with dpath.open("rb") as f:
+            if last >= 0:
+                f.seek(last)
+                f.readline()
+            while True:
+                off = f.tell()
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    rec = json.loads(line)
+                except Exception:
+                    continue
+                missing.append((index_key(rec.get("guild_id"), rec.get("user_id")), off))
+        if missing:
+            if repair:
+                with ipath.open("a", encoding="utf-8") as f:
+                    f.writelines(f"{k} {o}\n" for k, o in missing)
+                log.info("Audit %s: reindicizzati %s record", seg, len(missing))
+            for k, o in missing:
+                idx.setdefault(k, []).append(o)
+        return idx
+
+    def _build_sidx(self, seg: str) -> None:
+        """Compatta l'indice di un segmento in quello ordinato (file temporaneo + replace)."""
+        covered = self._data_path(seg).stat().st_size  # misurato PRIMA di leggere: mai sovrastimato
+        idx = self._load_index(seg, repair=False)
+        path = self._sidx_path(seg)
+        tmp = path.with_name(path.name + ".tmp")
+        with tmp.open("wb") as f:
+            f.write(SIDX_MAGIC + b" %d\n" % covered)
+            for key in sorted(idx):
+                f.write(f"{key} {','.join(map(str, sorted(idx[key])))}\n".encode("utf-8"))
+        os.replace(tmp, path)
+
+    def _sidx_lookup(self, seg: str, key: str) -> List[int]:
+        """Offset di `key` in un segmento chiuso: ricerca binaria nell'indice ordinato."""
+        path = self._sidx_path(seg)
+        size = self._data_path(seg).stat().st_size
+        for attempt in range(2):
+            try:
+                with path.open("rb") as f:
+                    head = f.readline().split()
+                    if len(head) == 2 and head[0] == SIDX_MAGIC and int(head[1]) == size:
+                        return _bsearch(f, key.encode("utf-8"), f.tell(), os.fstat(f.fileno()).st_size)
+            except (OSError, ValueError):
+                pass
+            if attempt:
+                break
+            # assente o non aggiornato (record tardivi nel segmento): si ricompatta una volta
+            with self._sidx_lock:
+                self._build_sidx(seg)
+        # indice ordinato illeggibile anche dopo la ricompattazione: scansione completa
+        return self._load_index(seg, repair=False).get(key) or []
+
+    # --- scrittura ---
+    def _open_active(self, seg: str) -> None:
+        if self._active == seg:
+            return
+        self._close_files()
+        self._active_idx = self._load_index(seg)  # carica/ripara l'indice prima di aggiungere righe
+        self._data_f = self._data_path(seg).open("ab")
+        self._idx_f = self._idx_path(seg).open("a", encoding="utf-8")
+        self._active = seg
+
+    def append_many(self, records: Iterable[Dict[str, Any]], fsync: bool = False) -> int:
+        """Aggiunge i record (nel segmento del loro `t`). Ritorna quanti ne ha scritti."""
+        n = 0
+        with self._lock:
+            for rec in records:
+                seg = segment_id(rec.get("t") or time.time())
+                self._open_active(seg)
+                line = (json.dumps(rec, ensure_ascii=False) + "\n").encode("utf-8")
+                off = self._data_f.tell()
+                self._data_f.write(line)
+                key = index_key(rec.get("guild_id"), rec.get("user_id"))
+                self._idx_f.write(f"{key} {off}\n")
+                self._active_idx.setdefault(key, []).append(off)
+                n += 1
+            if n:
+                # prima i dati, poi l'indice: un indice non punta mai a un record che non c'è
+                self._data_f.flush()
+                if fsync:
+                    os.fsync(self._data_f.fileno())
+                self._idx_f.flush()
+        return n
+
+    def append(self, rec: Dict[str, Any]) -> None:
+        self.append_many([rec])
+
+    # --- lettura ---
+    def statement(
+        self,
+        guild_id: int,
+        user_id: int,
+        limit: int = 50,
+        before: Optional[float] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Movimenti dell'utente dal più recente (al massimo `limit`, opzionalmente prima di `before`)."""
+        key = index_key(guild_id, user_id)
+        left = limit
+        for seg in reversed(self.segments()):
+            if left <= 0:
+                return
+            if before is not None and seg > segment_id(before):
+                continue
+            offsets = self._offsets(seg, key)
+            if not offsets:
+                continue
+            with self._data_path(seg).open("rb") as f:
+                for off in reversed(offsets):
+                    f.seek(off)
+                    try:
+                        rec = json.loads(f.readline())
+                    except Exception:
+                        continue
+                    if before is not None and (rec.get("t") or 0) >= before:
+                        continue
+                    yield rec
+                    left -= 1
+                    if left <= 0:
+                        return
+
+    def _offsets(self, seg: str, key: str) -> List[int]:
+        with self._lock:
+            if seg == self._active:
+                if self._data_f is not None:
+                    self._data_f.flush()
+                return list(self._active_idx.get(key) or ())
+        # segmento chiuso: niente lock dello scrittore, si legge solo la riga dell'utente
+        return self._sidx_lookup(seg, key)
+
+    # --- chiusura ---
+    def _close_files(self) -> None:
+        for f in (self._data_f, self._idx_f):
+            if f is not None:
+                f.flush()
+                try:
+                    os.fsync(f.fileno())
+                except OSError:
+                    pass
+                f.close()
+        self._data_f = self._idx_f = None
+        self._active = None
+        self._active_idx = {}
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_files()
+
+
+def _bsearch(f, key: bytes, lo: int, hi: int) -> List[int]:
+    """
+    Cerca la riga `key off,...` tra i byte [lo, hi) di un indice ordinato (lo = inizio riga).
+    Invariante: le righe che iniziano prima di `lo` hanno chiave < key.
+    """
+    while lo < hi:
+        mid = (lo + hi) // 2
+        f.seek(mid - 1)
+        f.readline()
+        pos = f.tell()  # primo inizio riga >= mid
+        if pos >= hi:
+            break  # nessun inizio riga in [mid, hi): si finisce con una scansione da lo
+        line = f.readline()
+        if line.split(b" ", 1)[0] < key:
+            lo = f.tell()
+        else:
+            hi = pos
+    f.seek(lo)
+    for line in f:
+        k, _, offs = line.rstrip(b"\n").partition(b" ")
+        if k == key:
+            return [int(o) for o in offs.split(b",") if o]
+        if k > key:
+            break
+    return []
+
+
+def migrate_legacy(audit: AuditLog, path: Path = LEGACY_AUDIT_FILE, batch: int = 1000) -> int:
+    """Una tantum: ridistribuisce il vecchio economy_audit.jsonl nei segmenti (in streaming)."""
+    if not path.exists():
+        return 0
+    n = 0
+    buf: List[Dict[str, Any]] = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                buf.append(json.loads(line))
+            except Exception:
+                continue
+            if len(buf) >= batch:
+                n += audit.append_many(buf)
+                buf = []
+    if buf:
+        n += audit.append_many(buf)
+    audit.close()
+    os.replace(path, path.with_name(path.name + ".migrated"))
+    log.info("✅ Audit economia: %s record migrati in %s", n, audit.dir)
+    return n
+
+
+# ---------- Scrittura a lotti (group commit) ----------
+_STOP = object()
+
+class AuditWriter:
+    """
+    Thread unico che svuota una coda LIMITATA di record e li scrive a lotti con un solo fsync.
+    - submit() non fa I/O: accoda e torna (se la coda è piena aspetta: backpressure)
+    - flush() attende che tutto ciò che è stato accodato sia su disco
+    - close() svuota la coda e ferma il thread (shutdown)
+    """
+    def __init__(self, audit: AuditLog, max_pending: int = MAX_PENDING):
+        self.audit = audit
+        self._q: "queue.Queue[Any]" = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+        self._closed = False
+        # contatori
+        self.batches = 0
+        self.records = 0
+        self.max_batch = 0
+        self.blocked = 0
+        self.errors = 0
+        self.write_ms_total = 0.0
+        self._thread.start()
+
+    def submit(self, rec: Dict[str, Any]) -> None:
+        if self._closed:
+            raise RuntimeError("Audit chiuso")
+        try:
+            self._q.put_nowait(rec)
+        except queue.Full:
+            self.blocked += 1
+            self._q.put(rec)
+
+    def submit_nowait(self, rec: Dict[str, Any]) -> bool:
+        """Come submit ma senza mai bloccare: False se la coda è piena."""
+        if self._closed:
+            raise RuntimeError("Audit chiuso")
+        try:
+            self._q.put_nowait(rec)
+            return True
+        except queue.Full:
+            self.blocked += 1
+            return False
+
+    def _run(self) -> None:
+        while True:
+            first = self._q.get()
+            if first is _STOP:
+                self._q.task_done()
+                return
+            batch = [first]
+            stop = False
+            deadline = time.monotonic() + GROUP_COMMIT_MS / 1000
+            while len(batch) < GROUP_COMMIT_MAX:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._q.get(timeout=timeout) if timeout > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            t0 = time.perf_counter()
+            try:
+                self.audit.append_many(batch, fsync=True)
+            except Exception:
+                self.errors += 1
+                log.exception("❌ Audit: scrittura di %s record fallita", len(batch))
+            self.write_ms_total += (time.perf_counter() - t0) * 1000
+            self.batches += 1
+            self.records += len(batch)
+            self.max_batch = max(self.max_batch, len(batch))
+            for _ in range(len(batch) + stop):
+                self._q.task_done()
+            if stop:
+                return
+
+    def flush(self) -> None:
+        self._q.join()
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._q.put(_STOP)
+        self._thread.join()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self._q.qsize(),
+            "records": self.records,
+            "batches": self.batches,
+            "avg_batch": round(self.records / self.batches, 1) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "blocked_submits": self.blocked,
+            "errors": self.errors,
+            "write_ms_avg": round(self.write_ms_total / self.batches, 3) if self.batches else 0.0,
+        }
+
+
+# ---------- Istanza di processo ----------
+_audit: Optional[AuditLog] = None
+_writer: Optional[AuditWriter] = None
+_audit_lock = threading.Lock()
+
+def get_audit_log() -> AuditLog:
+    global _audit
+    if _audit is None:
+        with _audit_lock:
+            if _audit is None:
+                a = AuditLog()
+                migrate_legacy(a)
+                _audit = a
+    return _audit
+
+def get_writer() -> AuditWriter:
+    global _writer
+    if _writer is None:
+        audit = get_audit_log()
+        with _audit_lock:
+            if _writer is None:
+                _writer = AuditWriter(audit)
+    return _writer
+
+def make_record(guild_id: int, user_id: int, cents: int, op: str, reason: str = "", meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # amount in euro per compatibilità con i vecchi record, cents è il valore esatto
+    return {
+        "t": time.time(), "guild_id": guild_id, "user_id": user_id,
+        "amount": cents / 100, "cents": cents, "op": op, "reason": reason, "meta": meta or {},
+    }
+
+def record(guild_id: int, user_id: int, cents: int, op: str, reason: str = "", meta: Optional[Dict[str, Any]] = None) -> None:
+    """Accoda un movimento per l'audit (scritto dal writer al prossimo lotto)."""
+    get_writer().submit(make_record(guild_id, user_id, cents, op, reason, meta))
+
+def record_many(records: Iterable[Dict[str, Any]]) -> int:
+    """Accoda più record (da make_record): per payroll e operazioni di massa."""
+    w = get_writer()
+    n = 0
+    for rec in records:
+        w.submit(rec)
+        n += 1
+    return n
+
+async def arecord(guild_id: int, user_id: int, cents: int, op: str, reason: str = "", meta: Optional[Dict[str, Any]] = None) -> None:
+    """Come record() dall'event loop: se la coda è piena l'attesa avviene nel pool I/O, non sul loop."""
+    await arecord_many([make_record(guild_id, user_id, cents, op, reason, meta)])
+
+async def arecord_many(records: Iterable[Dict[str, Any]]) -> int:
+    w = _writer if _writer is not None else await run_io(get_writer)
+    pending = list(records)
+    for i, rec in enumerate(pending):
+        if not w.submit_nowait(rec):
+            await run_io(record_many, pending[i:])
+            break
+    return len(pending)
+
+def flush() -> None:
+    """Attende che i record accodati siano su disco."""
+    if _writer is not None:
+        _writer.flush()
+
+def statement(guild_id: int, user_id: int, limit: int = 50, before: Optional[float] = None) -> List[Dict[str, Any]]:
+    """Estratto conto (bloccante: da chiamare nel pool I/O). Include i record ancora in coda."""
+    flush()
+    return list(get_audit_log().statement(guild_id, user_id, limit=limit, before=before))
+
+def stats() -> Dict[str, Any]:
+    return _writer.stats() if _writer is not None else {}
+
+def close() -> None:
+    """
+    Svuota la coda (flush garantito) e chiude i file. Idempotente: writer e log vengono
+    dimenticati, quindi dopo un riavvio del runner (main.py) il primo record li riapre.
+    """
+    global _writer, _audit
+    with _audit_lock:
+        writer, _writer = _writer, None
+        audit, _audit = _audit, None
+    if writer is not None:
+        writer.close()
+    if audit is not None:
+        audit.close()
+
+atexit.register(close)
@@ -0,0 +1,208 @@
+# utils/config_registry.py
+"""
+Registro centrale dei file di configurazione (data/roles.json, data/channels.json,
+data/economy_config.json).
+
+- ogni file viene letto e normalizzato UNA volta: le interaction leggono uno snapshot in memoria
+  (un dict), non il disco
+- lo snapshot è immutabile (dict -> MappingProxyType, liste -> tuple) e ha già pronti gli insiemi
+  di id ruolo (frozenset di int), così i controlli "ha uno di questi ruoli?" sono lookup in un set
+- il file si rilegge solo se cambia l'mtime (controllato al più ogni CHECK_INTERVAL secondi) o con
+  reload() (/config_reload)
+- un file illeggibile o non valido NON sostituisce lo snapshot buono precedente: l'errore viene
+  loggato (una volta per versione del file) e riportato da errors()
+"""
+from __future__ import annotations
+import json
+import logging
+import threading
+import time
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Mapping, Optional
+
+from utils.async_io import run_io
+
+log = logging.getLogger(__name__)
+
+CHECK_INTERVAL = 2.0  # secondi tra due stat() dello stesso file
+
+ROLES = "roles"
+CHANNELS = "channels"
+ECONOMY = "economy"
+
+
+def freeze(value: Any) -> Any:
+    """Copia in sola lettura: dict -> MappingProxyType, liste -> tuple (ricorsivo)."""
+    if isinstance(value, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+def to_ids(value: Any) -> FrozenSet[int]:
+    """int / str numerica / lista di questi -> frozenset di int (le voci non numeriche si scartano)."""
+    if value is None or isinstance(value, bool):
+        return frozenset()
+    if not isinstance(value, (list, tuple, set, frozenset)):
+        value = [value]
+    out = set()
+    for x in value:
+        try:
+            out.add(int(x))
+        except (TypeError, ValueError):
+            pass
+    return frozenset(out)
+
+
+class Snapshot:
+    """Contenuto di un file di configurazione, congelato, con gli id ruolo già convertiti."""
+    __slots__ = ("data", "mtime", "loaded_at", "_ids", "extra", "fallback")
+
+    def __init__(self, data: Mapping[str, Any], mtime: float, extra: Any = None, fallback: bool = False):
+        self.data = freeze(data)
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        self.extra = extra  # risultato del normalizzatore del file (es. la config economia compilata)
+        self.fallback = fallback  # True: il file non è mai stato valido, questo è il contenuto vuoto
+        ids: Dict[str, FrozenSet[int]] = {}
+        for k, v in self.data.items():
+            if isinstance(v, Mapping):
+                # gruppi annidati ("groups": {"staff": [...]}) -> "groups.staff"
+                for sub, sv in v.items():
+                    ids[f"{k}.{sub}"] = to_ids(sv)
+            else:
+                ids[k] = to_ids(v)
+        self._ids = ids
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self.data
+
+    def ids(self, *keys: str) -> FrozenSet[int]:
+        """Id ruolo della prima chiave non vuota tra `keys` (alias), es. ids("sep_licenze", "licenze")."""
+        for k in keys:
+            found = self._ids.get(k)
+            if found:
+                return found
+        return frozenset()
+
+    def id(self, key: str) -> Optional[int]:
+        """Un singolo id (chiavi come "cittadino"); None se assente."""
+        found = self._ids.get(key)
+        return next(iter(found)) if found and len(found) == 1 else None
+
+
+class _Entry:
+    def __init__(self, path: Path, normalize: Optional[Callable[[Dict[str, Any]], Any]]):
+        self.path = path
+        self.normalize = normalize
+        self.snapshot: Optional[Snapshot] = None
+        self.checked = 0.0          # monotonic dell'ultimo stat()
+        self.error: Optional[str] = None
+        self.bad_mtime: Optional[float] = None  # mtime del file non valido (non si rilegge finché non cambia)
+
+
+class ConfigRegistry:
+    def __init__(self):
+        self._entries: Dict[str, _Entry] = {}
+        self._lock = threading.Lock()  # i refresh possono arrivare da più thread di run_io
+
+    def register(self, name: str, path: Path | str, normalize: Optional[Callable[[Dict[str, Any]], Any]] = None) -> None:
+        """
+        Registra un file. `normalize(data)` (facoltativo) valida/converte il contenuto: il suo
+        risultato finisce in Snapshot.extra; se solleva ValueError il file è considerato non valido.
+        """
+        self._entries[name] = _Entry(Path(path), normalize)
+
+    def names(self) -> List[str]:
+        return list(self._entries)
+
+    # --- lettura ---
+    def _stale(self, e: _Entry) -> bool:
+        return e.snapshot is None or time.monotonic() - e.checked >= CHECK_INTERVAL
+
+    def _refresh(self, name: str, force: bool = False) -> Snapshot:
+        e = self._entries[name]
+        with self._lock:
+            if not force and not self._stale(e):
+                return e.snapshot
+            e.checked = time.monotonic()
+            try:
+                mtime = e.path.stat().st_mtime
+            except FileNotFoundError:
+                mtime = 0.0
+            if not force and e.snapshot is not None and mtime in (e.snapshot.mtime, e.bad_mtime):
+                return e.snapshot
+            try:
+                data = json.loads(e.path.read_text(encoding="utf-8")) if mtime else {}
+                if not isinstance(data, dict):
+                    raise ValueError("il file deve contenere un oggetto JSON")
+                extra = e.normalize(data) if e.normalize else None
+            except (OSError, ValueError) as ex:
+                # ValueError copre anche json.JSONDecodeError
+                e.error = f"{e.path}: {ex}"
+                e.bad_mtime = mtime
+                if e.snapshot is None:
+                    log.error("❌ Config %s non valida, uso una configurazione vuota: %s", name, ex)
+                    e.snapshot = Snapshot({}, mtime, e.normalize({}) if e.normalize else None, fallback=True)
+                else:
+                    log.error("❌ Config %s non valida, resta in uso la versione precedente: %s", name, ex)
+                return e.snapshot
+            e.snapshot = Snapshot(data, mtime, extra)
+            e.error = None
+            e.bad_mtime = None
+            log.info("Config %s caricata (%s)", name, e.path)
+            return e.snapshot
+
+    def get(self, name: str) -> Snapshot:
+        """Snapshot corrente: lettura in memoria; al più ogni CHECK_INTERVAL uno stat() del file."""
+        e = self._entries[name]
+        if not self._stale(e):
+            return e.snapshot
+        return self._refresh(name)
+
+    async def aget(self, name: str) -> Snapshot:
+        """Come get(), ma l'eventuale stat()/rilettura gira nel pool di I/O."""
+        e = self._entries[name]
+        if not self._stale(e):
+            return e.snapshot
+        return await run_io(self._refresh, name)
+
+    def reload(self, names: Optional[Iterable[str]] = None) -> Dict[str, Optional[str]]:
+        """Rilegge subito i file indicati (tutti se None). Ritorna {nome: errore o None}."""
+        out = {}
+        for name in names or list(self._entries):
+            self._refresh(name, force=True)
+            out[name] = self._entries[name].error
+        return out
+
+    def errors(self) -> Dict[str, str]:
+        return {n: e.error for n, e in self._entries.items() if e.error}
+
+
+def _compile_economy(data: Dict[str, Any]) -> Any:
+    # import locale: utils.economy_config importa questo modulo
+    from utils.economy_config import compile_config
+    return compile_config(data)
+
+
+# ---------- Istanza di processo ----------
+registry = ConfigRegistry()
+registry.register(ROLES, "data/roles.json")
+registry.register(CHANNELS, "data/channels.json")
+registry.register(ECONOMY, "data/economy_config.json", _compile_economy)
+
+def get(name: str) -> Snapshot:
+    return registry.get(name)
+
+async def aget(name: str) -> Snapshot:
+    return await registry.aget(name)
+
+async def areload(names: Optional[Iterable[str]] = None) -> Dict[str, Optional[str]]:
+    return await run_io(registry.reload, names)
@@ -1,13 +1,21 @@
 from __future__ import annotations
-import json, time
+import functools, json, logging, threading, time
 from pathlib import Path
 from typing import Optional
 
+from utils import audit_log, profili
+from utils.async_io import run_io, write_json_sync
+from utils.ledger import (
+    InsufficientFunds, bank_account, from_cents, get_ledger, mint_account, to_cents, wallet_account,
+)
+
+log = logging.getLogger(__name__)
+
 DATA_DIR = Path("data")
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-ECON_FILE = DATA_DIR / "economy.json"          # conti per gilda
-AUDIT_FILE = DATA_DIR / "economy_audit.jsonl"  # audit append-only
+ECON_FILE = DATA_DIR / "economy.json"          # legacy: saldi e IBAN vengono migrati (ledger / profilo) e tolti
+# audit: segmenti mensili indicizzati per utente in data/audit/ (vedi utils/audit_log)
 
 def _load() -> dict:
     if ECON_FILE.exists():
@@ -16,69 +24,220 @@ def _load() -> dict:
     return {}
 
 def _save(d: dict) -> None:
-    ECON_FILE.write_text(json.dumps(d, ensure_ascii=False, indent=2), encoding="utf-8")
+    write_json_sync(ECON_FILE, d)
 
 def _now() -> float: return time.time()
 
-def _ensure_guild(d: dict, gid: int) -> dict:
-    g = d.setdefault(str(gid), {})
-    g.setdefault("accounts", {})
-    return g
+# le operazioni possono girare nei thread del pool I/O: una alla volta
+_lock = threading.RLock()
+
+def _serialized(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _lock:
+            return fn(*args, **kwargs)
+    return wrapper
+
+def _async(fn):
+    """Versione awaitable di un'operazione: gira nel pool I/O, mai sull'event loop."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run_io(fn, *args, **kwargs)
+    wrapper.__name__ = wrapper.__qualname__ = "a" + fn.__name__
+    return wrapper
+
+# economy.json letto una volta: non è più la fonte di nulla, si svuota con le migrazioni
+_data: Optional[dict] = None
+
+def _db() -> dict:
+    global _data
+    if _data is None:
+        _data = _load()
+        _migrate_balances(_data)
+    return _data
+
+def _migrate_balances(d: dict) -> None:
+    """
+    Una tantum: i vecchi saldi float di economy.json diventano transazioni di apertura nel ledger
+    (una per gilda, dal conto mint) e spariscono dal file: è il file stesso a dire se la migrazione
+    è da fare, non lo stato del ledger (che può già avere altre transazioni, es. la riconciliazione
+    dei profili). La chiave della transazione è permanente: se il processo muore tra il post e il
+    salvataggio del file, alla ripresa la transazione si trova nel ledger e non si ripete.
+    """
+    ledger = get_ledger()
+    moved = False
+    for gid, g in d.items():
+        legs = []
+        for uid, a in (g.get("accounts") or {}).items():
+            if "wallet" not in a and "balance" not in (a.get("bank") or {}):
+                continue
+            w = to_cents(a.pop("wallet", 0) or 0)
+            b = to_cents((a.get("bank") or {}).pop("balance", 0) or 0)
+            legs += [(acc, c) for acc, c in ((wallet_account(gid, uid), w), (bank_account(gid, uid), b)) if c]
+            moved = True
+        total = sum(c for _, c in legs)
+        if not total:
+            continue
+        key = f"opening:economy_json:{gid}"
+        if ledger.find(key) is not None:
+            log.warning("Saldi di economy.json per la gilda %s già nel ledger: non vengono reimportati", gid)
+            continue
+        tx = ledger.post(legs + [(mint_account(gid), -total)], "OPENING", "Saldi importati da economy.json", key=key)
+        audit_log.record_many(
+            audit_log.make_record(int(gid), int(acc.rsplit(":", 1)[1]), c, "OPENING", "Saldi importati da economy.json",
+                                  {"account": acc.split(":", 1)[0], "tx": tx["seq"]})
+            for acc, c in legs
+        )
+        log.info("✅ Saldi di economy.json importati nel ledger: gilda %s, %s centesimi", gid, total)
+    if moved:
+        _save(d)
+
+@_serialized
+def migrate_balances() -> dict:
+    """
+    Esegue subito (all'avvio, prima della riconciliazione dei profili) l'eventuale migrazione dei
+    saldi. Ritorna gli IBAN ancora in economy.json ({user_id: iban}), da portare sul profilo.
+    """
+    ibans = {}
+    for g in _db().values():
+        for uid, a in (g.get("accounts") or {}).items():
+            iban = (a.get("bank") or {}).get("iban")
+            if iban and uid.isdigit():
+                ibans.setdefault(int(uid), iban)
+    return ibans
+
+@_serialized
+def _drop_legacy_ibans() -> None:
+    d = _db()
+    for g in d.values():
+        for a in (g.get("accounts") or {}).values():
+            (a.get("bank") or {}).pop("iban", None)
+    _save(d)
+
+async def amigrate_balances() -> None:
+    """
+    Migrazioni di economy.json: saldi -> ledger, poi IBAN -> profilo (`bank.iban`, l'unica fonte).
+    L'IBAN di economy.json si copia solo su profili che non ne hanno uno; il file si ripulisce
+    dopo la scrittura dei profili, quindi un crash in mezzo non perde nulla.
+    """
+    ibans = await run_io(migrate_balances)
+    if not ibans:
+        return
+
+    def patch(iban: str):
+        def fn(prof):
+            cur = (prof.get("bank") or {}).get("iban")
+            if cur and cur != iban:
+                log.warning("IBAN di economy.json %s scartato: il profilo ha già %s", iban, cur)
+            return None if cur else {"bank": {"iban": iban}}
+        return fn
+
+    results = await profili.abulk_update_profiles({uid: patch(iban) for uid, iban in ibans.items()})
+    failed = {uid: r["error"] for uid, r in results.items() if not r["ok"]}
+    if failed:
+        raise RuntimeError(f"IBAN di economy.json non migrati: {failed}")
+    await run_io(_drop_legacy_ibans)
+    log.info("✅ IBAN di economy.json portati sui profili: %s", sum(1 for r in results.values() if r["patch"]))
+
+def _view(guild_id: int, user_id: int, iban: Optional[str]) -> dict:
+    """Conto nella forma storica ({"wallet", "bank": {"iban", "balance"}}) + i centesimi esatti."""
+    ledger = get_ledger()
+    w_acc, b_acc = wallet_account(guild_id, user_id), bank_account(guild_id, user_id)
+    w, b = ledger.balance(w_acc), ledger.balance(b_acc)
+    touched = [t for t in (ledger.last_activity(w_acc), ledger.last_activity(b_acc)) if t]
+    return {
+        "wallet": from_cents(w),
+        "bank": {"iban": iban or None, "balance": from_cents(b)},
+        "updated_at": max(touched) if touched else _now(),
+        "cents": {"wallet": w, "bank": b},
+    }
+
+def _post(guild_id: int, legs, kind: str, reason: str, meta: dict | None = None,
+          insufficient: str = "Fondi insufficienti", key: Optional[str] = None) -> dict:
+    try:
+        return get_ledger().post(legs, kind, reason, meta, key)
+    except InsufficientFunds:
+        raise ValueError(insufficient) from None
 
-def _ensure_acct(d: dict, gid: int, uid: int) -> dict:
-    g = _ensure_guild(d, gid)
-    a = g["accounts"].setdefault(str(uid), {"wallet": 0, "bank": {"iban": None, "balance": 0}, "updated_at": _now()})
-    return a
+# l'IBAN sta SOLO nel profilo (bank.iban): qui lo si legge/scrive attraverso utils/profili
+def _iban(user_id: int) -> Optional[str]:
+    return (profili.get_profile(user_id, fields=profili.BANK_FIELDS).get("bank") or {}).get("iban")
 
+@_serialized
 def get_account(guild_id: int, user_id: int) -> dict:
-    d = _load()
-    return _ensure_acct(d, guild_id, user_id)
+    return _view(guild_id, user_id, _iban(user_id))
 
 def set_iban(guild_id: int, user_id: int, iban: Optional[str]) -> dict:
-    d = _load(); a = _ensure_acct(d, guild_id, user_id)
-    a["bank"]["iban"] = iban; a["updated_at"] = _now(); _save(d); _audit(guild_id, user_id, 0, "SET_IBAN", meta={"iban": iban})
-    return a
+    profili.set_profile(user_id, bank={"iban": iban or ""})
+    _audit(guild_id, user_id, 0, "SET_IBAN", meta={"iban": iban})
+    return get_account(guild_id, user_id)
 
+@_serialized
 def deposit_wallet(guild_id: int, user_id: int, amount: int | float, reason: str="") -> dict:
-    d = _load(); a = _ensure_acct(d, guild_id, user_id)
-    a["wallet"] = float(a.get("wallet", 0)) + float(amount); a["updated_at"] = _now(); _save(d)
-    _audit(guild_id, user_id, amount, "WALLET_DEPOSIT", reason)
-    return a
+    c = to_cents(amount)
+    if c <= 0: raise ValueError("Importo non valido")
+    tx = _post(guild_id, [(mint_account(guild_id), -c), (wallet_account(guild_id, user_id), c)], "WALLET_DEPOSIT", reason)
+    _audit(guild_id, user_id, c, "WALLET_DEPOSIT", reason, meta={"tx": tx["seq"]})
+    return _view(guild_id, user_id, _iban(user_id))
 
+@_serialized
 def withdraw_wallet(guild_id: int, user_id: int, amount: int | float, reason: str="") -> dict:
-    d = _load(); a = _ensure_acct(d, guild_id, user_id)
-    if float(a.get("wallet",0)) < amount: raise ValueError("Fondi insufficienti in portafoglio")
-    a["wallet"] = float(a["wallet"]) - float(amount); a["updated_at"] = _now(); _save(d)
-    _audit(guild_id, user_id, -amount, "WALLET_WITHDRAW", reason)
-    return a
+    c = to_cents(amount)
+    if c <= 0: raise ValueError("Importo non valido")
+    tx = _post(guild_id, [(wallet_account(guild_id, user_id), -c), (mint_account(guild_id), c)], "WALLET_WITHDRAW", reason,
+               insufficient="Fondi insufficienti in portafoglio")
+    _audit(guild_id, user_id, -c, "WALLET_WITHDRAW", reason, meta={"tx": tx["seq"]})
+    return _view(guild_id, user_id, _iban(user_id))
 
+@_serialized
 def deposit_bank(guild_id: int, user_id: int, amount: int | float, reason: str="") -> dict:
-    d = _load(); a = _ensure_acct(d, guild_id, user_id)
-    a["bank"]["balance"] = float(a["bank"].get("balance",0)) + float(amount); a["updated_at"] = _now(); _save(d)
-    _audit(guild_id, user_id, amount, "BANK_DEPOSIT", reason)
-    return a
+    c = to_cents(amount)
+    if c <= 0: raise ValueError("Importo non valido")
+    tx = _post(guild_id, [(mint_account(guild_id), -c), (bank_account(guild_id, user_id), c)], "BANK_DEPOSIT", reason)
+    _audit(guild_id, user_id, c, "BANK_DEPOSIT", reason, meta={"tx": tx["seq"]})
+    return _view(guild_id, user_id, _iban(user_id))
 
+@_serialized
 def withdraw_bank(guild_id: int, user_id: int, amount: int | float, reason: str="") -> dict:
-    d = _load(); a = _ensure_acct(d, guild_id, user_id)
-    if float(a["bank"].get("balance",0)) < amount: raise ValueError("Fondi insufficienti in banca")
-    a["bank"]["balance"] = float(a["bank"]["balance"]) - float(amount); a["updated_at"] = _now(); _save(d)
-    _audit(guild_id, user_id, -amount, "BANK_WITHDRAW", reason)
-    return a
-
-def transfer_bank(guild_id: int, from_uid: int, to_uid: int, amount: int | float, reason: str="") -> None:
-    if amount <= 0: raise ValueError("Importo non valido")
-    d = _load()
-    a_from = _ensure_acct(d, guild_id, from_uid)
-    a_to   = _ensure_acct(d, guild_id, to_uid)
-    if float(a_from["bank"].get("balance",0)) < amount: raise ValueError("Fondi insufficienti")
-    a_from["bank"]["balance"] = float(a_from["bank"]["balance"]) - float(amount)
-    a_to["bank"]["balance"]   = float(a_to["bank"].get("balance",0)) + float(amount)
-    a_from["updated_at"] = a_to["updated_at"] = _now()
-    _save(d)
-    _audit(guild_id, from_uid, -amount, "BANK_TRANSFER_OUT", reason, meta={"to": to_uid})
-    _audit(guild_id, to_uid, amount, "BANK_TRANSFER_IN", reason, meta={"from": from_uid})
+    c = to_cents(amount)
+    if c <= 0: raise ValueError("Importo non valido")
+    tx = _post(guild_id, [(bank_account(guild_id, user_id), -c), (mint_account(guild_id), c)], "BANK_WITHDRAW", reason,
+               insufficient="Fondi insufficienti in banca")
+    _audit(guild_id, user_id, -c, "BANK_WITHDRAW", reason, meta={"tx": tx["seq"]})
+    return _view(guild_id, user_id, _iban(user_id))
+
+@_serialized
+def transfer_bank(guild_id: int, from_uid: int, to_uid: int, amount: int | float, reason: str="", key: Optional[str]=None) -> dict:
+    """Bonifico tra conti; ritorna la transazione. `key` (es. id dell'interazione) rende la richiesta idempotente."""
+    c = to_cents(amount)
+    if c <= 0: raise ValueError("Importo non valido")
+    # UNA transazione: o si muovono entrambi i conti o nessuno
+    tx = _post(guild_id, [(bank_account(guild_id, from_uid), -c), (bank_account(guild_id, to_uid), c)], "BANK_TRANSFER", reason,
+               meta={"from": from_uid, "to": to_uid}, key=key, insufficient="Fondi insufficienti sul conto")
+    if tx.get("replayed"):
+        return tx  # duplicato: bonifico e audit già registrati
+    audit_log.record_many([
+        audit_log.make_record(guild_id, from_uid, -c, "BANK_TRANSFER_OUT", reason, {"to": to_uid, "tx": tx["seq"]}),
+        audit_log.make_record(guild_id, to_uid, c, "BANK_TRANSFER_IN", reason, {"from": from_uid, "tx": tx["seq"]}),
+    ])
+    return tx
+
+def _audit(gid: int, uid: int, cents: int, op: str, reason: str="", meta: dict | None=None):
+    audit_log.record(gid, uid, cents, op, reason, meta)
+
+# ---------- API async (per cog/view) ----------
+async def aget_account(guild_id: int, user_id: int) -> dict:
+    # profilo letto sul loop (cache), saldi nel pool I/O
+    prof = await profili.aget_profile(user_id, fields=profili.BANK_FIELDS)
+    return await run_io(_serialized(_view), guild_id, user_id, (prof.get("bank") or {}).get("iban"))
+
+async def aset_iban(guild_id: int, user_id: int, iban: Optional[str]) -> dict:
+    await profili.aset_profile(user_id, bank={"iban": iban or ""})
+    await run_io(_audit, guild_id, user_id, 0, "SET_IBAN", meta={"iban": iban})
+    return await aget_account(guild_id, user_id)
 
-def _audit(gid: int, uid: int, amount: float, op: str, reason: str="", meta: dict | None=None):
-    rec = {"t": _now(), "guild_id": gid, "user_id": uid, "amount": amount, "op": op, "reason": reason, "meta": meta or {}}
-    with AUDIT_FILE.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
\ No newline at end of file
+adeposit_wallet  = _async(deposit_wallet)
+awithdraw_wallet = _async(withdraw_wallet)
+adeposit_bank    = _async(deposit_bank)
+awithdraw_bank   = _async(withdraw_bank)
+atransfer_bank   = _async(transfer_bank)
@@ -0,0 +1,138 @@
+# utils/economy_config.py
+"""
+Configurazione dell'economia (data/economy_config.json): schema, validazione e forma compilata.
+
+- il file viene validato per intero: TUTTI gli errori vengono riportati insieme, ognuno con il
+  percorso della voce (es. `salary_per_cycle.1408613574850379959.amount: ...`)
+- un file non valido non viene MAI riscritto: il registro (utils/config_registry) continua a
+  servire l'ultima versione buona
+- la forma compilata (EconomyConfig) è immutabile ed è la stessa per payroll e banca: la tabella
+  stipendi è già un SalaryIndex in centesimi
+
+Formato di una voce stipendio (chiave = id del ruolo):
+    "1408613574850379959": 800
+    "1408613574850379959": {"amount": 800, "label": "🏛️ Cittadino", "note": "..."}
+Le chiavi che iniziano con "_" sono commenti e vengono ignorate (a ogni livello).
+"""
+from __future__ import annotations
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from utils import config_registry
+from utils.ledger import to_cents
+from utils.payroll import SalaryIndex
+
+
+class ConfigError(ValueError):
+    """Config non valida; `errors` sono i messaggi "percorso: problema"."""
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+class EconomyConfig(NamedTuple):
+    salary: SalaryIndex
+    bank_log_channel_id: int
+    min_operation_amount: float
+    max_operation_amount: float
+    payroll_log_channel_id: int
+    delete_logs_after_seconds: int
+    payroll_mode: str
+    log_prefix: str
+
+
+# campo -> (tipi ammessi, default)
+_NUMBER = (int, float)
+SCHEMA: Mapping[str, Tuple[Tuple[type, ...], Any]] = MappingProxyType({
+    "bank_log_channel_id": ((int,), 0),
+    "min_operation_amount": (_NUMBER, 1),
+    "max_operation_amount": (_NUMBER, 1_000_000),
+    "payroll_log_channel_id": ((int,), 1409251318153089044),
+    "delete_logs_after_seconds": ((int,), 120),
+    "payroll_mode": ((str,), "monthly"),
+    "log_prefix": ((str,), "Comune di Venezia — Stipendi"),
+})
+SALARY_KEY = "salary_per_cycle"
+PAYROLL_MODES = ("monthly", "daily")
+# chiavi delle versioni precedenti del file, accettate e ignorate
+OBSOLETE = frozenset({"payroll_minutes"})
+SALARY_FIELDS = ("amount", "label", "note")
+
+def _is(value: Any, types: Tuple[type, ...]) -> bool:
+    return isinstance(value, types) and not isinstance(value, bool)
+
+def _salary(raw: Any, errors: List[str]) -> SalaryIndex:
+    if not isinstance(raw, Mapping):
+        errors.append(f"{SALARY_KEY}: deve essere un oggetto {{\"ROLE_ID\": importo}}")
+        return SalaryIndex({})
+    by_role: Dict[int, int] = {}
+    labels: Dict[int, str] = {}
+    for key, entry in raw.items():
+        if key.startswith("_"):
+            continue
+        path = f"{SALARY_KEY}.{key}"
+        if not key.isdigit():
+            errors.append(f"{path}: la chiave deve essere l'id numerico del ruolo")
+            continue
+        label = None
+        if isinstance(entry, Mapping):
+            for k in entry:
+                if not k.startswith("_") and k not in SALARY_FIELDS:
+                    errors.append(f"{path}.{k}: campo sconosciuto (ammessi: {', '.join(SALARY_FIELDS)})")
+            label = entry.get("label")
+            if label is not None and not isinstance(label, str):
+                errors.append(f"{path}.label: deve essere una stringa")
+                label = None
+            amount, path = entry.get("amount"), f"{path}.amount"
+        else:
+            amount = entry
+        if not _is(amount, _NUMBER) or amount < 0:
+            errors.append(f"{path}: deve essere un numero >= 0, trovato {amount!r}")
+            continue
+        by_role[int(key)] = to_cents(amount)
+        if label:
+            labels[int(key)] = label
+    return SalaryIndex(by_role, labels)
+
+def compile_config(data: Mapping[str, Any]) -> EconomyConfig:
+    """Valida `data` (il JSON del file) e lo compila; ConfigError con tutti i problemi trovati."""
+    errors: List[str] = []
+    for key in data:
+        if not key.startswith("_") and key != SALARY_KEY and key not in SCHEMA and key not in OBSOLETE:
+            errors.append(f"{key}: chiave sconosciuta")
+    values: Dict[str, Any] = {}
+    for key, (types, default) in SCHEMA.items():
+        value = data.get(key, default)
+        if not _is(value, types):
+            errors.append(f"{key}: tipo non valido ({type(value).__name__}), atteso {'/'.join(t.__name__ for t in types)}")
+            value = default
+        values[key] = value
+    salary = _salary(data.get(SALARY_KEY, {}), errors)
+    if values["min_operation_amount"] <= 0:
+        errors.append("min_operation_amount: deve essere > 0")
+    if values["max_operation_amount"] < values["min_operation_amount"]:
+        errors.append("max_operation_amount: deve essere >= min_operation_amount")
+    if values["payroll_mode"] not in PAYROLL_MODES:
+        errors.append(f"payroll_mode: deve essere uno tra {', '.join(PAYROLL_MODES)}, trovato {values['payroll_mode']!r}")
+    if values["delete_logs_after_seconds"] < 0:
+        errors.append("delete_logs_after_seconds: deve essere >= 0")
+    if errors:
+        raise ConfigError(errors)
+    return EconomyConfig(salary=salary, **values)
+
+
+DEFAULTS = compile_config({})
+
+def current() -> Optional[EconomyConfig]:
+    """Ultima config valida; None se il file non è mai stato valido (dall'avvio)."""
+    snap = config_registry.get(config_registry.ECONOMY)
+    return None if snap.fallback else snap.extra
+
+async def acurrent() -> Optional[EconomyConfig]:
+    snap = await config_registry.aget(config_registry.ECONOMY)
+    return None if snap.fallback else snap.extra
+
+def error() -> Optional[str]:
+    """Errore dell'ultimo caricamento del file, se c'è (anche quando resta in uso una versione buona)."""
+    return config_registry.registry.errors().get(config_registry.ECONOMY)
@@ -1,30 +1,85 @@
 # utils/iban.py
+"""
+IBAN della "VeneziaRP Bank": generazione, validazione e rilascio in blocco.
+
+- mod-97 (ISO 7064) a blocchi di 7 cifre: interi piccoli, niente ciclo cifra per cifra
+- il numero di conto è `user_id % 10**12`: due utenti con le stesse ultime 12 cifre avrebbero
+  lo stesso IBAN. issue_ibans() se ne accorge e al secondo assegna un numero derivato
+  (tentativo 1, 2, ...), sempre diverso dagli IBAN già in uso
+"""
 from __future__ import annotations
+import hashlib
+import re
+import string
+from typing import Any, Dict, Iterable, MutableSet
 
 # Parametri fittizi della "VeneziaRP Bank"
 ABI = "12345"  # 5 cifre
 CAB = "67890"  # 5 cifre
 CIN = "X"      # 1 lettera
 
+ACCOUNT_DIGITS = 12
+MAX_ATTEMPTS = 100
+
+# lunghezze ufficiali dei paesi che ci interessano; gli altri: solo formato + mod-97
+IBAN_LENGTHS = {"IT": 27, "SM": 27, "VA": 22}
+
+_IBAN_RE = re.compile(r"^[A-Z]{2}[0-9]{2}[A-Z0-9]{11,30}$")
+_LETTERS = str.maketrans({ch: str(ord(ch) - 55) for ch in string.ascii_uppercase})  # A->10 ... Z->35
+
+def normalize_iban(iban: Any) -> str:
+    return "".join(str(iban or "").split()).upper()
+
 def _alnum_to_digits(s: str) -> str:
-    out = []
-    for ch in s:
-        if ch.isdigit():
-            out.append(ch)
-        else:
-            out.append(str(ord(ch.upper()) - 55))  # A->10 ... Z->35
-    return "".join(out)
+    return s.upper().translate(_LETTERS)
 
-def _iban_check_digits(country: str, bban: str) -> str:
-    rearranged = bban + country + "00"
-    number = _alnum_to_digits(rearranged)
+def _mod97(digits: str) -> int:
+    # a blocchi: resto (2 cifre) + 7 cifre nuove stanno comodamente in un int piccolo
     rem = 0
-    for ch in number:
-        rem = (rem * 10 + int(ch)) % 97
+    for i in range(0, len(digits), 7):
+        rem = int(f"{rem}{digits[i:i + 7]}") % 97
+    return rem
+
+def _iban_check_digits(country: str, bban: str) -> str:
+    rem = _mod97(_alnum_to_digits(bban + country + "00"))
     return f"{98 - rem:02d}"
 
-def generate_iban(user_id: int) -> str:
-    conto12 = f"{user_id % 10**12:012d}"
+def validate_iban(iban: Any) -> bool:
+    """Formato, lunghezza (per i paesi noti) e cifre di controllo."""
+    s = normalize_iban(iban)
+    if not _IBAN_RE.match(s):
+        return False
+    expected = IBAN_LENGTHS.get(s[:2])
+    if expected is not None and len(s) != expected:
+        return False
+    return _mod97(_alnum_to_digits(s[4:] + s[:4])) == 1
+
+def account_number(user_id: int, attempt: int = 0) -> int:
+    """Numero di conto a 12 cifre: le ultime cifre dell'id, oppure (collisione) uno derivato."""
+    if attempt == 0:
+        return user_id % 10**ACCOUNT_DIGITS
+    h = hashlib.blake2b(f"{user_id}:{attempt}".encode(), digest_size=8).digest()
+    return int.from_bytes(h, "big") % 10**ACCOUNT_DIGITS
+
+def generate_iban(user_id: int, attempt: int = 0) -> str:
+    conto12 = f"{account_number(user_id, attempt):0{ACCOUNT_DIGITS}d}"
     bban = f"{CIN}{ABI}{CAB}{conto12}"  # 1+5+5+12=23
     check = _iban_check_digits("IT", bban)
-    return f"IT{check}{bban}"
\ No newline at end of file
+    return f"IT{check}{bban}"
+
+def issue_ibans(user_ids: Iterable[int], taken: MutableSet[str]) -> Dict[int, str]:
+    """
+    IBAN nuovi per `user_ids`, tutti diversi tra loro e da `taken` (IBAN già in uso, normalizzati),
+    che viene aggiornato. Ritorna {user_id: iban}.
+    """
+    out: Dict[int, str] = {}
+    for uid in user_ids:
+        for attempt in range(MAX_ATTEMPTS):
+            iban = generate_iban(uid, attempt)
+            if iban not in taken:
+                taken.add(iban)
+                out[uid] = iban
+                break
+        else:
+            raise RuntimeError(f"Nessun IBAN libero per {uid}")
+    return out
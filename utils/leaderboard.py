@@ -0,0 +1,228 @@
+# utils/leaderboard.py
+"""
+Classifica della ricchezza (portafoglio + conto) per gilda, mantenuta in modo incrementale.
+
+Ogni transazione del ledger notifica la classifica (Ledger.subscribe): si aggiornano solo gli
+utenti toccati dalle gambe della transazione. Payroll, /deposita, /preleva, bonifici e
+utils/economy passano tutti dal ledger, quindi nessuno deve ricordarsi di aggiornarla.
+
+Per gilda c'è un treap con la dimensione dei sottoalberi (albero di statistiche d'ordine):
+- inserimento/rimozione O(log n)
+- "la mia posizione" e "l'i-esimo" O(log n), quindi una pagina da k righe costa O(k log n)
+Le chiavi sono (-totale, user_id): ordine per ricchezza decrescente, a parità per id.
+"""
+from __future__ import annotations
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from utils.ledger import get_ledger
+
+PAGE_SIZE = 10
+
+Key = Tuple[int, int]
+
+
+# ---------- Treap con dimensioni ----------
+class _Node:
+    __slots__ = ("key", "prio", "size", "left", "right")
+
+    def __init__(self, key: Key):
+        self.key = key
+        self.prio = random.random()
+        self.size = 1
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+
+def _size(n: Optional[_Node]) -> int:
+    return n.size if n is not None else 0
+
+def _fix(n: _Node) -> _Node:
+    n.size = 1 + _size(n.left) + _size(n.right)
+    return n
+
+def _split(n: Optional[_Node], key: Key) -> Tuple[Optional[_Node], Optional[_Node]]:
+    # (chiavi < key, chiavi >= key)
+    if n is None:
+        return None, None
+    if n.key < key:
+        l, r = _split(n.right, key)
+        n.right = l
+        return _fix(n), r
+    l, r = _split(n.left, key)
+    n.left = r
+    return l, _fix(n)
+
+def _merge(a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+    # tutte le chiavi di a < tutte le chiavi di b
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        a.right = _merge(a.right, b)
+        return _fix(a)
+    b.left = _merge(a, b.left)
+    return _fix(b)
+
+def _remove(n: Optional[_Node], key: Key) -> Optional[_Node]:
+    if n is None:
+        return None
+    if key == n.key:
+        return _merge(n.left, n.right)
+    if key < n.key:
+        n.left = _remove(n.left, key)
+    else:
+        n.right = _remove(n.right, key)
+    return _fix(n)
+
+
+class RankTree:
+    """Insieme ordinato di chiavi con rango e selezione per posizione in O(log n)."""
+
+    def __init__(self):
+        self._root: Optional[_Node] = None
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def add(self, key: Key) -> None:
+        l, r = _split(self._root, key)
+        self._root = _merge(_merge(l, _Node(key)), r)
+
+    def discard(self, key: Key) -> None:
+        self._root = _remove(self._root, key)
+
+    def rank(self, key: Key) -> int:
+        """Quante chiavi sono < key (posizione 0-based di key, se presente)."""
+        n, out = self._root, 0
+        while n is not None:
+            if n.key < key:
+                out += _size(n.left) + 1
+                n = n.right
+            else:
+                n = n.left
+        return out
+
+    def select(self, i: int) -> Key:
+        """Chiave in posizione i (0-based)."""
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        n = self._root
+        while True:
+            left = _size(n.left)
+            if i < left:
+                n = n.left
+            elif i == left:
+                return n.key
+            else:
+                i -= left + 1
+                n = n.right
+
+
+# ---------- Classifica per gilda ----------
+def _owner(account: str) -> Optional[Tuple[int, int]]:
+    # "wallet:{g}:{u}" / "bank:{g}:{u}" -> (g, u); conti di sistema esclusi
+    kind, _, rest = account.partition(":")
+    if kind not in ("wallet", "bank"):
+        return None
+    g, _, u = rest.partition(":")
+    try:
+        return int(g), int(u)
+    except ValueError:
+        return None
+
+
+class Leaderboard:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[int, Dict[int, int]] = {}   # gilda -> {utente: centesimi}
+        self._trees: Dict[int, RankTree] = {}
+
+    def _set(self, guild_id: int, user_id: int, total: int) -> None:
+        totals = self._totals.setdefault(guild_id, {})
+        tree = self._trees.setdefault(guild_id, RankTree())
+        old = totals.get(user_id, 0)
+        if old == total:
+            return
+        if old > 0:
+            tree.discard((-old, user_id))
+        if total > 0:
+            tree.add((-total, user_id))
+            totals[user_id] = total
+        else:
+            totals.pop(user_id, None)
+
+    def load(self, balances: Dict[str, int]) -> None:
+        sums: Dict[Tuple[int, int], int] = {}
+        for account, cents in balances.items():
+            who = _owner(account)
+            if who is not None:
+                sums[who] = sums.get(who, 0) + cents
+        with self._lock:
+            for (g, u), total in sums.items():
+                self._set(g, u, total)
+
+    def on_transaction(self, tx: Dict) -> None:
+        """Listener del ledger: applica le gambe della transazione (già registrata)."""
+        with self._lock:
+            for account, cents in tx["legs"]:
+                who = _owner(account)
+                if who is not None:
+                    g, u = who
+                    self._set(g, u, self._totals.get(g, {}).get(u, 0) + cents)
+
+    # --- query ---
+    def size(self, guild_id: int) -> int:
+        with self._lock:
+            tree = self._trees.get(guild_id)
+            return len(tree) if tree else 0
+
+    def top(self, guild_id: int, offset: int = 0, limit: int = PAGE_SIZE) -> List[Tuple[int, int, int]]:
+        """[(posizione 1-based, user_id, centesimi)] da `offset`, al massimo `limit` righe."""
+        with self._lock:
+            tree = self._trees.get(guild_id)
+            if not tree:
+                return []
+            out = []
+            for i in range(max(0, offset), min(len(tree), offset + limit)):
+                neg, uid = tree.select(i)
+                out.append((i + 1, uid, -neg))
+            return out
+
+    def rank(self, guild_id: int, user_id: int) -> Optional[Tuple[int, int]]:
+        """(posizione 1-based, centesimi) dell'utente, None se non è in classifica (saldo 0)."""
+        with self._lock:
+            total = self._totals.get(guild_id, {}).get(user_id, 0)
+            if total <= 0:
+                return None
+            return self._trees[guild_id].rank((-total, user_id)) + 1, total
+
+    def page(self, guild_id: int, page: int, page_size: int = PAGE_SIZE) -> List[Tuple[int, int, int]]:
+        return self.top(guild_id, page * page_size, page_size)
+
+    def pages(self, guild_id: int, page_size: int = PAGE_SIZE) -> int:
+        return max(1, -(-self.size(guild_id) // page_size))
+
+
+# ---------- Istanza di processo ----------
+_board: Optional[Leaderboard] = None
+_board_lock = threading.Lock()
+
+def get_leaderboard() -> Leaderboard:
+    """
+    Alla prima chiamata costruisce la classifica dai saldi del ledger (replay, bloccante:
+    da chiamare nel pool I/O) e si iscrive alle transazioni successive.
+    """
+    global _board
+    if _board is None:
+        with _board_lock:
+            if _board is None:
+                board = Leaderboard()
+                # saldi e iscrizione sotto lo stesso lock del ledger: nessuna transazione persa
+                board.load(get_ledger().subscribe(board.on_transaction))
+                _board = board
+    return _board
+
+def is_loaded() -> bool:
+    return _board is not None
@@ -0,0 +1,370 @@
+# utils/ledger.py
+"""
+Libro mastro a partita doppia, importi in centesimi interi.
+
+- ogni movimento è una transazione bilanciata: lista di gambe (conto, centesimi) con somma 0
+- le transazioni sono righe append-only di data/ledger.jsonl (una riga = una transazione,
+  scritta con fsync): un bonifico è UNA riga, non due riscritture di file
+- i saldi sono materializzati in memoria e aggiornati a ogni transazione: leggere un saldo è O(1)
+- all'avvio i saldi si ricostruiscono riapplicando le transazioni in ordine di `seq`:
+  interi, niente float, quindi il risultato è sempre lo stesso
+- idempotenza: una transazione può portare una chiave (es. l'id dell'interazione Discord).
+  Se la stessa chiave arriva di nuovo entro IDEMPOTENCY_TTL, post() non scrive nulla e ritorna
+  la transazione originale (con i saldi di allora in "after"). La chiave sta nella riga stessa
+  del ledger, quindi transazione e chiave sono scritte insieme; l'indice (LRU limitato) si
+  ricostruisce nel replay con le sole transazioni recenti
+
+Conti:
+- wallet:{guild_id}:{user_id}   portafoglio
+- bank:{guild_id}:{user_id}     conto bancario
+- system:{guild_id}:mint        emissione/distruzione di denaro (stipendi, spese): può andare in negativo
+"""
+from __future__ import annotations
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+LEDGER_FILE = Path("data/ledger.jsonl")
+
+IDEMPOTENCY_TTL = 24 * 3600      # secondi in cui una chiave ripetuta è riconosciuta come duplicato
+IDEMPOTENCY_MAX = 10_000         # chiavi tenute in memoria (LRU)
+
+Leg = Tuple[str, int]
+
+
+# ---------- Importi ----------
+def to_cents(amount: Any) -> int:
+    """Euro (int/float/str) -> centesimi interi, arrotondando al centesimo (half-up)."""
+    if isinstance(amount, bool):
+        raise ValueError("Importo non valido")
+    if isinstance(amount, int):
+        return amount * 100
+    if isinstance(amount, float) and not math.isfinite(amount):
+        raise ValueError("Importo non valido")
+    try:
+        # str(): 0.1 diventa "0.1" e non 0.1000000000000000055...
+        d = Decimal(str(amount).strip().replace(",", "."))
+    except InvalidOperation:
+        raise ValueError("Importo non valido") from None
+    if not d.is_finite():
+        raise ValueError("Importo non valido")
+    try:
+        return int((d * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    except ArithmeticError:  # es. "1e999999": oltre la precisione del contesto decimal
+        raise ValueError("Importo non valido") from None
+
+def from_cents(cents: int) -> float:
+    """Centesimi -> euro, solo per visualizzazione (money_fmt) e per i vecchi campi float."""
+    return cents / 100
+
+
+# ---------- Conti ----------
+def wallet_account(guild_id: int, user_id: int) -> str:
+    return f"wallet:{guild_id}:{user_id}"
+
+def bank_account(guild_id: int, user_id: int) -> str:
+    return f"bank:{guild_id}:{user_id}"
+
+def mint_account(guild_id: int) -> str:
+    return f"system:{guild_id}:mint"
+
+def is_system_account(account: str) -> bool:
+    return account.startswith("system:")
+
+
+class InsufficientFunds(ValueError):
+    def __init__(self, account: str, available: int, requested: int):
+        super().__init__(f"Fondi insufficienti su {account}")
+        self.account = account
+        self.available = available
+        self.requested = requested
+
+
+class Ledger:
+    def __init__(self, path: Path = LEDGER_FILE):
+        self.path = path
+        self._lock = threading.RLock()
+        self._balances: Optional[Dict[str, int]] = None
+        self._last_t: Dict[str, float] = {}   # ultimo movimento per conto
+        self._keys: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()  # chiave -> transazione
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+        self._seq = 0
+        self._offset = 0                       # byte dopo l'ultima transazione valida
+        self._file = None
+
+    # --- avvio: replay ---
+    def _load(self) -> Dict[str, int]:
+        if self._balances is not None:
+            return self._balances
+        balances: Dict[str, int] = {}
+        seq = 0
+        since = time.time() - IDEMPOTENCY_TTL
+        if self.path.exists():
+            valid = 0
+            with self.path.open("rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("riga incompleta")
+                        tx = json.loads(line)
+                    except Exception:
+                        break  # transazione troncata da un crash: non è mai avvenuta
+                    valid += len(line)
+                    _apply(balances, tx["legs"])
+                    self._touch(tx)
+                    if "key" in tx and tx["t"] >= since:
+                        self._remember(tx)
+                    seq = tx["seq"]
+            if valid < self.path.stat().st_size:
+                log.warning("Ledger: scartata una transazione incompleta in coda")
+                with self.path.open("r+b") as f:
+                    f.truncate(valid)
+        self._seq = seq
+        self._offset = valid if self.path.exists() else 0
+        self._balances = balances
+        return balances
+
+    # --- letture ---
+    def balance(self, account: str) -> int:
+        with self._lock:
+            return self._load().get(account, 0)
+
+    def balances(self, prefix: str = "") -> Dict[str, int]:
+        """Saldi dei conti che iniziano con `prefix` (es. "bank:123:")."""
+        with self._lock:
+            return {k: v for k, v in self._load().items() if k.startswith(prefix)}
+
+    def last_activity(self, account: str) -> Optional[float]:
+        with self._lock:
+            self._load()
+            return self._last_t.get(account)
+
+    @property
+    def loaded(self) -> bool:
+        return self._balances is not None
+
+    @property
+    def seq(self) -> int:
+        with self._lock:
+            self._load()
+            return self._seq
+
+    def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Transazione già registrata con questa chiave (entro IDEMPOTENCY_TTL), altrimenti None."""
+        with self._lock:
+            self._load()
+            tx = self._keys.get(key)
+            if tx is None:
+                return None
+            if tx["t"] < time.time() - IDEMPOTENCY_TTL:
+                del self._keys[key]
+                return None
+            self._keys.move_to_end(key)
+            return tx
+
+    def find(self, key: str, offset: int = 0) -> Optional[Dict[str, Any]]:
+        """
+        Come lookup(), ma senza scadenza: se la chiave non è più nell'indice in memoria si cerca nel
+        file da `offset` (es. quello letto con `offset` prima del post). Per i controlli di recupero.
+        """
+        tx = self.lookup(key)
+        if tx is not None:
+            return tx
+        for tx in self.iter_transactions(offset):
+            if tx.get("key") == key:
+                return tx
+        return None
+
+    @property
+    def offset(self) -> int:
+        """Byte dopo l'ultima transazione valida: le prossime verranno scritte da qui."""
+        with self._lock:
+            self._load()
+            return self._offset
+
+    def subscribe(self, listener: Callable[[Dict[str, Any]], None]) -> Dict[str, int]:
+        """
+        Iscrive `listener` alle transazioni future (chiamato dopo ogni post, sotto il lock) e
+        ritorna una copia dei saldi attuali: insieme danno una vista senza buchi (es. classifica).
+        """
+        with self._lock:
+            balances = dict(self._load())
+            self._listeners.append(listener)
+            return balances
+
+    def checkpoint(self) -> Dict[str, Any]:
+        """Stato coerente per uno snapshot: ultima seq, suo offset nel file e copia dei saldi."""
+        with self._lock:
+            balances = self._load()
+            if self._file is not None:
+                self._file.flush()
+            return {"seq": self._seq, "t": time.time(), "offset": self._offset, "balances": dict(balances)}
+
+    def iter_transactions(self, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """Tutte le transazioni valide, in ordine (da `offset`, es. quello di uno snapshot)."""
+        with self._lock:
+            self._load()
+            if self._file is not None:
+                self._file.flush()
+            last = self._seq
+        for tx in iter_file(self.path, offset):
+            if tx["seq"] > last:
+                return
+            yield tx
+
+    def rebuild(self) -> Dict[str, int]:
+        """Saldi ricostruiti da zero dal file (non tocca quelli in memoria)."""
+        balances: Dict[str, int] = {}
+        for tx in self.iter_transactions():
+            _apply(balances, tx["legs"])
+        return balances
+
+    # --- scritture ---
+    def post(
+        self,
+        legs: Sequence[Leg],
+        kind: str,
+        reason: str = "",
+        meta: Optional[Dict[str, Any]] = None,
+        key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Registra UNA transazione bilanciata (tutto o niente) e ritorna il record scritto.
+        I conti non di sistema non possono andare sotto zero: InsufficientFunds.
+        Con `key` già vista: nessuna scrittura, ritorna l'originale con "replayed": True.
+        """
+        legs = _merge_legs(legs)
+        if not legs:
+            raise ValueError("Transazione vuota")
+        if sum(c for _, c in legs) != 0:
+            raise ValueError("Transazione non bilanciata")
+        with self._lock:
+            balances = self._load()
+            if key is not None:
+                prev = self.lookup(key)
+                if prev is not None:
+                    return dict(prev, replayed=True)
+            for account, cents in legs:
+                if cents < 0 and not is_system_account(account):
+                    available = balances.get(account, 0)
+                    if available + cents < 0:
+                        raise InsufficientFunds(account, available, -cents)
+            tx = {
+                "seq": self._seq + 1,
+                "t": time.time(),
+                "kind": kind,
+                "legs": [[a, c] for a, c in legs],
+            }
+            if reason:
+                tx["reason"] = reason
+            if meta:
+                tx["meta"] = meta
+            if key is not None:
+                # saldi dopo la transazione: il risultato da restituire ai duplicati
+                tx["key"] = key
+                tx["after"] = {a: balances.get(a, 0) + c for a, c in legs}
+            line = json.dumps(tx, ensure_ascii=False, separators=(",", ":")) + "\n"
+            # prima su disco, poi i saldi in memoria
+            if self._file is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._file = self.path.open("a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._seq += 1
+            self._offset += len(line.encode("utf-8"))
+            _apply(balances, tx["legs"])
+            self._touch(tx)
+            if key is not None:
+                self._remember(tx)
+            for listener in self._listeners:
+                try:
+                    listener(tx)
+                except Exception:
+                    log.exception("Ledger: errore in un listener (transazione %s già registrata)", tx["seq"])
+            return tx
+
+    def _touch(self, tx: Dict[str, Any]) -> None:
+        for account, _ in tx["legs"]:
+            self._last_t[account] = tx["t"]
+
+    def _remember(self, tx: Dict[str, Any]) -> None:
+        self._keys[tx["key"]] = tx
+        self._keys.move_to_end(tx["key"])
+        while len(self._keys) > IDEMPOTENCY_MAX:
+            self._keys.popitem(last=False)
+
+    def transfer(
+        self,
+        src: str,
+        dst: str,
+        cents: int,
+        kind: str,
+        reason: str = "",
+        meta: Optional[Dict[str, Any]] = None,
+        key: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        if cents <= 0:
+            raise ValueError("Importo non valido")
+        return self.post([(src, -cents), (dst, cents)], kind, reason, meta, key)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def iter_file(path: Path, offset: int = 0) -> Iterator[Dict[str, Any]]:
+    """Transazioni di un file di ledger da `offset`, fermandosi alla prima riga incompleta."""
+    if not path.exists():
+        return
+    with path.open("rb") as f:
+        f.seek(offset)
+        for line in f:
+            try:
+                if not line.endswith(b"\n"):
+                    return
+                tx = json.loads(line)
+            except Exception:
+                return
+            yield tx
+
+def _merge_legs(legs: Iterable[Leg]) -> List[Leg]:
+    # stesso conto più volte -> una gamba sola; gambe a 0 eliminate; ordine stabile
+    out: Dict[str, int] = {}
+    for account, cents in legs:
+        if not isinstance(cents, int) or isinstance(cents, bool):
+            raise TypeError("Gli importi del ledger sono centesimi interi")
+        out[account] = out.get(account, 0) + cents
+    return [(a, c) for a, c in out.items() if c]
+
+def _apply(balances: Dict[str, int], legs: Iterable[Sequence[Any]]) -> None:
+    for account, cents in legs:
+        balances[account] = balances.get(account, 0) + cents
+
+
+# ---------- Istanza di processo ----------
+_ledger: Optional[Ledger] = None
+_ledger_lock = threading.Lock()
+
+def get_ledger() -> Ledger:
+    global _ledger
+    if _ledger is None:
+        with _ledger_lock:
+            if _ledger is None:
+                _ledger = Ledger()
+    return _ledger
+
+def close() -> None:
+    if _ledger is not None:
+        _ledger.close()
@@ -0,0 +1,323 @@
+# utils/ledger_verify.py
+"""
+Verifica dei saldi: ledger contro audit, a partire dall'ultimo snapshot.
+
+Ogni transazione del ledger su un conto utente ha i suoi record di audit (con meta.tx = seq).
+La verifica riparte dallo snapshot più recente (saldi a una certa seq + offset nel file) e, per
+ogni conto utente, confronta:
+- il saldo del ledger: snapshot + gambe delle transazioni successive
+- il saldo secondo l'audit: snapshot + effetti dei record con meta.tx successivo allo snapshot
+- (nel bot) il saldo in memoria del ledger
+Le differenze sono riportate conto per conto.
+
+Il lavoro è diviso per gilda su un pool di processi: ogni processo fa il parse solo delle righe
+della sua gilda (filtro per sottostringa sull'id prima di json.loads).
+
+Snapshot: data/ledger_snapshots/snap-<seq>.json, scritti ogni SNAPSHOT_EVERY transazioni (dal
+bot) e dopo ogni verifica senza differenze; se ne tengono KEEP_SNAPSHOTS.
+
+Da riga di comando (a bot fermo o acceso, è in sola lettura):
+    python -m utils.ledger_verify [--workers N] [--no-snapshot]
+"""
+from __future__ import annotations
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from utils import audit_log
+from utils.async_io import read_json_sync, write_json_sync
+from utils.ledger import LEDGER_FILE, get_ledger, is_system_account
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_DIR = Path("data/ledger_snapshots")
+SNAPSHOT_EVERY = 5_000
+KEEP_SNAPSHOTS = 4
+MAX_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+# effetto di un record di audit sui conti dell'utente: (conto, segno)
+OP_EFFECTS: Dict[str, Tuple[Tuple[str, int], ...]] = {
+    "DEPOSIT": (("wallet", -1), ("bank", 1)),
+    "WITHDRAW": (("wallet", -1), ("bank", 1)),       # cents negativi
+    "PAYROLL": (("bank", 1),),
+    "WALLET_DEPOSIT": (("wallet", 1),),
+    "WALLET_WITHDRAW": (("wallet", 1),),
+    "BANK_DEPOSIT": (("bank", 1),),
+    "BANK_WITHDRAW": (("bank", 1),),
+    "BANK_TRANSFER_IN": (("bank", 1),),
+    "BANK_TRANSFER_OUT": (("bank", 1),),
+}
+
+_GUILD_RE = re.compile(rb'"(?:wallet|bank|system):(\d+):')
+_SEQ_RE = re.compile(rb'^\{"seq":(\d+),')
+
+
+# ---------- Snapshot ----------
+def _snapshot_path(seq: int) -> Path:
+    return SNAPSHOT_DIR / f"snap-{seq:012d}.json"
+
+def list_snapshots() -> List[Path]:
+    return sorted(SNAPSHOT_DIR.glob("snap-*.json"))
+
+def write_snapshot(state: Dict[str, Any]) -> Path:
+    """Scrive uno snapshot ({"seq","t","offset","balances"}) e tiene solo gli ultimi KEEP_SNAPSHOTS."""
+    path = _snapshot_path(state["seq"])
+    write_json_sync(path, state)
+    for old in list_snapshots()[:-KEEP_SNAPSHOTS]:
+        try:
+            old.unlink()
+        except OSError:
+            pass
+    return path
+
+def load_snapshot(max_seq: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Snapshot più recente (con seq <= max_seq), o None."""
+    for path in reversed(list_snapshots()):
+        snap = read_json_sync(path, None)
+        if not isinstance(snap, dict) or "balances" not in snap:
+            log.warning("Snapshot illeggibile ignorato: %s", path)
+            continue
+        if max_seq is None or snap["seq"] <= max_seq:
+            return snap
+    return None
+
+_auto_enabled = False
+_auto_lock = threading.Lock()
+
+def enable_auto_snapshots() -> None:
+    """Dal bot: uno snapshot ogni SNAPSHOT_EVERY transazioni (scritto fuori dal lock del ledger)."""
+    global _auto_enabled
+    with _auto_lock:
+        if _auto_enabled:
+            return
+        ledger = get_ledger()
+
+        def on_tx(tx: Dict[str, Any]) -> None:
+            if tx["seq"] % SNAPSHOT_EVERY:
+                return
+            state = ledger.checkpoint()  # siamo sotto il lock del ledger: stato coerente
+            threading.Thread(target=write_snapshot, args=(state,), name="ledger-snapshot", daemon=True).start()
+
+        ledger.subscribe(on_tx)
+        _auto_enabled = True
+
+
+# ---------- Replay per gilda (gira nei processi del pool) ----------
+def _guild_of(account: str) -> Optional[int]:
+    try:
+        return int(account.split(":", 2)[1])
+    except (IndexError, ValueError):
+        return None
+
+def _verify_guild(
+    guild_id: int,
+    base: Dict[str, int],
+    ledger_path: str,
+    offset: int,
+    from_seq: int,
+    upto_seq: int,
+    audit_files: List[str],
+) -> Dict[str, Any]:
+    ledger_bal = dict(base)
+    audit_bal = {a: c for a, c in base.items() if not is_system_account(a)}
+    tx_count = rec_count = 0
+
+    # ledger: solo le righe che toccano conti di questa gilda
+    needles = tuple(f'"{k}:{guild_id}:'.encode() for k in ("wallet", "bank", "system"))
+    with open(ledger_path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            if not any(n in line for n in needles):
+                continue
+            tx = json.loads(line)
+            if tx["seq"] <= from_seq:
+                continue
+            if tx["seq"] > upto_seq:
+                break
+            tx_count += 1
+            for account, cents in tx["legs"]:
+                if _guild_of(account) == guild_id:
+                    ledger_bal[account] = ledger_bal.get(account, 0) + cents
+
+    # audit: solo i record della gilda legati a una transazione dopo lo snapshot. Il filtro per
+    # sottostringa (l'id della gilda) non dipende dal formato della riga; decide il campo parsato
+    needle = str(guild_id).encode()
+    for path in audit_files:
+        with open(path, "rb") as f:
+            for line in f:
+                if needle not in line or not line.endswith(b"\n"):
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if str(rec.get("guild_id")) != str(guild_id):
+                    continue
+                seq = (rec.get("meta") or {}).get("tx")
+                if not isinstance(seq, int) or not from_seq < seq <= upto_seq:
+                    continue  # storia precedente al ledger/snapshot o transazione non ancora letta
+                rec_count += 1
+                for account, cents in _audit_effects(rec):
+                    audit_bal[account] = audit_bal.get(account, 0) + cents
+
+    diffs = []
+    users = {a for a in ledger_bal if not is_system_account(a)} | set(audit_bal)
+    for account in sorted(users):
+        lv, av = ledger_bal.get(account, 0), audit_bal.get(account, 0)
+        if lv != av:
+            diffs.append({"account": account, "ledger": lv, "audit": av})
+    return {
+        "guild_id": guild_id,
+        "accounts": len(users),
+        "transactions": tx_count,
+        "audit_records": rec_count,
+        "balances": ledger_bal,
+        "discrepancies": diffs,
+    }
+
+def _audit_effects(rec: Dict[str, Any]) -> Iterable[Tuple[str, int]]:
+    g, u = rec.get("guild_id"), rec.get("user_id")
+    cents = rec.get("cents")
+    if cents is None:
+        cents = round((rec.get("amount") or 0) * 100)
+    kind = (rec.get("meta") or {}).get("account")
+    effects = ((kind, 1),) if kind in ("wallet", "bank") else OP_EFFECTS.get(rec.get("op"), ())
+    return [(f"{k}:{g}:{u}", sign * cents) for k, sign in effects]
+
+
+# ---------- Verifica ----------
+def _scan_ledger(path: Path, offset: int, seq: int) -> Tuple[set, int, int]:
+    """Gilde toccate dopo `offset`, ultima seq e offset finale (regex, senza json.loads per riga)."""
+    guilds = set()
+    end = offset
+    if path.exists():
+        with path.open("rb") as f:
+            f.seek(offset)
+            for line in f:
+                m = _SEQ_RE.match(line)
+                if not line.endswith(b"\n") or not m:
+                    break
+                seq = int(m.group(1))
+                guilds.update(int(g) for g in _GUILD_RE.findall(line))
+                end += len(line)
+    return guilds, seq, end
+
+def verify(
+    workers: int = MAX_WORKERS,
+    snapshot: bool = True,
+    live: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Verifica bloccante (pool I/O o CLI). `live` è un ledger.checkpoint() del bot: si verifica fino
+    alla sua seq e si confrontano anche i saldi in memoria.
+    """
+    t0 = time.perf_counter()
+    snap = load_snapshot(live["seq"] if live else None)
+    from_seq = snap["seq"] if snap else 0
+    offset = snap["offset"] if snap else 0
+    guilds, last_seq, end = _scan_ledger(LEDGER_FILE, offset, from_seq)
+    upto_seq = live["seq"] if live else last_seq
+    if live:
+        end = live["offset"]
+
+    base: Dict[int, Dict[str, int]] = {}
+    for account, cents in ((snap or {}).get("balances") or {}).items():
+        g = _guild_of(account)
+        if g is not None:
+            base.setdefault(g, {})[account] = cents
+    guilds |= set(base)
+    if live:
+        guilds |= {g for g in map(_guild_of, live["balances"]) if g is not None}
+
+    # un giorno di margine: i record di audit seguono di poco la loro transazione
+    since = audit_log.segment_id(snap["t"] - 86400) if snap else ""
+    audit_files = [str(p.resolve()) for p in audit_log.AuditLog().segment_files(since)]
+
+    jobs = [(g, base.get(g, {}), str(LEDGER_FILE.resolve()), offset, from_seq, upto_seq, audit_files) for g in sorted(guilds)]
+    if len(jobs) > 1 and workers > 1:
+        ctx = multiprocessing.get_context("spawn")  # niente fork di un processo con thread attivi
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs)), mp_context=ctx) as pool:
+            results = list(pool.map(_verify_guild, *zip(*jobs)))
+    else:
+        results = [_verify_guild(*job) for job in jobs]
+
+    discrepancies = [dict(d, guild_id=r["guild_id"], source="audit") for r in results for d in r["discrepancies"]]
+    replayed: Dict[str, int] = {}
+    for r in results:
+        replayed.update(r["balances"])
+    if live:
+        mem = live["balances"]
+        for account in sorted(set(mem) | set(replayed)):
+            if mem.get(account, 0) != replayed.get(account, 0):
+                discrepancies.append({
+                    "account": account, "ledger": replayed.get(account, 0), "memory": mem.get(account, 0),
+                    "guild_id": _guild_of(account), "source": "memory",
+                })
+
+    written = None
+    if snapshot and not discrepancies and upto_seq > from_seq:
+        written = str(write_snapshot({"seq": upto_seq, "t": time.time(), "offset": end, "balances": replayed}))
+
+    return {
+        "from_seq": from_seq,
+        "upto_seq": upto_seq,
+        "guilds": len(results),
+        "accounts": sum(r["accounts"] for r in results),
+        "transactions": sum(r["transactions"] for r in results),
+        "audit_records": sum(r["audit_records"] for r in results),
+        "discrepancies": discrepancies,
+        "snapshot_written": written,
+        "elapsed_s": round(time.perf_counter() - t0, 3),
+    }
+
+def verify_live(workers: int = MAX_WORKERS) -> Dict[str, Any]:
+    """
+    Dal bot (nel pool I/O): fino allo stato attuale del ledger, con l'audit accodato già su disco.
+    I record di audit si accodano DOPO il post della transazione: uno di una transazione entro il
+    checkpoint può arrivare dopo il flush. Le differenze con l'audit si ricontrollano quindi una
+    volta, dopo un secondo flush, prima di riportarle.
+    """
+    live = get_ledger().checkpoint()
+    audit_log.flush()
+    report = verify(workers, live=live)
+    if any(d["source"] == "audit" for d in report["discrepancies"]):
+        audit_log.flush()
+        report = verify(workers, live=live)
+    return report
+
+
+# ---------- CLI ----------
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Verifica ledger e audit dell'economia.")
+    ap.add_argument("--workers", type=int, default=MAX_WORKERS)
+    ap.add_argument("--no-snapshot", action="store_true", help="non scrivere un nuovo snapshot")
+    args = ap.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s | %(levelname)s | %(message)s")
+
+    report = verify(args.workers, snapshot=not args.no_snapshot)
+    print(
+        f"Transazioni {report['from_seq']} -> {report['upto_seq']} • {report['guilds']} gilde • "
+        f"{report['accounts']} conti • {report['audit_records']} record audit • {report['elapsed_s']}s"
+    )
+    for d in report["discrepancies"]:
+        print(f"❌ {d['account']}: ledger {d['ledger']} ≠ {d['source']} {d.get('audit', d.get('memory'))}")
+    if not report["discrepancies"]:
+        print("✅ Nessuna differenza")
+    if report["snapshot_written"]:
+        print(f"📸 Snapshot: {report['snapshot_written']}")
+    return 1 if report["discrepancies"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+# utils/outbound.py
+"""
+Coda dei messaggi in uscita verso i canali di log.
+
+- una coda per canale, svuotata da un solo worker: su un canale c'è al più un invio in corso
+  (lo stesso bucket di rate limit di Discord), e i canali non si bloccano tra loro
+- priorità: i follow-up delle interaction (followup()) passano davanti ai log; mentre un
+  follow-up è in corso in un canale, i log (e le cancellazioni) di QUEL canale aspettano;
+  gli altri canali proseguono
+- le righe di log consecutive per lo stesso canale vengono unite in UN messaggio (fino a
+  MAX_MESSAGE_LEN caratteri): una raffica di /deposita diventa pochi invii, non uno per riga
+- cancellazioni ritardate (delete_after) gestite da UN solo task con uno heap di scadenze, al
+  posto di un task con sleep per ogni messaggio
+- stats(): profondità delle code, latenza (accodamento -> invio completato), invii, unioni, errori
+"""
+from __future__ import annotations
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import discord
+
+log = logging.getLogger(__name__)
+
+# priorità (minore = prima)
+URGENT = 0
+NORMAL = 1
+LOG = 2
+
+MAX_MESSAGE_LEN = 2000
+MAX_QUEUE = 500          # oltre, per quel canale si scartano i log più vecchi
+LOG_LINGER = 0.5         # secondi di attesa prima di inviare un log, per raccogliere le righe successive
+IDLE_EXIT = 60.0         # il worker di un canale termina dopo tanto tempo senza messaggi
+LATENCY_SAMPLES = 500
+
+
+class _Item:
+    __slots__ = ("content", "kwargs", "priority", "coalesce", "delete_after", "future", "t")
+
+    def __init__(self, content: Optional[str], kwargs: Dict[str, Any], priority: int, coalesce: bool, delete_after: Optional[float]):
+        self.content = content
+        self.kwargs = kwargs
+        self.priority = min(max(priority, URGENT), LOG)
+        self.coalesce = coalesce and not kwargs and bool(content)
+        self.delete_after = delete_after
+        self.future: Optional[asyncio.Future] = None
+        self.t = time.perf_counter()
+
+
+class _Channel:
+    def __init__(self, channel: discord.abc.Messageable):
+        self.channel = channel
+        self.queues: Tuple[Deque[_Item], ...] = (deque(), deque(), deque())  # una per priorità
+        self.wake = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def depth(self) -> int:
+        return sum(len(q) for q in self.queues)
+
+    def pop(self) -> Optional[_Item]:
+        for q in self.queues:
+            if q:
+                return q.popleft()
+        return None
+
+
+class Dispatcher:
+    """Da creare (e usare) dentro un event loop: code, eventi e task appartengono a quel loop."""
+
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self._channels: Dict[int, _Channel] = {}
+        # follow-up in corso per canale; l'evento si setta (e sparisce) quando l'ultimo finisce
+        self._urgent: Dict[int, int] = {}
+        self._urgent_done: Dict[int, asyncio.Event] = {}
+        self._deletes: List[Tuple[float, int, discord.Message]] = []
+        self._delete_seq = itertools.count()
+        self._delete_wake = asyncio.Event()
+        self._delete_task: Optional[asyncio.Task] = None
+        self._latency: Deque[float] = deque(maxlen=LATENCY_SAMPLES)           # accodamento -> inviato
+        self._followup_latency: Deque[float] = deque(maxlen=LATENCY_SAMPLES)  # durata dei follow-up
+        self._stats = {"sent": 0, "lines": 0, "coalesced": 0, "dropped": 0, "errors": 0, "deleted": 0}
+
+    # --- invii ---
+    def post(
+        self,
+        channel: discord.abc.Messageable,
+        content: Optional[str] = None,
+        *,
+        priority: int = LOG,
+        coalesce: bool = True,
+        delete_after: Optional[float] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Accoda un messaggio senza attenderlo (i log). kwargs come per channel.send (embed, ...)."""
+        self._enqueue(channel, _Item(content, kwargs, priority, coalesce, delete_after))
+
+    async def send(
+        self,
+        channel: discord.abc.Messageable,
+        content: Optional[str] = None,
+        *,
+        priority: int = NORMAL,
+        delete_after: Optional[float] = None,
+        **kwargs: Any,
+    ) -> discord.Message:
+        """Accoda e attende l'invio; ritorna il messaggio (mai unito ad altri)."""
+        item = _Item(content, kwargs, priority, False, delete_after)
+        item.future = asyncio.get_running_loop().create_future()
+        self._enqueue(channel, item)
+        return await item.future
+
+    async def followup(self, itx: discord.Interaction, content: Optional[str] = None, **kwargs: Any) -> Any:
+        """itx.followup.send con precedenza: i log dello stesso canale aspettano che finisca."""
+        cid = itx.channel_id or 0
+        self._urgent[cid] = self._urgent.get(cid, 0) + 1
+        if cid not in self._urgent_done:
+            self._urgent_done[cid] = asyncio.Event()
+        t0 = time.perf_counter()
+        try:
+            return await itx.followup.send(content, **kwargs)
+        finally:
+            self._followup_latency.append((time.perf_counter() - t0) * 1000)
+            self._urgent[cid] -= 1
+            if not self._urgent[cid]:
+                del self._urgent[cid]
+                self._urgent_done.pop(cid).set()
+
+    async def _urgent_wait(self, channel_id: int) -> None:
+        """Attende la fine dei follow-up in corso nel canale (nessuna attesa se non ce ne sono)."""
+        done = self._urgent_done.get(channel_id)
+        if done is not None:
+            await done.wait()
+
+    def _enqueue(self, channel: discord.abc.Messageable, item: _Item) -> None:
+        ch = self._channels.get(channel.id)
+        if ch is None:
+            ch = self._channels[channel.id] = _Channel(channel)
+        ch.channel = channel
+        ch.queues[item.priority].append(item)
+        if ch.depth() > MAX_QUEUE and ch.queues[LOG]:
+            dropped = ch.queues[LOG].popleft()
+            self._stats["dropped"] += 1
+            if dropped.future and not dropped.future.done():
+                dropped.future.set_exception(RuntimeError("coda piena"))
+        ch.wake.set()
+        if ch.task is None or ch.task.done():
+            ch.task = asyncio.get_running_loop().create_task(self._worker(ch), name=f"outbound:{channel.id}")
+
+    def _take_batch(self, ch: _Channel, first: _Item) -> Tuple[str, List[_Item]]:
+        """Unisce a `first` le righe di log successive compatibili, entro MAX_MESSAGE_LEN."""
+        batch, text = [first], first.content or ""
+        q = ch.queues[first.priority]
+        while q and q[0].coalesce and q[0].delete_after == first.delete_after:
+            nxt = q[0].content or ""
+            if len(text) + 1 + len(nxt) > MAX_MESSAGE_LEN:
+                break
+            text = f"{text}\n{nxt}"
+            batch.append(q.popleft())
+        return text, batch
+
+    async def _worker(self, ch: _Channel) -> None:
+        while True:
+            item = ch.pop()
+            if item is None:
+                ch.wake.clear()
+                try:
+                    await asyncio.wait_for(ch.wake.wait(), timeout=IDLE_EXIT)
+                except asyncio.TimeoutError:
+                    if not ch.depth():
+                        self._channels.pop(ch.channel.id, None)
+                        return
+                continue
+            if item.priority >= LOG:
+                if item.coalesce and LOG_LINGER and not ch.queues[item.priority]:
+                    await asyncio.sleep(LOG_LINGER)  # raccoglie il resto della raffica
+                await self._urgent_wait(ch.channel.id)
+                if ch.queues[URGENT] or ch.queues[NORMAL]:
+                    ch.queues[item.priority].appendleft(item)  # nel frattempo è arrivato qualcosa di più urgente
+                    continue
+            if item.coalesce:
+                text, batch = self._take_batch(ch, item)
+            else:
+                text, batch = item.content, [item]
+            try:
+                msg = await ch.channel.send(text, **item.kwargs)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                log.warning("Invio su %s fallito (%s righe): %s", ch.channel.id, len(batch), e)
+                for it in batch:
+                    if it.future and not it.future.done():
+                        it.future.set_exception(e)
+                continue
+            now = time.perf_counter()
+            self._stats["sent"] += 1
+            self._stats["lines"] += len(batch)
+            self._stats["coalesced"] += len(batch) - 1
+            for it in batch:
+                self._latency.append((now - it.t) * 1000)
+                if it.future and not it.future.done():
+                    it.future.set_result(msg)
+            if item.delete_after is not None:
+                self.delete_later(msg, item.delete_after)
+
+    # --- cancellazioni ritardate ---
+    def delete_later(self, message: discord.Message, delay: float) -> None:
+        heapq.heappush(self._deletes, (time.monotonic() + max(5.0, delay), next(self._delete_seq), message))
+        self._delete_wake.set()
+        if self._delete_task is None or self._delete_task.done():
+            self._delete_task = asyncio.get_running_loop().create_task(self._delete_loop(), name="outbound:delete")
+
+    async def _delete_loop(self) -> None:
+        while self._deletes:
+            self._delete_wake.clear()
+            wait = self._deletes[0][0] - time.monotonic()
+            if wait > 0:
+                try:
+                    await asyncio.wait_for(self._delete_wake.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, message = heapq.heappop(self._deletes)
+            await self._urgent_wait(message.channel.id)
+            try:
+                await message.delete()
+                self._stats["deleted"] += 1
+            except (discord.NotFound, discord.Forbidden):
+                pass
+            except Exception as e:
+                self._stats["errors"] += 1
+                log.warning("Cancellazione del messaggio %s fallita: %s", message.id, e)
+
+    # --- metriche ---
+    def stats(self) -> Dict[str, Any]:
+        depths = [ch.depth() for ch in self._channels.values()]
+        lat = sorted(self._latency)
+        fu = self._followup_latency
+        return {
+            "channels": len(depths),
+            "queued": sum(depths),
+            "queued_max": max(depths, default=0),
+            **self._stats,
+            "pending_deletes": len(self._deletes),
+            "urgent_in_flight": sum(self._urgent.values()),
+            "latency_ms_avg": round(sum(lat) / len(lat), 1) if lat else 0.0,
+            "latency_ms_p95": round(lat[int(len(lat) * 0.95)], 1) if lat else 0.0,
+            "latency_ms_max": round(lat[-1], 1) if lat else 0.0,
+            "followup_ms_avg": round(sum(fu) / len(fu), 1) if fu else 0.0,
+        }
+
+
+# ---------- Istanza di processo ----------
+_dispatcher: Optional[Dispatcher] = None
+
+def get_dispatcher() -> Dispatcher:
+    """Dispatcher del loop corrente: dopo un riavvio del runner (main.py, nuovo asyncio.run) se ne crea uno nuovo."""
+    global _dispatcher
+    if _dispatcher is None or _dispatcher.loop is not asyncio.get_running_loop():
+        _dispatcher = Dispatcher()
+    return _dispatcher
+
+def post_log(channel: discord.abc.Messageable, content: str, delete_after: Optional[float] = None) -> None:
+    get_dispatcher().post(channel, content, delete_after=delete_after)
+
+async def followup(itx: discord.Interaction, content: Optional[str] = None, **kwargs: Any) -> Any:
+    return await get_dispatcher().followup(itx, content, **kwargs)
+
+def delete_later(message: discord.Message, delay: float) -> None:
+    get_dispatcher().delete_later(message, delay)
+
+def stats() -> Dict[str, Any]:
+    return _dispatcher.stats() if _dispatcher else {}
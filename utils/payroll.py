@@ -0,0 +1,278 @@
+# utils/payroll.py
+"""
+Motore stipendi.
+
+- SalaryIndex: tabella {role_id: centesimi} compilata UNA volta al caricamento della config
+  (utils/economy_config), immutabile e condivisa
+- plan_guild(): una passata sui membri; per ognuno si guardano solo i SUOI ruoli (lookup nel
+  dict), quindi il costo è O(ruoli posseduti), non O(ruoli × tabella stipendi)
+- il piano è solo calcolo; l'anteprima (/payroll_preview) usa lo stesso indice e la stessa
+  iter_payees dell'esecuzione, quindi mostra esattamente ciò che verrebbe pagato
+- arun_payroll(): l'esecuzione vera, a blocchi e con checkpoint (vedi sotto)
+"""
+from __future__ import annotations
+import asyncio
+import bisect
+import csv
+import logging
+import time
+from pathlib import Path
+from types import MappingProxyType
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Mapping, NamedTuple, Optional, Sequence, Tuple
+
+from utils import accounts, audit_log
+from utils.async_io import read_json_sync, run_io, write_json_sync
+from utils.ledger import get_ledger
+
+log = logging.getLogger(__name__)
+
+
+class SalaryIndex:
+    """Stipendio per ruolo in centesimi; a parità di membro vince il ruolo più pagato."""
+    __slots__ = ("_by_role", "_labels")
+
+    def __init__(self, by_role: Mapping[int, int], labels: Optional[Mapping[int, str]] = None):
+        self._by_role = MappingProxyType({rid: c for rid, c in by_role.items() if c > 0})
+        self._labels = MappingProxyType(dict(labels or {}))
+
+    def __len__(self) -> int:
+        return len(self._by_role)
+
+    def __contains__(self, role_id: object) -> bool:
+        return role_id in self._by_role
+
+    def get(self, role_id: int) -> int:
+        return self._by_role.get(role_id, 0)
+
+    def items(self):
+        return self._by_role.items()
+
+    def label(self, role_id: int) -> Optional[str]:
+        """Etichetta del ruolo scritta nella config (utile se il ruolo non esiste più su Discord)."""
+        return self._labels.get(role_id)
+
+    def pick(self, role_ids: Iterable[int]) -> Tuple[int, Optional[int]]:
+        """(centesimi, role_id) del ruolo più pagato tra quelli posseduti; (0, None) se nessuno."""
+        best, best_role = 0, None
+        table = self._by_role
+        for rid in role_ids:
+            c = table.get(rid)
+            if c is not None and c > best:
+                best, best_role = c, rid
+        return best, best_role
+
+
+class PayrollEntry(NamedTuple):
+    user_id: int
+    role_id: int
+    cents: int
+
+
+class PayrollPlan(NamedTuple):
+    guild_id: int
+    entries: Tuple[PayrollEntry, ...]
+    scanned: int          # membri (non bot) esaminati
+    total: int            # centesimi
+    elapsed_ms: float
+
+    def credits(self) -> dict:
+        """{user_id: centesimi}, per accounts.credit_bank_many."""
+        return {e.user_id: e.cents for e in self.entries}
+
+    def by_role(self) -> Dict[int, Tuple[int, int]]:
+        """{role_id: (membri pagati, centesimi)}, dal ruolo che costa di più."""
+        out: Dict[int, Tuple[int, int]] = {}
+        for e in self.entries:
+            n, c = out.get(e.role_id, (0, 0))
+            out[e.role_id] = (n + 1, c + e.cents)
+        return dict(sorted(out.items(), key=lambda kv: -kv[1][1]))
+
+
+def iter_payees(members: Iterable[Any], index: SalaryIndex) -> Iterator[Tuple[Any, Optional[PayrollEntry]]]:
+    """(membro, voce o None) per ogni membro non bot: la stessa logica per esecuzione e anteprima."""
+    for m in members:
+        if m.bot:
+            continue
+        cents, rid = index.pick(r.id for r in m.roles)
+        yield m, (PayrollEntry(m.id, rid, cents) if rid is not None else None)
+
+def plan_guild(guild: Any, index: SalaryIndex) -> PayrollPlan:
+    t0 = time.perf_counter()
+    entries = []
+    scanned = 0
+    for _, entry in iter_payees(guild.members, index):
+        scanned += 1
+        if entry is not None:
+            entries.append(entry)
+    return PayrollPlan(
+        guild.id, tuple(entries), scanned, sum(e.cents for e in entries),
+        (time.perf_counter() - t0) * 1000,
+    )
+
+
+CSV_HEADER = ("guild_id", "user_id", "membro", "role_id", "ruolo", "importo")
+
+def write_csv(
+    plans: Sequence[PayrollPlan],
+    fh: IO[str],
+    member_name: Callable[[int, int], str],
+    role_name: Callable[[int, int], str],
+) -> int:
+    """Scrive il piano riga per riga (guild_id, user_id, nome, ruolo, importo). Ritorna le righe scritte."""
+    w = csv.writer(fh)
+    w.writerow(CSV_HEADER)
+    n = 0
+    for plan in plans:
+        for e in plan.entries:
+            w.writerow((
+                plan.guild_id, e.user_id, member_name(plan.guild_id, e.user_id),
+                e.role_id, role_name(plan.guild_id, e.role_id), f"{e.cents / 100:.2f}",
+            ))
+            n += 1
+    return n
+
+
+# ---------- Esecuzione a blocchi con checkpoint ----------
+# Su una gilda grande il payroll non deve tenere occupato l'event loop: i membri (ordinati per id)
+# vengono pagati a blocchi di CHUNK_SIZE, una transazione del ledger per blocco, cedendo il loop
+# tra un blocco e l'altro. Dopo ogni blocco il checkpoint (ciclo + ultimo membro pagato) va su
+# disco: dopo un crash si riparte dal membro successivo.
+# Prima di registrare un blocco si salva un marcatore "pending" (chiave del blocco + offset del
+# ledger): se il processo muore tra il post e il checkpoint, alla ripresa si cerca quella chiave
+# nel ledger da quell'offset, senza scadenza (l'indice di idempotenza in memoria dura solo
+# IDEMPOTENCY_TTL, mentre un recupero può arrivare dopo giorni).
+
+PROGRESS_FILE = Path("data/payroll_progress.json")
+CHUNK_SIZE = 500
+KEEP_FINISHED = 50   # esecuzioni concluse tenute nel file (per /payroll_status)
+
+_progress: Optional[Dict[str, Dict[str, Any]]] = None
+_locks: Dict[str, asyncio.Lock] = {}
+_locks_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _lock(name: str) -> asyncio.Lock:
+    # lock del loop corrente: dopo un riavvio del runner (nuovo asyncio.run) si ricreano
+    global _locks_loop
+    loop = asyncio.get_running_loop()
+    if _locks_loop is not loop:
+        _locks.clear()
+        _locks_loop = loop
+    lock = _locks.get(name)
+    if lock is None:
+        lock = _locks[name] = asyncio.Lock()
+    return lock
+
+async def load_progress() -> Dict[str, Dict[str, Any]]:
+    global _progress
+    if _progress is None:
+        state = await run_io(read_json_sync, PROGRESS_FILE, {}) or {}
+        # prima lettura del processo: nessuna esecuzione è davvero in corso, quelle segnate
+        # "running" sono morte con il processo precedente (/payroll_status le mostra interrotte)
+        for p in state.values():
+            p["running"] = False
+        _progress = state
+    return _progress
+
+async def _save_progress() -> None:
+    async with _lock(""):
+        state = await load_progress()
+        finished = sorted((k for k, p in state.items() if p.get("done")), key=lambda k: state[k].get("updated", 0))
+        for k in finished[:-KEEP_FINISHED]:
+            del state[k]
+        await run_io(write_json_sync, PROGRESS_FILE, state)
+
+def progress() -> List[Dict[str, Any]]:
+    """Esecuzioni note (in corso per prime, poi le più recenti), per /payroll_status."""
+    runs = [dict(p, key=k) for k, p in (_progress or {}).items()]
+    return sorted(runs, key=lambda p: (p.get("done", False), -p.get("updated", 0)))
+
+async def arun_payroll(
+    guild: Any,
+    index: SalaryIndex,
+    key: str,
+    reason: str = "Stipendio mensile",
+    chunk_size: int = CHUNK_SIZE,
+) -> Dict[str, Any]:
+    """
+    Paga la gilda per il ciclo `key` (es. "payroll:<gilda>:2026-10"), riprendendo da un checkpoint
+    se c'è. Ritorna lo stato finale (paid, scanned, total, chunks, resumed, already...).
+    Due chiamate con la stessa `key` (scheduler e /payroll_now) non girano mai insieme.
+    """
+    async with _lock(key):
+        return await _run_locked(guild, index, key, reason, chunk_size)
+
+async def _run_locked(guild: Any, index: SalaryIndex, key: str, reason: str, chunk_size: int) -> Dict[str, Any]:
+    state = await load_progress()
+    p = state.get(key)
+    if p and p.get("done"):
+        return dict(p, already=True)
+    if p is None:
+        p = state[key] = {
+            "guild_id": guild.id, "last_member": 0, "scanned": 0, "paid": 0, "total": 0,
+            "chunks": 0, "started": time.time(), "updated": time.time(), "done": False,
+        }
+        resumed = False
+    else:
+        resumed = True
+        log.info("Payroll %s: ripresa dal membro %s (%s già pagati)", key, p["last_member"], p["paid"])
+    p["running"] = True
+
+    ledger = get_ledger()
+    t0 = time.perf_counter()
+    try:
+        members = sorted((m for m in guild.members if not m.bot), key=lambda m: m.id)
+        ids = [m.id for m in members]
+        p["members"] = len(members)
+        i = bisect.bisect_right(ids, p["last_member"])
+        while i < len(members):
+            chunk = members[i:i + chunk_size]
+            last = chunk[-1].id
+            entries = [e for _, e in iter_payees(chunk, index) if e is not None]
+            paid, total = len(entries), sum(e.cents for e in entries)
+            chunk_key = f"{key}:{p['last_member']}"
+            tx = None
+            pending = p.get("pending")
+            if pending and pending.get("key") == chunk_key:
+                # il processo è morto tra il post e il checkpoint: il ledger sa se il blocco c'è
+                tx = await run_io(ledger.find, chunk_key, pending.get("offset", 0))
+                if tx is not None:
+                    log.warning("Payroll %s: blocco %s già registrato (tx %s), non viene ripagato", key, chunk_key, tx["seq"])
+            if tx is not None:
+                # vale ciò che è nel ledger, non il ricalcolo (i membri possono essere cambiati)
+                last = (tx.get("meta") or {}).get("last", last)
+                legs = [c for _, c in tx["legs"] if c > 0]
+                paid, total = len(legs), sum(legs)
+            elif entries:
+                p["pending"] = {"key": chunk_key, "offset": await run_io(lambda: ledger.offset)}
+                await _save_progress()
+                tx = await accounts.acredit_bank_many(
+                    guild.id, {e.user_id: e.cents for e in entries}, "PAYROLL", reason,
+                    meta={"cycle": key, "last": last}, key=chunk_key,
+                )
+                if tx.get("replayed"):
+                    last = (tx.get("meta") or {}).get("last", last)
+                    legs = [c for _, c in tx["legs"] if c > 0]
+                    paid, total = len(legs), sum(legs)
+                else:
+                    await audit_log.arecord_many(
+                        audit_log.make_record(guild.id, e.user_id, e.cents, "PAYROLL", reason, {"tx": tx["seq"], "role": e.role_id})
+                        for e in entries
+                    )
+            nxt = bisect.bisect_right(ids, last)
+            p["scanned"] += nxt - i
+            p["paid"] += paid
+            p["total"] += total
+            p["chunks"] += 1
+            p["last_member"] = last
+            p["updated"] = time.time()
+            p.pop("pending", None)
+            await _save_progress()
+            i = nxt
+            await asyncio.sleep(0)  # cede il loop: heartbeat e interazioni non aspettano il payroll
+        p["done"] = True
+        p["updated"] = time.time()
+    finally:
+        p["running"] = False
+        p["elapsed_ms"] = p.get("elapsed_ms", 0.0) + (time.perf_counter() - t0) * 1000
+        await _save_progress()
+    return dict(p, resumed=resumed)
@@ -1,23 +1,38 @@
 # utils/profili.py
 from __future__ import annotations
-import json
+import asyncio
+import atexit
+import copy
+import inspect
+import logging
+import time
 from pathlib import Path
-from typing import Any, Dict
+import os
+import threading
+import weakref
+from types import MappingProxyType
+from typing import Any, Awaitable, Callable, Dict, Iterable, Mapping, Optional, Sequence, Set, Union
 
-DB_FILE = Path("data/profili.json")
+from utils.async_io import run_io
+from utils.iban import issue_ibans, normalize_iban, validate_iban
+from utils.profili_index import ProfileIndex, index_keys_touched
+from utils.profili_schema import migrate, normalize_patch
+from utils.profili_store import JournalProfileStore, SqliteProfileStore, set_path, split_path
+
+DB_FILE = Path("data/profili.json")            # snapshot del backend "journal"
+JOURNAL_FILE = Path("data/profili.journal.jsonl")
+PROFILE_DATA_FILE = Path("data/profile_data.json")  # legacy, importato dalla migrazione
+SQLITE_FILE = Path("data/profili.db")
 DB_FILE.parent.mkdir(parents=True, exist_ok=True)
 
-# ---------- Helpers I/O ----------
-def _load_db() -> Dict[str, Any]:
-    if DB_FILE.exists():
-        try:
-            return json.loads(DB_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            pass
-    return {"profiles": {}}
+# "sqlite" (default, una riga per utente) oppure "journal" (profili.json + journal write-ahead;
+# "json" è accettato come alias)
+BACKEND = os.getenv("PROFILI_BACKEND", "sqlite").lower()
+
+# finestra di coalescenza: le scritture arrivate entro questo intervallo finiscono in un solo flush
+FLUSH_DELAY_SECONDS = 2.0
 
-def _save_db(db: Dict[str, Any]) -> None:
-    DB_FILE.write_text(json.dumps(db, ensure_ascii=False, indent=2), encoding="utf-8")
+log = logging.getLogger(__name__)
 
 # ---------- Merge profilo ----------
 def _deep_merge(base: Any, new: Any) -> Any:
@@ -35,85 +50,757 @@ def _deep_merge(base: Any, new: Any) -> Any:
     # se il campo non esiste, restituisci 'new' direttamente
     return new if new is not None else base
 
-# ---------- API principali ----------
-def get_profile(user_id: int) -> Dict[str, Any]:
-    """Ritorna il profilo utente con default sensati."""
-    db = _load_db()
-    ukey = str(user_id)
-    prof = (db.get("profiles") or {}).get(ukey) or {}
-
-    # default consigliati (usati nei tuoi embed)
-    defaults = {
-        "wallet": 0.0,
-        "bank": {
-            "iban": "",
-            "saldo": 0.0,
-        },
-        "nome_rp": "",
-        "cognome_rp": "",
-        "data_nascita": "",
-        "stato_civile": "",
-        "famiglia": "",
-        "cittadinanza": "",
-        "identity_card": "",
-        "docs": {
-            "cittadinanza": {
-                "stato": False,
-                "numero": "",
-                "rilasciata_il": "",
-                "rilasciata_da": "",
-                "note": ""
-            },
-            "patenti": {
-                "A": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""},
-                "B": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""},
-                "C": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""},
-                "NAUTICA": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""}
-            },
-            # ✅ porto d’armi va qui, non dentro "patenti"
-            "porto_armi": {
-                "stato": False,
-                "numero": "",
-                "rilasciata_il": "",
-                "scadenza": "",
-                "rilasciata_da": "",
-                "tipo": "",
-                "note": ""
-            }
+# ---------- Cache in memoria ----------
+class _ProfileCache:
+    """
+    Cache di processo dei profili (write-through):
+    - ogni profilo viene letto dallo store UNA volta, poi le letture sono servite dalla memoria
+    - le scritture aggiornano subito la memoria e segnano l'utente come "dirty"
+    - il salvataggio è coalescente: un solo flush ogni FLUSH_DELAY_SECONDS
+      (più quello finale allo shutdown), che scrive solo i profili cambiati
+    - le varianti a* (aget, aload, aflush) fanno l'I/O nel pool di utils.async_io:
+      l'event loop tocca solo la memoria
+    """
+    def __init__(self) -> None:
+        self._store = None
+        self._store_lock = threading.Lock()
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self.rows: Dict[str, Optional[Dict[str, Any]]] = {}
+        self.dirty: Set[str] = set()
+        # revisione per utente: cresce a ogni scrittura (per compare-and-set)
+        self.revs: Dict[str, int] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_task: Optional[asyncio.Task] = None
+        # indici secondari (iban, documenti, targhe, ...): costruiti alla prima ricerca,
+        # poi aggiornati a ogni scrittura che passa dalla cache
+        self.index: Optional[ProfileIndex] = None
+        self._index_task: Optional[asyncio.Task] = None
+        # contatori
+        self.hits = 0
+        self.misses = 0
+        self.projected = 0
+        self.writes = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_ms_total = 0.0
+        self.flush_ms_last = 0.0
+        self.flush_ms_max = 0.0
+
+    @property
+    def store(self):
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = _open_store()
+        return self._store
+
+    # --- letture async: l'accesso allo store avviene nel pool I/O ---
+    async def aload(self, ukeys: Iterable[str]) -> None:
+        """Porta in cache i profili mancanti (una sola lettura nel pool I/O)."""
+        missing = [k for k in dict.fromkeys(ukeys) if k not in self.rows]
+        if not missing:
+            return
+        self.misses += len(missing)
+        found = await run_io(lambda: self.store.get_many(missing))
+        for k in missing:
+            # se nel frattempo qualcuno l'ha caricato/scritto, vince la versione in memoria
+            if k not in self.rows:
+                self.rows[k] = found.get(k)
+
+    async def aget(self, ukey: str) -> Optional[Dict[str, Any]]:
+        if ukey in self.rows:
+            self.hits += 1
+            return self.rows[ukey]
+        await self.aload([ukey])
+        return self.rows.get(ukey)
+
+    async def aget_fields_many(self, ukeys: Iterable[str], paths: Sequence[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        keys = list(ukeys)
+        missing = [k for k in keys if k not in self.rows]
+        found = {}
+        if missing:
+            self.projected += len(missing)
+            found = await run_io(lambda: self.store.get_fields_many(missing, paths))
+        out = self.get_fields_many([k for k in keys if k in self.rows], paths)
+        for k in missing:
+            if k not in out:
+                out[k] = found.get(k)
+        return out
+
+    def get(self, ukey: str) -> Optional[Dict[str, Any]]:
+        if ukey in self.rows:
+            self.hits += 1
+            return self.rows[ukey]
+        self.misses += 1
+        prof = self.store.get(ukey)
+        self.rows[ukey] = prof  # anche None: evita di richiedere di nuovo un utente che non c'è
+        return prof
+
+    def get_many(self, ukeys: Iterable[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Come get() per più utenti: i mancanti in cache vengono letti dallo store in un colpo solo."""
+        keys = list(ukeys)
+        missing = [k for k in keys if k not in self.rows]
+        self.hits += len(keys) - len(missing)
+        if missing:
+            self.misses += len(missing)
+            found = self.store.get_many(missing)
+            for k in missing:
+                self.rows[k] = found.get(k)
+        return {k: self.rows[k] for k in keys}
+
+    def get_fields_many(self, ukeys: Iterable[str], paths: Sequence[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Profili parziali (solo `paths`) SENZA default. Chi è in cache viene proiettato dalla memoria,
+        gli altri vengono chiesti allo store con la proiezione già applicata (niente documento intero,
+        e la cache non si riempie di profili letti solo a metà).
+        """
+        keys = list(ukeys)
+        out: Dict[str, Optional[Dict[str, Any]]] = {}
+        missing = []
+        for k in keys:
+            if k in self.rows:
+                row = self.rows[k]
+                out[k] = None if row is None else _project(ProfileView(row, _EMPTY), paths)
+            else:
+                missing.append(k)
+        self.hits += len(keys) - len(missing)
+        if missing:
+            self.projected += len(missing)
+            found = self.store.get_fields_many(missing, paths)
+            for k in missing:
+                out[k] = found.get(k)
+        return out
+
+    def put(self, ukey: str, prof: Dict[str, Any]) -> None:
+        self.rows[ukey] = prof
+        self.revs[ukey] = self.revs.get(ukey, 0) + 1
+        self.dirty.add(ukey)
+        self.writes += 1
+        self._reindex(ukey, prof)
+        self._schedule_flush()
+
+    # --- indici secondari ---
+    def _reindex(self, ukey: str, prof: Optional[Dict[str, Any]]) -> None:
+        if self.index is not None:
+            self.index.update(ukey, prof)
+
+    def _index_from_store(self) -> ProfileIndex:
+        # gira nel pool I/O: scansione completa dello store, UNA volta per processo
+        idx = ProfileIndex()
+        for ukey, prof in self.store.iter_all():
+            idx.update(ukey, prof)
+        return idx
+
+    def _install_index(self, idx: ProfileIndex) -> ProfileIndex:
+        # la cache è più recente dello store (profili dirty non ancora salvati): vince lei
+        for ukey, prof in list(self.rows.items()):
+            idx.update(ukey, prof)
+        if self.index is None:
+            self.index = idx
+        return self.index
+
+    def ensure_index(self) -> ProfileIndex:
+        if self.index is None:
+            self._install_index(self._index_from_store())
+        return self.index
+
+    async def aensure_index(self) -> ProfileIndex:
+        if self.index is not None:
+            return self.index
+        if self._index_task is None:
+            async def build() -> ProfileIndex:
+                try:
+                    return self._install_index(await run_io(self._index_from_store))
+                finally:
+                    self._index_task = None
+            self._index_task = asyncio.get_running_loop().create_task(build())
+        return await asyncio.shield(self._index_task)
+
+    def commit(self, rows: Dict[str, Dict[str, Any]], patches: Optional[Dict[str, Dict[str, Any]]] = None) -> None:
+        """
+        Scrive SUBITO nello store in una sola transazione e solo dopo aggiorna la cache:
+        se lo store fallisce, la cache resta com'era (tutto o niente).
+        `rows` sono profili interi, `patches` patch da fondere lato store (utenti non in cache).
+        """
+        patches = patches or {}
+        t0 = time.perf_counter()
+        self.store.write_batch(rows, patches)
+        ms = (time.perf_counter() - t0) * 1000
+        self.rows.update(rows)
+        self.dirty.difference_update(rows)
+        for k, row in rows.items():
+            self._reindex(k, row)
+        for k, patch in patches.items():
+            if self.rows.get(k) is not None:
+                self.rows[k] = _deep_merge(self.rows[k], patch)
+                if index_keys_touched(patch):  # es. il solo bank.saldo non cambia gli indici
+                    self._reindex(k, self.rows[k])
+            else:
+                self.rows.pop(k, None)  # era cache negativa: ora il profilo esiste
+                if (self.index is not None or self._index_task is not None) and index_keys_touched(patch):
+                    # fuso lato store: per l'indice serve il profilo risultante
+                    # (anche a indice in costruzione: la scansione potrebbe non vederlo)
+                    self.rows[k] = self.store.get(k)
+                    self._reindex(k, self.rows[k])
+        for k in (*rows, *patches):
+            self.revs[k] = self.revs.get(k, 0) + 1
+        self.writes += len(rows) + len(patches)
+        self.flushes += 1
+        self.flushed_rows += len(rows) + len(patches)
+        self.flush_ms_last = ms
+        self.flush_ms_total += ms
+        self.flush_ms_max = max(self.flush_ms_max, ms)
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is not None:
+            return  # c'è già un flush in coda: questa scrittura ci finisce dentro
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # fuori dal bot (script, REPL): salva subito
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(FLUSH_DELAY_SECONDS, self._flush_in_background)
+
+    def _flush_in_background(self) -> None:
+        self._flush_handle = None
+        self._flush_task = asyncio.get_running_loop().create_task(self.aflush())
+
+    def _take_dirty(self) -> Dict[str, Dict[str, Any]]:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        return {k: self.rows[k] for k in self.dirty}
+
+    def _flushed(self, rows: Dict[str, Dict[str, Any]], ms: float) -> None:
+        # tolgo dai dirty solo i profili NON riscritti mentre il flush era in corso
+        for k, row in rows.items():
+            if self.rows.get(k) is row:
+                self.dirty.discard(k)
+        self.flushes += 1
+        self.flushed_rows += len(rows)
+        self.flush_ms_last = ms
+        self.flush_ms_total += ms
+        self.flush_ms_max = max(self.flush_ms_max, ms)
+
+    def flush(self) -> int:
+        """Scrive su disco (bloccante) se ci sono modifiche pendenti. Ritorna il n° di profili salvati."""
+        rows = self._take_dirty()
+        if not rows:
+            return 0
+        t0 = time.perf_counter()
+        try:
+            self.store.put_many(rows)
+        except Exception:
+            log.exception("❌ Flush profili fallito (%s profili in sospeso)", len(rows))
+            return 0
+        self._flushed(rows, (time.perf_counter() - t0) * 1000)
+        return len(rows)
+
+    def close(self) -> None:
+        """
+        Flush finale e chiusura dello store. Store, indice e oggetti legati all'event loop vengono
+        dimenticati: dopo un riavvio del runner (main.py) si riaprono/ricreano al primo uso.
+        """
+        self.flush()
+        with self._store_lock:
+            store, self._store = self._store, None
+        if store is not None:
+            store.close()
+        self.index = None
+        self._index_task = None
+        self._flush_lock = None
+        self._flush_handle = None
+        self._flush_task = None
+
+    async def aflush(self) -> int:
+        """Come flush(), ma la scrittura avviene nel pool I/O. I flush async sono serializzati."""
+        if self._flush_lock is None:
+            self._flush_lock = asyncio.Lock()
+        async with self._flush_lock:
+            rows = self._take_dirty()
+            if not rows:
+                return 0
+            t0 = time.perf_counter()
+            try:
+                await run_io(self.store.put_many, rows)
+            except Exception:
+                log.exception("❌ Flush profili fallito (%s profili in sospeso)", len(rows))
+                return 0
+            self._flushed(rows, (time.perf_counter() - t0) * 1000)
+            return len(rows)
+
+    def stats(self) -> Dict[str, Any]:
+        reads = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / reads) if reads else 0.0,
+            "projected_reads": self.projected,
+            "backend": BACKEND,
+            "cached": len(self.rows),
+            "indexed": len(self.index) if self.index is not None else None,
+            "writes": self.writes,
+            "pending": len(self.dirty),
+            "flushes": self.flushes,
+            "flushed_rows": self.flushed_rows,
+            # scritture assorbite dal coalescing: write che non sono diventate una riga scritta
+            # (né lo diventeranno: le righe in sospeso verranno scritte al prossimo flush)
+            "coalesced_writes": max(0, self.writes - self.flushed_rows - len(self.dirty)),
+            "flush_ms_last": round(self.flush_ms_last, 3),
+            "flush_ms_avg": round(self.flush_ms_total / self.flushes, 3) if self.flushes else 0.0,
+            "flush_ms_max": round(self.flush_ms_max, 3),
+        }
+
+def _open_store():
+    if BACKEND in ("journal", "json"):
+        store = JournalProfileStore(DB_FILE, merge=_deep_merge, journal_path=JOURNAL_FILE)
+    else:
+        store = SqliteProfileStore(SQLITE_FILE)
+    # schema canonico: importa i vecchi JSON (profile_data < profili.json) e normalizza gli alias
+    migrate(store, (PROFILE_DATA_FILE, DB_FILE), merge=_deep_merge)
+    return store
+
+_cache = _ProfileCache()
+
+def flush() -> int:
+    """Forza il salvataggio delle modifiche pendenti (da chiamare allo shutdown)."""
+    return _cache.flush()
+
+def close() -> None:
+    """Flush finale e chiusura dello store (attende un'eventuale compattazione in corso)."""
+    _cache.close()
+
+def iter_all_profiles():
+    """(user_id, profilo salvato) per tutti i profili dello store, senza default (bloccante: pool I/O)."""
+    yield from _cache.store.iter_all()
+
+async def aflush() -> int:
+    """Salva le modifiche pendenti senza bloccare l'event loop."""
+    return await _cache.aflush()
+
+def cache_stats() -> Dict[str, Any]:
+    """Contatori della cache profili (hit/miss, latenza dei flush, ecc.)."""
+    return _cache.stats()
+
+atexit.register(flush)
+
+# ---------- Default profilo (template unico, immutabile) ----------
+# default consigliati (usati nei tuoi embed)
+_DEFAULTS = {
+    "wallet": 0.0,     # deprecato: i saldi stanno in utils/accounts (ledger)
+    "bank": {
+        "iban": "",
+        "saldo": 0.0,  # deprecato, come "wallet"
+    },
+    "nome_rp": "",
+    "cognome_rp": "",
+    "data_nascita": "",
+    "stato_civile": "",
+    "famiglia": "",
+    "cittadinanza": "",
+    "identity_card": "",
+    "docs": {
+        "cittadinanza": {
+            "stato": False,
+            "numero": "",
+            "rilasciata_il": "",
+            "rilasciata_da": "",
+            "note": ""
         },
-        "fazioni": [],
-        "patenti_extra": [],
-        "proprieta": {
-            "case": [],
-            "veicoli": [],   # es. [{"modello":"...", "targa":"..."}, ...]
-            "aziende": []
+        "patenti": {
+            "A": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""},
+            "B": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""},
+            "C": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""},
+            "NAUTICA": {"stato": False, "numero": "", "rilasciata_il": "", "scadenza": ""}
         },
-        "lavoro": "",      # o "lavoro_rp" se preferisci, nei tuoi embed leggi "lavoro"
-        "riconoscimenti": [],
-        "bio": "",
-        "roblox": "",
-        "social": "",
-    }
+        # ✅ porto d’armi va qui, non dentro "patenti"
+        "porto_armi": {
+            "stato": False,
+            "numero": "",
+            "rilasciata_il": "",
+            "scadenza": "",
+            "rilasciata_da": "",
+            "tipo": "",
+            "note": ""
+        }
+    },
+    "fazioni": [],
+    "patenti_extra": [],
+    "proprieta": {
+        "case": [],
+        "veicoli": [],   # es. [{"modello":"...", "targa":"..."}, ...]
+        "aziende": []
+    },
+    "lavoro": "",      # (i vecchi "lavoro_rp" vengono migrati qui, vedi utils/profili_schema)
+    "riconoscimenti": [],
+    "bio": "",
+    "roblox": "",
+    "social": "",
+}
+
+def _freeze(obj: Any) -> Any:
+    if isinstance(obj, dict):
+        return MappingProxyType({k: _freeze(v) for k, v in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(v) for v in obj)
+    return obj
+
+def _thaw(obj: Any) -> Any:
+    if isinstance(obj, Mapping):
+        return {k: _thaw(v) for k, v in obj.items()}
+    if isinstance(obj, tuple):
+        return [_thaw(v) for v in obj]
+    return obj
+
+PROFILE_DEFAULTS: Mapping[str, Any] = _freeze(_DEFAULTS)
+del _DEFAULTS
+_EMPTY: Mapping[str, Any] = MappingProxyType({})
+_MISSING = object()
+
+# ---------- Vista in sola lettura ----------
+class ProfileView(Mapping):
+    """
+    Profilo in sola lettura: sovrappone i dati salvati al template PROFILE_DEFAULTS
+    senza copiare niente (stessa semantica di _deep_merge: i dict si fondono chiave per chiave,
+    un valore None lascia il default). I sotto-dict sono a loro volta ProfileView.
+    Per un dict modificabile usa .to_dict() (o get_profile()).
+    """
+    __slots__ = ("_data", "_defaults")
+
+    def __init__(self, data: Optional[Mapping[str, Any]], defaults: Mapping[str, Any] = PROFILE_DEFAULTS):
+        self._data = data if data is not None else _EMPTY
+        self._defaults = defaults
+
+    def __getitem__(self, key: str) -> Any:
+        default = self._defaults.get(key, _MISSING)
+        value = self._data.get(key)
+        if value is None:
+            if default is not _MISSING:
+                return ProfileView(None, default) if isinstance(default, Mapping) else default
+            if key in self._data:
+                return None
+            raise KeyError(key)
+        if isinstance(value, Mapping):
+            return ProfileView(value, default if isinstance(default, Mapping) else _EMPTY)
+        return value
 
-    return _deep_merge(defaults, prof)
+    def __iter__(self):
+        yield from self._defaults
+        for k in self._data:
+            if k not in self._defaults:
+                yield k
+
+    def __len__(self) -> int:
+        return len(self._defaults) + sum(1 for k in self._data if k not in self._defaults)
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._defaults or key in self._data
+
+    def __repr__(self) -> str:
+        return f"ProfileView({self.to_dict()!r})"
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Materializza il profilo in un dict nuovo e modificabile."""
+        return _deep_merge(_thaw(self._defaults), copy.deepcopy(dict(self._data)))
+
+def _project(view: ProfileView, paths: Iterable[str]) -> Dict[str, Any]:
+    """Materializza solo i percorsi puntati richiesti ("wallet", "bank.saldo", ...)."""
+    out: Dict[str, Any] = {}
+    for path in paths:
+        parts = split_path(path)
+        cur: Any = view
+        for k in parts:
+            if not isinstance(cur, Mapping) or k not in cur:
+                break
+            cur = cur[k]
+        else:
+            if parts:
+                set_path(out, parts, cur.to_dict() if isinstance(cur, ProfileView) else _thaw(cur))
+    return out
+
+# ---------- API principali ----------
+# campi del profilo letti dalla sezione banca (per get_profile(..., fields=BANK_FIELDS));
+# i saldi NON stanno più nel profilo: vedi utils/accounts
+BANK_FIELDS = ("bank.iban",)
+
+def get_profile_view(user_id: int) -> ProfileView:
+    """Profilo in sola lettura, servito direttamente dalla cache (nessuna copia): per i renderer."""
+    return ProfileView(_cache.get(str(user_id)))
+
+def get_profile(user_id: int, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Ritorna il profilo utente con default sensati (dict nuovo, modificabile).
+    Con `fields=["wallet", "bank.saldo"]` ritorna solo quei campi (stessa forma annidata),
+    senza caricare/materializzare il resto del documento.
+    """
+    if fields is None:
+        return get_profile_view(user_id).to_dict()
+    part = _cache.get_fields_many([str(user_id)], fields)[str(user_id)]
+    return _project(ProfileView(part), fields)
 
 def set_profile(user_id: int, **patch: Any) -> Dict[str, Any]:
     """
     Applica un patch al profilo (merge ricorsivo) e salva.
     Uso: set_profile(uid, bank={"saldo": 123}, wallet=50)
     """
-    db = _load_db()
     ukey = str(user_id)
-    cur = (db.get("profiles") or {}).get(ukey) or {}
-    new_prof = _deep_merge(cur, patch)
-    db.setdefault("profiles", {})[ukey] = new_prof
-    _save_db(db)
-    return new_prof
+    cur = _cache.get(ukey) or {}
+    new_prof = _deep_merge(cur, copy.deepcopy(normalize_patch(patch)))
+    _cache.put(ukey, new_prof)
+    return copy.deepcopy(new_prof)
 
 # Alias comodo se preferisci passare un dict già pronto
 def upsert_profile(user_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
     return set_profile(user_id, **payload)
 
+# ---------- API async (da usare nelle coroutine: niente I/O sull'event loop) ----------
+async def aget_profile_view(user_id: int) -> ProfileView:
+    return ProfileView(await _cache.aget(str(user_id)))
+
+async def aget_profile(user_id: int, fields: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    if fields is None:
+        return (await aget_profile_view(user_id)).to_dict()
+    part = (await _cache.aget_fields_many([str(user_id)], fields))[str(user_id)]
+    return _project(ProfileView(part), fields)
+
+async def aset_profile(user_id: int, **patch: Any) -> Dict[str, Any]:
+    await _cache.aload([str(user_id)])
+    return set_profile(user_id, **patch)
+
+async def aupsert_profile(user_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
+    return await aset_profile(user_id, **payload)
+
+# ---------- Concorrenza: lock per utente + compare-and-set ----------
+# Un lock per utente, tenuto in vita solo da chi lo sta usando/aspettando:
+# la memoria resta proporzionale agli utenti con operazioni IN CORSO, non a tutti quelli visti.
+# I lock sono del loop corrente: dopo un riavvio del runner (main.py, nuovo asyncio.run) si ricreano.
+_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_locks_loop: Optional[asyncio.AbstractEventLoop] = None
+
+# tentativi di update_profile se il profilo cambia sotto i piedi (scrittura fuori dal lock)
+UPDATE_MAX_RETRIES = 5
+
+def profile_lock(user_id: int) -> asyncio.Lock:
+    """Lock asyncio dedicato all'utente (`async with profile_lock(uid): ...`)."""
+    global _locks_loop
+    loop = asyncio.get_running_loop()
+    if _locks_loop is not loop:
+        _locks.clear()
+        _locks_loop = loop
+    ukey = str(user_id)
+    lock = _locks.get(ukey)
+    if lock is None:
+        lock = asyncio.Lock()
+        _locks[ukey] = lock
+    return lock
+
+def profile_revision(user_id: int) -> int:
+    """Revisione attuale del profilo (0 = mai scritto da questo processo)."""
+    return _cache.revs.get(str(user_id), 0)
+
+def compare_and_set_profile(user_id: int, expected_rev: int, **patch: Any) -> bool:
+    """Applica il patch solo se il profilo è ancora alla revisione `expected_rev`. True se applicato."""
+    if profile_revision(user_id) != expected_rev:
+        return False
+    set_profile(user_id, **patch)
+    return True
+
+ProfileUpdate = Callable[[ProfileView], Union[Optional[Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]]
+
+async def update_profile(
+    user_id: int,
+    fn: ProfileUpdate,
+    fields: Optional[Sequence[str]] = None,
+) -> Dict[str, Any]:
+    """
+    Read-modify-write atomico di un profilo: `fn(profilo) -> patch` (sync o async).
+    - serializza le operazioni sullo STESSO utente (lock per utente, nessun lock globale)
+    - se il profilo cambia mentre `fn` è in attesa (es. payroll), rilegge e riprova (compare-and-set)
+    - le eccezioni di `fn` (es. ValueError "fondi insufficienti") annullano l'operazione e risalgono
+    Ritorna il patch applicato ({} se `fn` non ha cambiato nulla).
+    """
+    async with profile_lock(user_id):
+        for _ in range(UPDATE_MAX_RETRIES):
+            rev = profile_revision(user_id)
+            if fields:
+                prof = ProfileView(await aget_profile(user_id, fields=fields))
+            else:
+                prof = await aget_profile_view(user_id)
+            patch = fn(prof)
+            if inspect.isawaitable(patch):
+                patch = await patch
+            if not patch:
+                return {}
+            await _cache.aload([str(user_id)])  # la scrittura non deve leggere dallo store sul loop
+            if compare_and_set_profile(user_id, rev, **patch):
+                return patch
+        raise RuntimeError(f"Profilo {user_id} modificato di continuo: aggiornamento annullato")
+
+# ---------- Aggiornamenti in blocco ----------
+ProfilePatch = Union[Dict[str, Any], Callable[[Mapping[str, Any]], Optional[Dict[str, Any]]]]
+
+def bulk_update_profiles(
+    patches: Mapping[int, ProfilePatch],
+    fields: Optional[Sequence[str]] = None,
+) -> Dict[int, Dict[str, Any]]:
+    """
+    Applica molti patch con una sola lettura e UN solo commit atomico (riconciliazione, sync ruoli, tasse...).
+
+    `patches` è {user_id: patch}, dove patch è:
+    - un dict (come i kwargs di set_profile), oppure
+    - una funzione f(ProfileView) -> dict | None, per patch che dipendono dal valore attuale
+      (None = nessuna modifica)
+
+    Con `fields` le funzioni ricevono solo quei campi (letti con proiezione dallo store) e,
+    per gli utenti non in cache, il patch viene fuso direttamente dallo store: il resto
+    del profilo non viene mai letto né riscritto in Python.
+
+    Ritorna {user_id: {"ok": True, "patch": {...}}} oppure {"ok": False, "error": "..."} per utente.
+    Un errore su un utente non blocca gli altri; se il commit fallisce l'eccezione risale e
+    non viene applicato nulla.
+    """
+    ukeys = [str(uid) for uid in patches]
+    if fields is None:
+        current = _cache.get_many(ukeys)
+    else:
+        current = _cache.get_fields_many(ukeys, fields)
+    results, staged, staged_patches = _stage_patches(patches, current, pushdown=fields is not None)
+    if staged or staged_patches:
+        _cache.commit(staged, staged_patches)
+    return results
+
+async def abulk_update_profiles(patches: Mapping[int, ProfilePatch]) -> Dict[int, Dict[str, Any]]:
+    """
+    Variante async di bulk_update_profiles: lettura e commit (una transazione) avvengono nel pool I/O.
+    I nuovi profili entrano in cache PRIMA della scrittura, quindi chi legge nel frattempo
+    vede già i valori aggiornati; se la scrittura fallisce restano "dirty" e ritenta il flush.
+    """
+    await _cache.aload(str(uid) for uid in patches)
+    current = {str(uid): _cache.rows.get(str(uid)) for uid in patches}
+    results, staged, _ = _stage_patches(patches, current, pushdown=False)
+    applied = {str(uid): r["patch"] for uid, r in results.items() if r["ok"]}
+    for ukey, row in staged.items():
+        _cache.rows[ukey] = row
+        _cache.revs[ukey] = _cache.revs.get(ukey, 0) + 1
+        _cache.dirty.add(ukey)
+        if index_keys_touched(applied.get(ukey) or {}):
+            _cache._reindex(ukey, row)
+    _cache.writes += len(staged)
+    if staged:
+        await _cache.aflush()
+    return results
+
+def _stage_patches(
+    patches: Mapping[int, ProfilePatch],
+    current: Mapping[str, Optional[Dict[str, Any]]],
+    pushdown: bool,
+):
+    """Calcola i nuovi profili (o i patch da fondere lato store, se `pushdown`) senza scrivere nulla."""
+    results: Dict[int, Dict[str, Any]] = {}
+    staged: Dict[str, Dict[str, Any]] = {}
+    staged_patches: Dict[str, Dict[str, Any]] = {}
+    for uid, patch in patches.items():
+        ukey = str(uid)
+        cur = current.get(ukey) or {}
+        try:
+            if callable(patch):
+                patch = patch(ProfileView(cur))
+            if not patch:
+                results[uid] = {"ok": True, "patch": {}}
+                continue
+            if not isinstance(patch, dict):
+                raise TypeError(f"patch non valido: {type(patch).__name__}")
+            patch = copy.deepcopy(normalize_patch(patch))
+            if pushdown and ukey not in _cache.rows:
+                staged_patches[ukey] = patch
+            else:
+                base = _cache.rows.get(ukey) if pushdown else cur
+                staged[ukey] = _deep_merge(base or {}, patch)
+            results[uid] = {"ok": True, "patch": patch}
+        except Exception as e:
+            results[uid] = {"ok": False, "error": str(e) or type(e).__name__}
+    return results, staged, staged_patches
+
+# ---------- Ricerche inverse (indici secondari) ----------
+# Un indice per campo: valore normalizzato -> utenti. La prima ricerca costruisce gli indici
+# con una scansione dello store (nel pool I/O), poi ogni scrittura li aggiorna in O(campi cambiati).
+# Le ricerche sono lookup in dict: O(1) indipendentemente dal numero di profili.
+
+def _ids(ukeys: Iterable[str]) -> list:
+    return sorted(int(k) for k in ukeys if k.isdigit())
+
+def find_profiles(index: str, value: Any) -> list:
+    """User id con `value` nell'indice `index` ("iban", "identity_card", "docs", "targa", "fazione", "lavoro")."""
+    return _ids(_cache.ensure_index().lookup(index, value))
+
+async def afind_profiles(index: str, value: Any) -> list:
+    return _ids((await _cache.aensure_index()).lookup(index, value))
+
+async def afind_by_iban(iban: str) -> list:
+    """TUTTI i titolari dell'IBAN: più di uno è una collisione (da risolvere, vedi /iban_rilascia)."""
+    return await afind_profiles("iban", iban)
+
+async def afind_by_document(numero: str) -> list:
+    """Carta d'identità oppure numero di un documento (cittadinanza, patenti, porto d'armi)."""
+    idx = await _cache.aensure_index()
+    return _ids(idx.lookup("identity_card", numero) | idx.lookup("docs", numero))
+
+async def afind_by_plate(targa: str) -> list:
+    return await afind_profiles("targa", targa)
+
+async def afind_by_faction(fazione: str) -> list:
+    return await afind_profiles("fazione", fazione)
+
+async def afind_by_job(lavoro: str) -> list:
+    return await afind_profiles("lavoro", lavoro)
+
+async def aindex_values(index: str) -> Dict[str, int]:
+    """Valori presenti in un indice con il n° di profili (es. fazioni esistenti, per l'autocomplete)."""
+    return (await _cache.aensure_index()).values(index)
+
+# ---------- IBAN in blocco ----------
+def _plan_ibans() -> Dict[str, Any]:
+    # gira nel pool I/O: UNA passata sullo store per IBAN in uso, collisioni e profili senza IBAN
+    owners: Dict[str, list] = {}
+    missing: list = []
+    invalid = 0
+    for ukey, prof in _cache.store.iter_all():
+        if not ukey.isdigit():
+            continue
+        iban = normalize_iban((prof.get("bank") or {}).get("iban"))
+        if not iban:
+            missing.append(int(ukey))
+            continue
+        owners.setdefault(iban, []).append(int(ukey))
+        if not validate_iban(iban):
+            invalid += 1
+    taken = set(owners)
+    return {
+        "issue": issue_ibans(sorted(missing), taken),
+        "existing": len(owners),
+        "invalid": invalid,
+        "collisions": {iban: uids for iban, uids in owners.items() if len(uids) > 1},
+    }
+
+async def abackfill_ibans() -> Dict[str, Any]:
+    """
+    Rilascia un IBAN a ogni profilo che non ce l'ha, in una passata e con UN commit.
+    Ritorna {"issued", "existing", "invalid", "collisions": {iban: [user_id, ...]}}.
+    """
+    await aflush()  # lo store deve avere anche le ultime scritture in cache
+    plan = await run_io(_plan_ibans)
+
+    def patch(iban: str):
+        # se nel frattempo l'utente ha ricevuto un IBAN, non lo si tocca
+        return lambda prof: None if (prof.get("bank") or {}).get("iban") else {"bank": {"iban": iban}}
+
+    results = await abulk_update_profiles({uid: patch(iban) for uid, iban in plan.pop("issue").items()})
+    plan["issued"] = sum(1 for r in results.values() if r["ok"] and r["patch"])
+    if plan["collisions"]:
+        log.warning("IBAN condivisi da più profili: %s", plan["collisions"])
+    return plan
+
 # ---------- Utility di formattazione ----------
 def money_fmt(value: Any) -> str:
     try:
@@ -0,0 +1,135 @@
+# utils/profili_index.py
+"""
+Indici secondari sui profili (ricerche inverse per lo staff).
+
+Per ogni indice: valore normalizzato -> insieme di user id, più la mappa inversa
+utente -> valori attuali, così ogni scrittura aggiorna solo le voci di quell'utente.
+"""
+from __future__ import annotations
+from typing import Any, Callable, Dict, Iterable, Iterator, Mapping, Set, Tuple
+
+
+def _norm_code(v: Any) -> str:
+    """IBAN, targhe, numeri documento: maiuscolo e senza spazi."""
+    return "".join(str(v).split()).upper()
+
+def _norm_name(v: Any) -> str:
+    """Fazioni, lavori: confronto case-insensitive."""
+    return " ".join(str(v).split()).casefold()
+
+
+# ---------- estrattori (profilo salvato -> valori indicizzati) ----------
+def _iban(prof: Mapping[str, Any]) -> Iterator[Any]:
+    bank = prof.get("bank")
+    if isinstance(bank, Mapping):
+        yield bank.get("iban")
+
+def _identity_card(prof: Mapping[str, Any]) -> Iterator[Any]:
+    yield prof.get("identity_card")
+
+def _doc_numbers(node: Any) -> Iterator[Any]:
+    # docs.cittadinanza.numero, docs.porto_armi.numero, docs.patenti.<X>.numero, ...
+    if isinstance(node, Mapping):
+        for k, v in node.items():
+            if k == "numero":
+                yield v
+            else:
+                yield from _doc_numbers(v)
+
+def _docs(prof: Mapping[str, Any]) -> Iterator[Any]:
+    yield from _doc_numbers(prof.get("docs"))
+
+def _plates(prof: Mapping[str, Any]) -> Iterator[Any]:
+    pr = prof.get("proprieta")
+    for v in (pr.get("veicoli") or []) if isinstance(pr, Mapping) else []:
+        if isinstance(v, Mapping):
+            yield v.get("targa")
+
+def _factions(prof: Mapping[str, Any]) -> Iterator[Any]:
+    fz = prof.get("fazioni")
+    if isinstance(fz, (list, tuple)):
+        yield from fz
+
+def _job(prof: Mapping[str, Any]) -> Iterator[Any]:
+    yield prof.get("lavoro")
+
+
+# nome indice -> (estrattore, normalizzazione, chiavi top-level da cui dipende)
+INDEXES: Dict[str, Tuple[Callable[[Mapping[str, Any]], Iterable[Any]], Callable[[Any], str], Tuple[str, ...]]] = {
+    "iban":          (_iban,          _norm_code, ("bank",)),
+    "identity_card": (_identity_card, _norm_code, ("identity_card",)),
+    "docs":          (_docs,          _norm_code, ("docs",)),
+    "targa":         (_plates,        _norm_code, ("proprieta",)),
+    "fazione":       (_factions,      _norm_name, ("fazioni",)),
+    "lavoro":        (_job,           _norm_name, ("lavoro",)),
+}
+
+# valori che non vale la pena indicizzare (segnaposto usati nei profili)
+_SKIP = {"", "-", "—", "NESSUNO", "nessuno"}
+
+
+def index_keys_touched(patch: Mapping[str, Any]) -> bool:
+    """True se il patch può cambiare un valore indicizzato (es. non vale per il solo bank.saldo)."""
+    for _name, (_fn, _norm, deps) in INDEXES.items():
+        for k in deps:
+            if k not in patch:
+                continue
+            if k == "bank" and isinstance(patch[k], Mapping) and "iban" not in patch[k]:
+                continue
+            return True
+    return False
+
+
+class ProfileIndex:
+    def __init__(self) -> None:
+        self._by_value: Dict[str, Dict[str, Set[str]]] = {name: {} for name in INDEXES}
+        self._by_user: Dict[str, Dict[str, Set[str]]] = {}
+
+    @staticmethod
+    def _values(prof: Mapping[str, Any]) -> Dict[str, Set[str]]:
+        out: Dict[str, Set[str]] = {}
+        for name, (fn, norm, _deps) in INDEXES.items():
+            vals = set()
+            for v in fn(prof):
+                if v is None or isinstance(v, (Mapping, list, tuple)):
+                    continue
+                n = norm(v)
+                if n and n not in _SKIP:
+                    vals.add(n)
+            if vals:
+                out[name] = vals
+        return out
+
+    def update(self, ukey: str, prof: Mapping[str, Any] | None) -> None:
+        """(Re)indicizza un utente: tocca solo le voci che sono cambiate."""
+        new = self._values(prof) if prof else {}
+        old = self._by_user.get(ukey) or {}
+        for name in INDEXES:
+            before = old.get(name) or set()
+            after = new.get(name) or set()
+            if before == after:
+                continue
+            bucket = self._by_value[name]
+            for v in before - after:
+                users = bucket.get(v)
+                if users is not None:
+                    users.discard(ukey)
+                    if not users:
+                        del bucket[v]
+            for v in after - before:
+                bucket.setdefault(v, set()).add(ukey)
+        if new:
+            self._by_user[ukey] = new
+        else:
+            self._by_user.pop(ukey, None)
+
+    def lookup(self, name: str, value: Any) -> Set[str]:
+        _fn, norm, _deps = INDEXES[name]
+        return set(self._by_value[name].get(norm(value), ()))
+
+    def values(self, name: str) -> Dict[str, int]:
+        """Valori presenti in un indice con il numero di utenti (es. elenco fazioni)."""
+        return {v: len(users) for v, users in self._by_value[name].items()}
+
+    def __len__(self) -> int:
+        return len(self._by_user)
@@ -0,0 +1,250 @@
+# utils/profili_schema.py
+"""
+Schema versionato dei profili + migrazione dai vecchi formati.
+
+Versioni:
+- 1: formati legacy (profile_data.json e profili.json con record al top-level e/o in "profiles",
+     alias "lavoro_rp" e "iban" al top-level)
+- 2: formato canonico: un solo campo per dato ("lavoro", "bank.iban"), uno store unico
+
+La migrazione legge i file legacy in streaming (un record alla volta, a blocchi da
+CHUNK_SIZE byte): la memoria usata dipende dal record più grande, non dalla dimensione del file.
+"""
+from __future__ import annotations
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+SCHEMA_VERSION = 2
+SCHEMA_META_KEY = "schema_version"
+LEGACY_IMPORT_KEY = "legacy_import_done"
+
+CHUNK_SIZE = 64 * 1024
+MIGRATION_BATCH = 500
+
+# alias legacy -> percorso canonico
+FIELD_ALIASES: Dict[str, Tuple[str, ...]] = {
+    "lavoro_rp": ("lavoro",),
+    "iban": ("bank", "iban"),
+}
+
+
+# ---------- Normalizzazione ----------
+def _empty(v: Any) -> bool:
+    return v is None or v == ""
+
+def normalize_profile(prof: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Profilo nello schema canonico (dict nuovo se qualcosa cambia, altrimenti lo stesso oggetto).
+    Il campo canonico vince sull'alias; l'alias viene usato solo se il canonico è vuoto.
+    """
+    if not any(a in prof for a in FIELD_ALIASES):
+        return prof
+    out = dict(prof)
+    for alias, path in FIELD_ALIASES.items():
+        if alias not in out:
+            continue
+        value = out.pop(alias)
+        parent = out
+        for k in path[:-1]:
+            nxt = parent.get(k)
+            nxt = dict(nxt) if isinstance(nxt, dict) else {}
+            parent[k] = nxt
+            parent = nxt
+        if _empty(parent.get(path[-1])) and not _empty(value):
+            parent[path[-1]] = value
+        elif path[-1] not in parent:
+            parent[path[-1]] = value if value is not None else ""
+    return out
+
+def normalize_patch(patch: Dict[str, Any]) -> Dict[str, Any]:
+    """Come normalize_profile, ma per un patch: l'alias scritto oggi SOVRASCRIVE il canonico."""
+    if not any(a in patch for a in FIELD_ALIASES):
+        return patch
+    out = dict(patch)
+    for alias, path in FIELD_ALIASES.items():
+        if alias not in out:
+            continue
+        value = out.pop(alias)
+        parent = out
+        for k in path[:-1]:
+            nxt = parent.get(k)
+            nxt = dict(nxt) if isinstance(nxt, dict) else {}
+            parent[k] = nxt
+            parent = nxt
+        parent.setdefault(path[-1], value)
+    return out
+
+
+# ---------- Parser JSON in streaming ----------
+class _StreamReader:
+    """Legge un documento JSON a blocchi e decodifica un valore alla volta (json.raw_decode)."""
+
+    _WS = " \t\r\n"
+
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self._f = f
+        self._chunk = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._dec = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self._eof:
+            return False
+        data = self._f.read(self._chunk)
+        if not data:
+            self._eof = True
+            return False
+        self._buf = self._buf[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Prossimo carattere non-spazio ("" a fine file), senza consumarlo."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in self._WS:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str) -> None:
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"JSON non valido: atteso {ch!r}, trovato {got!r}")
+        self._pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                obj, end = self._dec.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # un numero/letterale a fine buffer potrebbe continuare nel blocco successivo
+            if end == len(self._buf) and not self._eof and self._fill():
+                continue
+            self._pos = end
+            return obj
+
+    def members(self) -> Iterator[str]:
+        """Chiavi di un oggetto JSON: dopo ogni chiave il chiamante DEVE consumare il valore."""
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            sep = self.peek()
+            self._pos += 1
+            if sep == "}":
+                return
+            if sep != ",":
+                raise ValueError(f"JSON non valido: atteso ',' o '}}', trovato {sep!r}")
+
+
+def iter_legacy_records(path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[Tuple[str, Dict[str, Any], int]]:
+    """
+    (user_id, profilo, priorità) per ogni record di un file legacy, in streaming.
+    I record dentro "profiles" hanno priorità 1 (scritti dal bot più di recente),
+    quelli al top-level priorità 0.
+    """
+    if not path.exists():
+        return
+    with path.open("r", encoding="utf-8") as f:
+        r = _StreamReader(f, chunk_size)
+        if r.peek() != "{":
+            return
+        for key in r.members():
+            if key == "profiles" and r.peek() == "{":
+                for ukey in r.members():
+                    rec = r.value()
+                    if isinstance(rec, dict):
+                        yield str(ukey), rec, 1
+            elif key.isdigit() and r.peek() == "{":
+                yield key, r.value(), 0
+            else:
+                r.value()  # journal_seq, meta, ...: non sono profili
+
+
+# ---------- Migrazione ----------
+def migrate(store, legacy_paths: Sequence[Path], merge: Callable[[Any, Any], Any]) -> Dict[str, int]:
+    """
+    Porta `store` allo schema SCHEMA_VERSION (idempotente, da chiamare all'apertura dello store):
+    1. importa UNA volta i file legacy (in ordine di precedenza crescente) senza sovrascrivere
+       i profili già presenti nello store
+    2. normalizza i profili già nello store
+    Ritorna i contatori {"imported": n, "normalized": n}.
+    """
+    stats = {"imported": 0, "normalized": 0}
+    current = int(store.get_meta(SCHEMA_META_KEY) or 1)
+    if current >= SCHEMA_VERSION:
+        return stats
+    t0 = time.perf_counter()
+    if not store.get_meta(LEGACY_IMPORT_KEY):
+        stats["imported"] = _import_legacy(store, legacy_paths, merge)
+        store.set_meta(LEGACY_IMPORT_KEY, str(time.time()))
+    batch: Dict[str, Dict[str, Any]] = {}
+    for ukey, prof in store.iter_all():
+        norm = normalize_profile(prof)
+        if norm is not prof:
+            batch[ukey] = norm
+            if len(batch) >= MIGRATION_BATCH:
+                store.put_many(batch)
+                stats["normalized"] += len(batch)
+                batch = {}
+    if batch:
+        store.put_many(batch)
+        stats["normalized"] += len(batch)
+    store.set_meta(SCHEMA_META_KEY, str(SCHEMA_VERSION))
+    log.info(
+        "✅ Profili migrati allo schema v%s: %s importati, %s normalizzati (%.0f ms)",
+        SCHEMA_VERSION, stats["imported"], stats["normalized"], (time.perf_counter() - t0) * 1000,
+    )
+    return stats
+
+def _import_legacy(store, paths: Sequence[Path], merge: Callable[[Any, Any], Any]) -> int:
+    # rank per utente importato: (indice file, priorità nel file). Solo gli id, non i profili.
+    ranks: Dict[str, Tuple[int, int]] = {}
+    imported = 0
+    pending: list = []
+
+    def apply(records: list) -> int:
+        existing = store.get_many(k for k, _, _ in records)
+        rows: Dict[str, Dict[str, Any]] = {}
+        for ukey, prof, rank in records:
+            cur: Optional[Dict[str, Any]] = rows.get(ukey, existing.get(ukey))
+            if cur is not None and ukey not in ranks:
+                continue  # profilo già nello store (scritto dal bot): non si tocca
+            prof = normalize_profile(prof)
+            if cur is None:
+                new = prof
+            elif rank >= ranks[ukey]:
+                new = merge(cur, prof)
+            else:
+                new = merge(prof, cur)
+            rows[ukey] = new
+            ranks[ukey] = max(rank, ranks.get(ukey, rank))
+        store.put_many(rows)
+        return sum(1 for k in rows if k not in existing)
+
+    for i, path in enumerate(paths):
+        for ukey, prof, prio in iter_legacy_records(path):
+            pending.append((ukey, prof, (i, prio)))
+            if len(pending) >= MIGRATION_BATCH:
+                imported += apply(pending)
+                pending = []
+    if pending:
+        imported += apply(pending)
+    return imported
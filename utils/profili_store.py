@@ -0,0 +1,437 @@
+# utils/profili_store.py
+"""
+Backend di persistenza dei profili usati da utils/profili.py.
+
+Ogni store espone la stessa interfaccia minima:
+- get(ukey)            -> profilo salvato (dict) oppure None
+- get_many([ukey])     -> {ukey: profilo} per quelli presenti
+- get_fields_many([ukey], ["bank.saldo", ...])
+                       -> {ukey: profilo parziale} con SOLO i campi richiesti (proiezione lato store)
+- put_many({ukey: p})  -> salva più profili in UNA transazione
+- write_batch(rows, patches)
+                       -> come put_many, più patch (merge ricorsivo) applicati senza rileggere il profilo
+- iter_all()           -> (ukey, profilo) per tutti i profili
+- get_meta(k) / set_meta(k, v)
+                       -> metadati dello store (versione dello schema, migrazioni fatte, ...)
+- close()
+"""
+from __future__ import annotations
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+log = logging.getLogger(__name__)
+
+
+# ---------- Percorsi puntati ("bank.saldo") ----------
+def split_path(path: str) -> List[str]:
+    return [p for p in path.split(".") if p]
+
+def set_path(out: Dict[str, Any], parts: Sequence[str], value: Any) -> None:
+    for k in parts[:-1]:
+        nxt = out.get(k)
+        if not isinstance(nxt, dict):
+            nxt = out[k] = {}
+        out = nxt
+    out[parts[-1]] = value
+
+def project(src: Any, paths: Iterable[str]) -> Dict[str, Any]:
+    """Copia da `src` (dict annidato) solo i percorsi richiesti; quelli assenti vengono saltati."""
+    out: Dict[str, Any] = {}
+    for path in paths:
+        parts = split_path(path)
+        cur = src
+        for k in parts:
+            if not isinstance(cur, dict) or cur.get(k) is None:
+                break
+            cur = cur[k]
+        else:
+            if parts:
+                set_path(out, parts, cur)
+    return out
+
+def strip_none(patch: Dict[str, Any]) -> Dict[str, Any]:
+    """Toglie i None (= "non toccare" per set_profile) prima di un merge-patch lato store."""
+    return {k: (strip_none(v) if isinstance(v, dict) else v) for k, v in patch.items() if v is not None}
+
+
+# ---------- JSON + journal (snapshot + write-ahead log) ----------
+_MISSING = object()
+
+def merge_diff(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Patch minimo che, fuso (merge ricorsivo) su `old`, dà `new`.
+    None se non è esprimibile come merge (chiavi rimosse o valori messi a None).
+    """
+    out: Dict[str, Any] = {}
+    for k, v in new.items():
+        o = old.get(k, _MISSING)
+        if o == v:
+            continue
+        if v is None:
+            return None
+        if isinstance(v, dict) and isinstance(o, dict):
+            d = merge_diff(o, v)
+            if d is None:
+                return None
+            out[k] = d
+        else:
+            out[k] = v
+    if any(k not in new for k in old):
+        return None
+    return out
+
+def _fsync_dir(path: Path) -> None:
+    try:
+        fd = os.open(str(path), os.O_RDONLY)
+    except OSError:
+        return  # es. Windows: niente fsync sulle cartelle
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+class JournalProfileStore:
+    """
+    Profili in JSON con journal write-ahead:
+    - `path` (data/profili.json) è lo snapshot: {"profiles": {...}, "journal_seq": N, "meta": {...}}
+    - ogni commit aggiunge UNA riga al journal (patch minimi per utente) + fsync:
+      il costo è proporzionale alla modifica, non al numero di profili
+    - una riga troncata da un crash viene scartata per intero (il commit è tutto o niente)
+    - quando il journal supera `compact_bytes` un thread in background ripiega tutto in un
+      nuovo snapshot (file temporaneo + fsync + rename atomico) e riparte con un journal vuoto
+    - all'avvio si legge lo snapshot e si riapplica solo la coda del journal (seq > journal_seq)
+    """
+    def __init__(
+        self,
+        path: Path,
+        merge: Callable[[Any, Any], Any],
+        journal_path: Optional[Path] = None,
+        compact_bytes: int = 4 * 1024 * 1024,
+    ):
+        self.path = path
+        self.journal_path = journal_path or path.with_name(path.stem + ".journal.jsonl")
+        self._merge = merge
+        self.compact_bytes = compact_bytes
+        # può essere usato dai thread del pool I/O
+        self._lock = threading.RLock()
+        self._profiles: Optional[Dict[str, Dict[str, Any]]] = None
+        self._extra: Dict[str, Any] = {}   # altre chiavi top-level dello snapshot (conservate)
+        self._seq = 0
+        self._journal_bytes = 0
+        self._journal = None
+        self._tail: Optional[List[str]] = None  # righe scritte mentre una compattazione è in corso
+        self._compactor: Optional[threading.Thread] = None
+
+    # --- avvio: snapshot + replay ---
+    def _load(self) -> Dict[str, Dict[str, Any]]:
+        if self._profiles is not None:
+            return self._profiles
+        raw: Dict[str, Any] = {}
+        if self.path.exists():
+            try:
+                raw = json.loads(self.path.read_text(encoding="utf-8"))
+            except Exception:
+                raw = {}
+        profiles = raw.pop("profiles", None) or {}
+        self._seq = int(raw.pop("journal_seq", 0) or 0)
+        # record legacy al top-level ({uid: {...}}): li importa la migrazione (utils/profili_schema),
+        # lo snapshot successivo non li riporta
+        self._extra = {k: v for k, v in raw.items() if not k.isdigit()}
+        self._extra["meta"] = dict(self._extra.get("meta") or {})
+        replayed = 0
+        if self.journal_path.exists():
+            valid = 0
+            with self.journal_path.open("rb") as f:
+                for line in f:
+                    try:
+                        if not line.endswith(b"\n"):
+                            raise ValueError("riga incompleta")
+                        rec = json.loads(line)
+                    except Exception:
+                        break  # riga troncata (crash durante la scrittura): fine del journal valido
+                    valid += len(line)
+                    if rec.get("seq", 0) <= self._seq:
+                        continue  # già dentro lo snapshot
+                    self._apply(profiles, rec.get("ops") or [])
+                    self._seq = rec["seq"]
+                    replayed += 1
+            if valid < self.journal_path.stat().st_size:
+                # via la coda corrotta, altrimenti i prossimi commit finirebbero dopo di lei
+                log.warning("Journal profili: scartata una riga incompleta in coda")
+                with self.journal_path.open("r+b") as f:
+                    f.truncate(valid)
+            self._journal_bytes = valid
+        self._profiles = profiles
+        if replayed:
+            log.info("Journal profili: riapplicati %s commit (seq %s)", replayed, self._seq)
+        return profiles
+
+    def _apply(self, profiles: Dict[str, Dict[str, Any]], ops: List[Dict[str, Any]]) -> None:
+        for op in ops:
+            if "m" in op:
+                self._extra["meta"].update(op["m"])
+                continue
+            ukey = op["u"]
+            if "r" in op:
+                profiles[ukey] = op["r"]
+            else:
+                profiles[ukey] = self._merge(profiles.get(ukey) or {}, op.get("p") or {})
+
+    # --- letture ---
+    def get(self, ukey: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            return self._load().get(ukey)
+
+    def get_many(self, ukeys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            profiles = self._load()
+            return {k: profiles[k] for k in ukeys if k in profiles}
+
+    def get_fields_many(self, ukeys: Iterable[str], paths: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        return {k: project(v, paths) for k, v in self.get_many(ukeys).items()}
+
+    def iter_all(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            items = list(self._load().items())
+        yield from items
+
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            self._load()
+            return self._extra["meta"].get(key)
+
+    # --- scritture ---
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._load()
+            self._commit([{"m": {key: value}}])
+
+    def put_many(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        self.write_batch(rows, {})
+
+    def write_batch(self, rows: Dict[str, Dict[str, Any]], patches: Dict[str, Dict[str, Any]]) -> None:
+        if not rows and not patches:
+            return
+        with self._lock:
+            profiles = self._load()
+            ops: List[Dict[str, Any]] = []
+            for ukey, row in rows.items():
+                diff = merge_diff(profiles.get(ukey) or {}, row)
+                if diff is None:
+                    ops.append({"u": ukey, "r": row})
+                elif diff:
+                    ops.append({"u": ukey, "p": diff})
+            for ukey, patch in patches.items():
+                ops.append({"u": ukey, "p": patch})
+            if ops:
+                self._commit(ops)
+
+    def _commit(self, ops: List[Dict[str, Any]]) -> None:
+        # chiamato con self._lock preso e lo snapshot già caricato
+        profiles = self._profiles
+        rec = {"seq": self._seq + 1, "t": time.time(), "ops": ops}
+        line = json.dumps(rec, ensure_ascii=False) + "\n"
+        # prima il journal su disco, poi la memoria (write-ahead)
+        if self._journal is None:
+            self._journal = self.journal_path.open("a", encoding="utf-8")
+        self._journal.write(line)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._seq += 1
+        self._journal_bytes += len(line.encode("utf-8"))
+        if self._tail is not None:
+            self._tail.append(line)
+        self._apply(profiles, ops)
+        if self._journal_bytes >= self.compact_bytes and self._compactor is None:
+            self._compactor = threading.Thread(target=self.compact, name="profili-compactor", daemon=True)
+            self._compactor.start()
+
+    # --- compattazione ---
+    def compact(self) -> None:
+        """Ripiega il journal in un nuovo snapshot. Le scritture possono continuare nel frattempo."""
+        try:
+            with self._lock:
+                profiles = dict(self._load())  # i profili non vengono mai modificati in place
+                snap_seq = self._seq
+                extra = {**self._extra, "meta": dict(self._extra["meta"])}
+                self._tail = []
+            snap = {**extra, "journal_seq": snap_seq, "profiles": profiles}
+            tmp = self.path.with_name(self.path.name + ".tmp")
+            with tmp.open("w", encoding="utf-8") as f:
+                json.dump(snap, f, ensure_ascii=False, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+            _fsync_dir(self.path.parent)
+            with self._lock:
+                # nuovo journal = solo i commit arrivati durante la compattazione
+                tail = self._tail or []
+                jtmp = self.journal_path.with_name(self.journal_path.name + ".tmp")
+                with jtmp.open("w", encoding="utf-8") as f:
+                    f.writelines(tail)
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                os.replace(jtmp, self.journal_path)
+                _fsync_dir(self.journal_path.parent)
+                self._journal_bytes = sum(len(x.encode("utf-8")) for x in tail)
+                log.info("Journal profili compattato (snapshot seq %s, %s commit in coda)", snap_seq, len(tail))
+        except Exception:
+            log.exception("❌ Compattazione journal profili fallita")
+        finally:
+            with self._lock:
+                self._tail = None
+                self._compactor = None
+
+    def close(self) -> None:
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+
+# ---------- SQLite (una riga per utente) ----------
+class SqliteProfileStore:
+    """
+    Una riga per utente (JSON nella colonna `data`), DB in WAL.
+    Salvare un profilo aggiorna solo la sua riga: il costo non dipende dal numero di utenti.
+    """
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles ("
+            " user_id TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+
+    # --- meta ---
+    def get_meta(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    # --- profili ---
+    def get(self, ukey: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT data FROM profiles WHERE user_id = ?", (ukey,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_many(self, ukeys: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        keys = list(ukeys)
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            # a blocchi: SQLite limita il numero di parametri per query
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                for ukey, data in self._conn.execute(
+                    f"SELECT user_id, data FROM profiles WHERE user_id IN ({marks})", chunk
+                ):
+                    out[ukey] = json.loads(data)
+        return out
+
+    def get_fields_many(self, ukeys: Iterable[str], paths: Sequence[str]) -> Dict[str, Dict[str, Any]]:
+        """Proiezione fatta da SQLite (json_extract): il resto del documento non viene decodificato."""
+        keys = list(ukeys)
+        split = [split_path(p) for p in paths]
+        split = [p for p in split if p]
+        cols = ", ".join(
+            "json_quote(json_extract(data, ?))" for _ in split
+        )
+        json_paths = ["$." + ".".join(json.dumps(k) for k in parts) for parts in split]
+        out: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                sql = f"SELECT user_id{', ' + cols if cols else ''} FROM profiles WHERE user_id IN ({marks})"
+                for row in self._conn.execute(sql, [*json_paths, *chunk]):
+                    prof: Dict[str, Any] = {}
+                    for parts, raw in zip(split, row[1:]):
+                        value = json.loads(raw) if raw is not None else None
+                        if value is not None:
+                            set_path(prof, parts, value)
+                    out[row[0]] = prof
+        return out
+
+    def put_many(self, rows: Dict[str, Dict[str, Any]]) -> None:
+        self.write_batch(rows, {})
+
+    def write_batch(self, rows: Dict[str, Dict[str, Any]], patches: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Una sola transazione: `rows` sostituisce il profilo intero, `patches` viene fuso nel JSON
+        salvato direttamente da SQLite (json_patch), senza leggere il profilo in Python.
+        """
+        if not rows and not patches:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO profiles (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    [(k, json.dumps(v, ensure_ascii=False), now) for k, v in rows.items()],
+                )
+                self._conn.executemany(
+                    "INSERT INTO profiles (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = json_patch(profiles.data, excluded.data), "
+                    "updated_at = excluded.updated_at",
+                    [(k, json.dumps(strip_none(v), ensure_ascii=False), now) for k, v in patches.items()],
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def iter_all(self, batch: int = 500) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        # a pagine (keyset sulla PK): memoria costante e lock non tenuto tra una pagina e l'altra
+        last = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT user_id, data FROM profiles WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                    (last, batch),
+                ).fetchall()
+            if not rows:
+                return
+            for ukey, data in rows:
+                yield ukey, json.loads(data)
+            last = rows[-1][0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM profiles").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
@@ -0,0 +1,269 @@
+# utils/scheduler.py
+"""
+Scheduler persistente per i lavori ricorrenti dell'economia (stipendi, e in futuro tasse, interessi...).
+
+- per ogni lavoro e gilda si salva l'ULTIMO ciclo completato (data/scheduler.json), non la data
+  in memoria: un riavvio non fa ripartire un ciclo già fatto
+- niente polling: si dorme fino all'istante esatto della prossima scadenza (o finché un lavoro
+  viene aggiunto/tolto)
+- all'avvio i cicli scaduti mentre il bot era spento vengono eseguiti, ognuno una volta sola,
+  dal più vecchio (al massimo `max_catch_up` per lavoro)
+- un ciclo è segnato come completato solo se il lavoro termina senza eccezioni
+
+Un ciclo ha un id stabile (es. "2026-10" per un lavoro mensile): è anche la chiave con cui il
+lavoro può rendersi idempotente (es. la chiave del ledger per il payroll).
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.async_io import read_json_sync, run_io, write_json_sync
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = Path("data/scheduler.json")
+
+# la prima volta che un lavoro vede una gilda, un ciclo scaduto da meno di così viene eseguito;
+# quelli più vecchi si considerano già fatti (niente stipendi arretrati al primo avvio)
+INITIAL_GRACE = timedelta(days=1)
+# sonno massimo: ogni tanto si ricalcola comunque (orologio di sistema cambiato, sospensione...)
+MAX_SLEEP_SECONDS = 6 * 3600
+
+
+# ---------- Calendari ----------
+class Monthly:
+    """Un ciclo al mese: id "AAAA-MM", scadenza il giorno `day` alle hour:minute UTC."""
+
+    def __init__(self, day: int = 1, hour: int = 0, minute: int = 0):
+        if not 1 <= day <= 28:
+            raise ValueError("day deve essere tra 1 e 28")
+        self.day, self.hour, self.minute = day, hour, minute
+
+    def due(self, cycle: str) -> datetime:
+        y, m = map(int, cycle.split("-"))
+        return datetime(y, m, self.day, self.hour, self.minute, tzinfo=timezone.utc)
+
+    def cycle_at(self, dt: datetime) -> str:
+        """Ultimo ciclo con scadenza <= dt."""
+        c = f"{dt.year:04d}-{dt.month:02d}"
+        return c if self.due(c) <= dt else self.prev(c)
+
+    def next(self, cycle: str) -> str:
+        y, m = map(int, cycle.split("-"))
+        return f"{y + m // 12:04d}-{m % 12 + 1:02d}"
+
+    def prev(self, cycle: str) -> str:
+        y, m = map(int, cycle.split("-"))
+        return f"{y - (m == 1):04d}-{(m - 2) % 12 + 1:02d}"
+
+    def __repr__(self) -> str:
+        return f"mensile (giorno {self.day}, {self.hour:02d}:{self.minute:02d} UTC)"
+
+
+class Daily:
+    """Un ciclo al giorno: id "AAAA-MM-GG", scadenza alle hour:minute UTC."""
+
+    def __init__(self, hour: int = 0, minute: int = 0):
+        self.hour, self.minute = hour, minute
+
+    def due(self, cycle: str) -> datetime:
+        d = datetime.strptime(cycle, "%Y-%m-%d")
+        return d.replace(hour=self.hour, minute=self.minute, tzinfo=timezone.utc)
+
+    def cycle_at(self, dt: datetime) -> str:
+        c = dt.strftime("%Y-%m-%d")
+        return c if self.due(c) <= dt else self.prev(c)
+
+    def next(self, cycle: str) -> str:
+        return (datetime.strptime(cycle, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+    def prev(self, cycle: str) -> str:
+        return (datetime.strptime(cycle, "%Y-%m-%d") - timedelta(days=1)).strftime("%Y-%m-%d")
+
+    def __repr__(self) -> str:
+        return f"giornaliero ({self.hour:02d}:{self.minute:02d} UTC)"
+
+
+# ---------- Scheduler ----------
+JobFn = Callable[[str, int], Awaitable[Any]]   # (ciclo, guild_id) -> risultato (salvato nello stato)
+
+
+class _Job:
+    def __init__(self, name: str, schedule: Any, run: JobFn, targets: Callable[[], Iterable[int]], max_catch_up: int):
+        self.name = name
+        self.schedule = schedule
+        self.run = run
+        self.targets = targets
+        self.max_catch_up = max_catch_up
+
+
+class Scheduler:
+    def __init__(self, path: Path = STATE_FILE):
+        self.path = path
+        self._jobs: Dict[str, _Job] = {}
+        self._state: Optional[Dict[str, Dict[str, Dict[str, Any]]]] = None  # job -> gilda -> stato
+        # evento e task appartengono al loop in cui sono nati: dopo un riavvio del runner
+        # (main.py, nuovo asyncio.run) si ricreano, vedi _bind()
+        self._loop_ref: Optional[asyncio.AbstractEventLoop] = None
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.running: Optional[Tuple[str, int, str]] = None  # (lavoro, gilda, ciclo) in esecuzione
+        self.failures = 0  # esecuzioni fallite consecutive (backoff)
+
+    # --- registrazione ---
+    def add_job(
+        self,
+        name: str,
+        schedule: Any,
+        run: JobFn,
+        targets: Callable[[], Iterable[int]],
+        max_catch_up: int = 12,
+    ) -> None:
+        """Registra (o sostituisce) un lavoro ricorrente; `targets` ritorna le gilde su cui eseguirlo."""
+        self._jobs[name] = _Job(name, schedule, run, targets, max_catch_up)
+        loop = self._bind()
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._loop(), name="scheduler")
+        self._wake.set()
+
+    def remove_job(self, name: str) -> None:
+        self._jobs.pop(name, None)
+        self._bind()
+        self._wake.set()
+
+    @property
+    def jobs(self) -> List[str]:
+        return list(self._jobs)
+
+    def _bind(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if self._loop_ref is not loop:
+            # il task del loop precedente è morto con lui
+            self._loop_ref = loop
+            self._wake = asyncio.Event()
+            self._task = None
+        return loop
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is None or self._loop_ref is not asyncio.get_running_loop():
+            return
+        # su 3.11 wait_for può "perdere" una cancellazione se l'evento scatta nello stesso giro
+        # (remove_job + stop): si insiste finché il task non è davvero finito
+        while not task.done():
+            task.cancel()
+            await asyncio.wait({task}, timeout=1.0)
+
+    # --- stato ---
+    async def _load(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        if self._state is None:
+            self._state = await run_io(read_json_sync, self.path, {}) or {}
+        return self._state
+
+    def _last(self, job: _Job, guild_id: int, now: datetime) -> str:
+        st = (self._state or {}).get(job.name, {}).get(str(guild_id))
+        if st and st.get("last_cycle"):
+            return st["last_cycle"]
+        current = job.schedule.cycle_at(now)
+        if now - job.schedule.due(current) <= INITIAL_GRACE:
+            return job.schedule.prev(current)
+        return current
+
+    def pending(self, job: _Job, guild_id: int, now: datetime) -> List[str]:
+        """Cicli scaduti e non ancora completati, dal più vecchio."""
+        out = []
+        c = job.schedule.next(self._last(job, guild_id, now))
+        while job.schedule.due(c) <= now:
+            out.append(c)
+            c = job.schedule.next(c)
+        return out[-job.max_catch_up:]
+
+    def next_due(self, job: _Job, guild_id: int, now: datetime) -> datetime:
+        return job.schedule.due(job.schedule.next(self._last(job, guild_id, now)))
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Per ogni lavoro e gilda: ultimo ciclo completato, prossima scadenza, ultimo esito."""
+        now = datetime.now(timezone.utc)
+        out = []
+        for job in self._jobs.values():
+            for gid in job.targets():
+                st = (self._state or {}).get(job.name, {}).get(str(gid)) or {}
+                out.append({
+                    "job": job.name, "guild_id": gid, "schedule": repr(job.schedule),
+                    "last_cycle": st.get("last_cycle"), "last_run": st.get("t"), "result": st.get("result"),
+                    "next_due": self.next_due(job, gid, now),
+                    "pending": self.pending(job, gid, now),
+                })
+        return out
+
+    async def _complete(self, job: _Job, guild_id: int, cycle: str, result: Any) -> None:
+        state = await self._load()
+        state.setdefault(job.name, {})[str(guild_id)] = {"last_cycle": cycle, "t": time.time(), "result": result}
+        await run_io(write_json_sync, self.path, state)
+
+    # --- esecuzione ---
+    async def run_pending(self) -> int:
+        """Esegue tutti i cicli scaduti (recuperi compresi). Ritorna quanti ne ha completati."""
+        state = await self._load()
+        done = failed = 0
+        for job in list(self._jobs.values()):
+            for gid in list(job.targets()):
+                if str(gid) not in state.get(job.name, {}):
+                    # prima volta: il punto di partenza si fissa subito, non a ogni sveglia
+                    baseline = self._last(job, gid, datetime.now(timezone.utc))
+                    state.setdefault(job.name, {})[str(gid)] = {"last_cycle": baseline, "t": time.time(), "result": "baseline"}
+                    await run_io(write_json_sync, self.path, state)
+                for cycle in self.pending(job, gid, datetime.now(timezone.utc)):
+                    if self._jobs.get(job.name) is not job:
+                        break  # lavoro rimosso/sostituito nel frattempo
+                    self.running = (job.name, gid, cycle)
+                    try:
+                        result = await job.run(cycle, gid)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception:
+                        log.exception("❌ Scheduler: %s su %s (ciclo %s) fallito, verrà ritentato", job.name, gid, cycle)
+                        failed += 1
+                        break  # i cicli successivi aspettano: si recupera in ordine
+                    finally:
+                        self.running = None
+                    await self._complete(job, gid, cycle, result)
+                    log.info("✅ Scheduler: %s su %s, ciclo %s completato", job.name, gid, cycle)
+                    done += 1
+        self.failures = self.failures + 1 if failed else 0
+        return done
+
+    async def _loop(self) -> None:
+        while self._jobs:
+            self._wake.clear()
+            try:
+                await self.run_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failures += 1
+                log.exception("❌ Scheduler: errore nel ciclo principale")
+            now = datetime.now(timezone.utc)
+            if self.failures:
+                delay = 60 * min(self.failures, 30)  # cicli falliti: si ritenta con backoff (max 30 min)
+            else:
+                dues = [self.next_due(j, g, now) for j in self._jobs.values() for g in j.targets()]
+                delay = min(((d - now).total_seconds() for d in dues), default=MAX_SLEEP_SECONDS)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=min(max(delay, 0.0), MAX_SLEEP_SECONDS))
+            except asyncio.TimeoutError:
+                pass
+
+
+# ---------- Istanza di processo ----------
+_scheduler: Optional[Scheduler] = None
+
+def get_scheduler() -> Scheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = Scheduler()
+    return _scheduler
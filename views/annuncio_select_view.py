@@ -29,7 +29,7 @@ class AnnuncioSelect(ui.Select):
         elif tipo == "conferma":
             view = ConfermaView(interaction.message.id)
             state = {"tipo": "conferma", "confermati": []}
-            store.save(interaction.message.id, state)
+            await store.asave(interaction.message.id, state)
             embed = discord.Embed(title="📄 Conferma Richiesta", description="Premi **✅ Confermo** per confermare.", color=discord.Color.gold())
             return await interaction.response.send_message(embed=embed, view=view)
         elif tipo == "sondaggio":
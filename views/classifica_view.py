@@ -0,0 +1,62 @@
+# views/classifica_view.py
+from __future__ import annotations
+
+import discord
+from utils.leaderboard import Leaderboard
+from utils.ledger import from_cents
+from utils.profili import money_fmt
+
+MEDALS = {1: "🥇", 2: "🥈", 3: "🥉"}
+
+def build_classifica_embed(board: Leaderboard, guild: discord.Guild, viewer_id: int, page: int) -> discord.Embed:
+    # solo query sull'indice: nessun ordinamento, nessuna lettura dei profili
+    rows = board.page(guild.id, page)
+    e = discord.Embed(title=f"🏆 Classifica ricchezza — {guild.name}", color=discord.Color.gold())
+    if rows:
+        e.description = "\n".join(
+            f"{MEDALS.get(pos, f'`#{pos}`')} <@{uid}> — **{money_fmt(from_cents(cents))}**"
+            for pos, uid, cents in rows
+        )
+    else:
+        e.description = "ℹ️ Nessun cittadino con saldo positivo."
+    mine = board.rank(guild.id, viewer_id)
+    me = f"La tua posizione: #{mine[0]} ({money_fmt(from_cents(mine[1]))})" if mine else "Non sei in classifica"
+    e.set_footer(text=f"{me} • Pagina {page + 1}/{board.pages(guild.id)} • Portafoglio + conto")
+    return e
+
+
+class ClassificaView(discord.ui.View):
+    def __init__(self, board: Leaderboard, owner_id: int, guild: discord.Guild, page: int = 0):
+        super().__init__(timeout=180)
+        self.board = board
+        self.owner_id = owner_id
+        self.guild = guild
+        self.page = page
+        self._sync_buttons()
+
+    def _sync_buttons(self) -> None:
+        last = self.board.pages(self.guild.id) - 1
+        self.page = max(0, min(self.page, last))
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= last
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.owner_id:
+            await interaction.response.send_message("❌ Usa `/classifica` per sfogliare la tua copia.", ephemeral=True)
+            return False
+        return True
+
+    async def _show(self, interaction: discord.Interaction) -> None:
+        self._sync_buttons()
+        embed = build_classifica_embed(self.board, self.guild, self.owner_id, self.page)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def prev_page(self, interaction: discord.Interaction, _btn: discord.ui.Button):
+        self.page -= 1
+        await self._show(interaction)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, interaction: discord.Interaction, _btn: discord.ui.Button):
+        self.page += 1
+        await self._show(interaction)
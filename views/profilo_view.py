@@ -1,44 +1,20 @@
 # views/profilo_view.py
 from __future__ import annotations
-import json
-from pathlib import Path
 from datetime import datetime, timezone
 
 import discord
-from utils.profili import get_profile, money_fmt, mask_iban
+from utils import accounts, config_registry
+from utils.config_registry import Snapshot
+from utils.profili import BANK_FIELDS, ProfileView, aget_profile, aget_profile_view, money_fmt, mask_iban
 
-ROLES_FILE = Path("data/roles.json")
 
-def load_roles_map() -> dict:
-    if ROLES_FILE.exists():
-        try:
-            return json.loads(ROLES_FILE.read_text(encoding="utf-8"))
-        except Exception:
-            return {}
-    return {}
-
-def _ids(roles_map: dict, key: str) -> list[int]:
-    aliases = [key]
+def _ids(roles: Snapshot, key: str) -> frozenset[int]:
     if key == "sep_licenze":
-        aliases.append("licenze")
-    raw = None
-    for k in aliases:
-        raw = roles_map.get(k)
-        if raw:
-            break
-    if raw is None:
-        return []
-    if isinstance(raw, int):
-        raw = [raw]
-    out: list[int] = []
-    for x in raw:
-        try: out.append(int(x))
-        except: pass
-    return out
-
-def _roles_in(member: discord.Member, id_list: list[int]) -> list[discord.Role]:
-    s = set(id_list or [])
-    return [r for r in sorted(member.roles, key=lambda r: r.position, reverse=True) if r.id in s]
+        return roles.ids(key, "licenze")
+    return roles.ids(key)
+
+def _roles_in(member: discord.Member, ids: frozenset[int]) -> list[discord.Role]:
+    return [r for r in sorted(member.roles, key=lambda r: r.position, reverse=True) if r.id in ids]
 
 def _fmt_ts(dt: datetime | None) -> str:
     if not dt:
@@ -67,9 +43,15 @@ def _base(member: discord.Member, title: str) -> discord.Embed:
     e.set_thumbnail(url=member.display_avatar.url)
     return e
 
-def build_section_embed(member: discord.Member, section: str) -> discord.Embed:
-    prof  = get_profile(member.id)
-    roles = load_roles_map()
+async def build_section_embed(member: discord.Member, section: str) -> discord.Embed:
+    if section == "banca":
+        prof = await aget_profile(member.id, fields=BANK_FIELDS)
+    else:
+        prof = await aget_profile_view(member.id)
+    if section in ("banca", "tutto"):
+        # i saldi arrivano dal servizio conti, sovrapposti al profilo (che ha solo l'IBAN)
+        prof = ProfileView(await accounts.amoney(member.guild.id, member.id), prof)
+    roles = await config_registry.aget(config_registry.ROLES)
 
     bank  = prof.get("bank") or {}
     props = prof.get("proprieta") or {}
@@ -78,7 +60,7 @@ def build_section_embed(member: discord.Member, section: str) -> discord.Embed:
     if section == "banca":
         e = _base(member, f"🏦 Dati bancari — {member.display_name}")
         e.add_field(name="💳 Portafoglio", value=money_fmt(prof.get("wallet")), inline=True)
-        e.add_field(name="IBAN", value=mask_iban(bank.get("iban") or prof.get("iban")), inline=True)
+        e.add_field(name="IBAN", value=mask_iban(bank.get("iban")), inline=True)
         e.add_field(name="💰 Saldo conto", value=money_fmt(bank.get("saldo")), inline=True)
         return e
 
@@ -152,8 +134,8 @@ def build_section_embed(member: discord.Member, section: str) -> discord.Embed:
         e = _base(member, f"⚙️ Info Discord — {member.display_name}")
         e.add_field(name="Iscritto a Discord", value=_fmt_ts(member.created_at), inline=False)
         e.add_field(name="Entrato in server", value=_fmt_ts(member.joined_at), inline=False)
-        staff_ids = (load_roles_map().get("groups") or {}).get("staff", [])
-        staff_roles = [r for r in member.roles if r.id in (staff_ids or [])] or [r for r in member.roles if getattr(r.permissions, "manage_guild", False)]
+        staff_ids = roles.ids("groups.staff")
+        staff_roles = [r for r in member.roles if r.id in staff_ids] or [r for r in member.roles if getattr(r.permissions, "manage_guild", False)]
         if staff_roles:
             e.add_field(name="Staff", value=max(staff_roles, key=lambda r: r.position).mention, inline=False)
         return e
@@ -172,7 +154,7 @@ def build_section_embed(member: discord.Member, section: str) -> discord.Embed:
     pat_extra = ", ".join(prof.get("patenti_extra") or [])
     e.add_field(name="Patenti/Licenze", value=(pat_ruoli + (", " if pat_ruoli and pat_extra else "") + pat_extra) or "—", inline=False)
     e.add_field(name="Portafoglio", value=money_fmt(prof.get("wallet")), inline=True)
-    e.add_field(name="IBAN", value=mask_iban(bank.get("iban") or prof.get("iban")), inline=True)
+    e.add_field(name="IBAN", value=mask_iban(bank.get("iban")), inline=True)
     e.add_field(name="Saldo conto", value=money_fmt(bank.get("saldo")), inline=True)
     if props.get("case"):
         e.add_field(name="Case", value="\n".join(props["case"]), inline=False)
@@ -211,7 +193,7 @@ class ProfiloSelect(discord.ui.Select):
 
     async def callback(self, interaction: discord.Interaction):
         section = self.values[0]
-        embed   = build_section_embed(self.target, section)
+        embed   = await build_section_embed(self.target, section)
         # ✅ aggiorna lo STESSO messaggio (niente messaggi nuovi)
         await interaction.response.edit_message(embed=embed, view=self.view)
 
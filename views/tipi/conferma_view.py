@@ -8,8 +8,8 @@ class ConfermaView(ui.View):
         self.message_id = message_id
         self.state = state or {"tipo": "conferma", "confermati": []}
 
-    def _save(self):
-        store.save(self.message_id, self.state)
+    async def _save(self):
+        await store.asave(self.message_id, self.state)
 
     @ui.button(label="✅ Confermo", style=discord.ButtonStyle.success)
     async def b_confermo(self, interaction: discord.Interaction, button: ui.Button):
@@ -18,5 +18,5 @@ class ConfermaView(ui.View):
             return await interaction.response.send_message("Hai già confermato.", ephemeral=True)
 
         self.state["confermati"].append(uid)
-        self._save()
+        await self._save()
         await interaction.response.send_message("✅ Conferma registrata!", ephemeral=True)
\ No newline at end of file
@@ -27,8 +27,8 @@ class EventoView(ui.View):
         self._sync_labels()
 
     # ---- helpers ----
-    def _save(self):
-        store.save(self.message_id, self.state)
+    async def _save(self):
+        await store.asave(self.message_id, self.state)
 
     def _posti_restanti(self) -> str:
         m = int(self.state.get("max_posti", 0) or 0)
@@ -55,7 +55,7 @@ class EventoView(ui.View):
 
     async def _chiudi(self, interaction: discord.Interaction, reason: str | None = None):
         self.state["chiuso"] = True
-        self._save()
+        await self._save()
         for c in self.children:
             if c.custom_id not in {"evt:riapri","evt:export"}:
                 c.disabled = True
@@ -77,7 +77,7 @@ class EventoView(ui.View):
             return await interaction.response.send_message("Sei già iscritto!", ephemeral=True)
 
         self.state["iscritti"].append(uid)
-        self._save()
+        await self._save()
         self._sync_labels()
 
         # prima risposta: aggiorna messaggio
@@ -115,7 +115,7 @@ class EventoView(ui.View):
         if not _is_staff(interaction.user):
             return await interaction.response.send_message("Solo lo staff può riaprire.", ephemeral=True)
         self.state["chiuso"] = False
-        self._save()
+        await self._save()
         self._sync_labels()
         await interaction.response.edit_message(view=self)
         await interaction.response.send_message("🔓 Iscrizioni riaperte.", ephemeral=True)
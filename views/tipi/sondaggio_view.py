@@ -23,7 +23,7 @@ class SondaggioButton(ui.Button):
             if uid in v:
                 v.remove(uid)
         self.view_ref.state["voti"][self.opzione].append(uid)
-        store.save(self.view_ref.message_id, self.view_ref.state)
+        await store.asave(self.view_ref.message_id, self.view_ref.state)
 
         self.label = f"{self.opzione} ({len(self.view_ref.state['voti'][self.opzione])})"
 
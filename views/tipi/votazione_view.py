@@ -14,8 +14,8 @@ class VotazioneView(ui.View):
         self.b_no.label = f"❌ No ({len(self.state['no'])})"
         self.b_forse.label = f"🤔 Forse ({len(self.state['maybe'])})"
 
-    def _save(self):
-        store.save(self.message_id, self.state)
+    async def _save(self):
+        await store.asave(self.message_id, self.state)
 
     async def _vote(self, interaction: discord.Interaction, choice: str):
         uid = str(interaction.user.id)
@@ -23,7 +23,7 @@ class VotazioneView(ui.View):
             if uid in self.state[k]:
                 self.state[k].remove(uid)
         self.state[choice].append(uid)
-        self._save()
+        await self._save()
         self._sync_labels()
 
         # aggiorna messaggio → prima risposta